@@ -1,20 +1,57 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
-from pymongo import MongoClient
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity, get_jwt
 from bson import ObjectId
-from werkzeug.security import generate_password_hash, check_password_hash
+from data_export import iter_export, public_chat, public_feedback, INTERNAL_CHAT_FIELDS
+import chat_archive
+import chat_turns
+import fast_json
+import feedback_analytics
+import idempotency
+import llm_cassette
+import llm_deadlines
+import load_shedding
+import memory_edits
+import memory_windows
+import outbound_http
+import password_hashing
+import profile_claims
+import rate_limit
+import read_routing
+import related_chats
+import search_index
+import storage
+import usage_ledger
+from password_hashing import hash_password, verify_password, PasswordHasherBusy
 from datetime import timedelta, datetime, timezone
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
-from googleapiclient.discovery import build
 import re
+import threading
+import heapq
+import hashlib
+import itertools
+import json
+import math
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables from .env file (override system variables)
 load_dotenv(override=True)
 
+class APIJSONProvider(DefaultJSONProvider):
+    """jsonify with fast_json's formats, so every endpoint returns dates as ISO-8601 in UTC"""
+    
+    @staticmethod
+    def default(value):
+        try:
+            return fast_json.default(value)
+        except TypeError:
+            return DefaultJSONProvider.default(value)
+
 app = Flask(__name__)
+app.json = APIJSONProvider(app)
 
 # JWT configuration - require from .env for security
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
@@ -25,35 +62,223 @@ app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 
 jwt = JWTManager(app)
-CORS(app)
+CORS(app, expose_headers=[read_routing.TOKEN_HEADER, profile_claims.TOKEN_HEADER])
+
+class LazyClient:
+    """Builds an external client on first use instead of at import time.
+    
+    Attribute access is forwarded to the real client, so call sites use it
+    like the client itself. Creation is guarded by a lock, so concurrent
+    first requests build it only once.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+    
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+    
+    @property
+    def initialized(self):
+        return self._instance is not None
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
 
-# MongoDB connection
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client['webapp_db']
+# Document storage: MongoDB, or the embedded SQLite engine for single-node installs (see storage.py)
+STORAGE_BACKEND = storage.backend_name()
+client = storage.create_client(STORAGE_BACKEND)
+db = client[os.getenv('MONGODB_DB', 'webapp_db')]
 users_collection = db['users']
 chats_collection = db['chats']
 memories_collection = db['memories']
 personas_collection = db['personas']
 diary_collection = db['diary']
 feedback_collection = db['feedback']
+search_collection = db['search_index']
+idempotency_collection = db['idempotency_keys']
+analytics_collection = db['analytics_rollups']
+chats_archive_collection = db['chats_archive']
+usage_collection = db['usage_ledger']
+related_collection = db['related_chats']
+
+# Read preference per read class (see read_routing.py); list and context reads may be configured to use secondaries
+READ_PREFERENCES = read_routing.load_preferences()
+READ_ROUTING_ENABLED = storage.supports_sessions(STORAGE_BACKEND) and read_routing.routes_to_secondaries(READ_PREFERENCES)
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+_routed_collections = {}
+
+def routed(collection, read_class):
+    """`collection` with the read preference configured for `read_class`"""
+    key = (collection.name, read_class)
+    if key not in _routed_collections:
+        _routed_collections[key] = collection.with_options(read_preference=READ_PREFERENCES[read_class])
+    return _routed_collections[key]
+
+def fork_read_session():
+    """A separate causal session at the client's read-after token, for reads run on other threads.
+    
+    Sessions must not be shared between threads; the caller ends it.
+    """
+    if not READ_ROUTING_ENABLED:
+        return None
+    session = client.start_session(causal_consistency=True)
+    read_routing.apply_token(session, request.headers.get(read_routing.TOKEN_HEADER))
+    return session
+
+def read_session():
+    """The request's causally consistent session, advanced to the client's read-after token.
+    
+    None when reads are not routed to secondaries or outside a request.
+    """
+    if not READ_ROUTING_ENABLED or not has_request_context():
+        return None
+    if 'read_session' not in g:
+        session = client.start_session(causal_consistency=True)
+        read_routing.apply_token(session, request.headers.get(read_routing.TOKEN_HEADER))
+        g.read_session = session
+    return g.read_session
+
+# Ephemeral collections and the date field their TTL index expires documents on
+TTL_INDEXES = {
+    'idempotency_keys': 'expires_at',
+    'rate_limits': 'expires_at'
+}
+
+def ensure_ttl_indexes():
+    for collection_name, field in TTL_INDEXES.items():
+        db[collection_name].create_index(field, name=f'{field}_ttl', expireAfterSeconds=0)
+
+# Global memory categories stored on each memories document
+MEMORY_CATEGORIES = ['family_friends', 'favorites', 'opinions', 'skills', 'personality', 'health', 'others']
+# MEMORY_EXTRACTION=batched extracts memory per window of messages in extract_memories.py
+# (see memory_windows.py) instead of with two LLM calls on every user message
+MEMORY_EXTRACTION_BATCHED = os.getenv('MEMORY_EXTRACTION', 'per_message').lower() == 'batched'
 
 # OpenAI configuration
+# LLM_PROVIDER=fake swaps in an offline client (see fake_llm.py) for batch jobs and local runs,
+# LLM_PROVIDER=replay answers from recorded cassettes (see llm_cassette.py and replay_cassettes.py)
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'openai')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY environment variable is required")
-if not OPENAI_API_KEY.startswith('sk-'):
-    raise ValueError("OPENAI_API_KEY must be a valid OpenAI API key (starts with 'sk-')")
-
-openai = OpenAI(
-    api_key=OPENAI_API_KEY
+# Record every /api/chat turn with its LLM calls into this cassette file
+LLM_RECORD_PATH = os.getenv('LLM_RECORD_PATH')
+
+if LLM_PROVIDER not in ('fake', 'replay'):
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY environment variable is required")
+    if not OPENAI_API_KEY.startswith('sk-'):
+        raise ValueError("OPENAI_API_KEY must be a valid OpenAI API key (starts with 'sk-')")
+
+def create_openai_client():
+    if LLM_PROVIDER == 'replay':
+        return llm_cassette.ReplayOpenAI()
+    
+    if LLM_PROVIDER == 'fake':
+        from fake_llm import FakeOpenAI
+        llm_client = FakeOpenAI()
+    else:
+        from openai import OpenAI
+        # The SDK default is 10 minutes; no single call should hold a request that long
+        timeout = float(os.getenv('OPENAI_TIMEOUT_SECONDS', '30'))
+        llm_client = OpenAI(
+            api_key=OPENAI_API_KEY,
+            timeout=timeout,
+            # Shared keep-alive pool sized for our concurrency (see outbound_http.py)
+            http_client=outbound_http.openai_http_client(timeout)
+        )
+    
+    if LLM_RECORD_PATH:
+        return llm_cassette.RecordingOpenAI(llm_client, llm_cassette.Cassette(LLM_RECORD_PATH))
+    return llm_client
+
+openai = LazyClient(create_openai_client)
+
+# Overall time budget for one /api/chat turn, and how it is shared between pipeline stages
+CHAT_DEADLINE_SECONDS = float(os.getenv('CHAT_DEADLINE_SECONDS', '25'))
+CHAT_STAGE_SHARES = {'analysis': 0.3, 'strategy': 0.3, 'implementation': 0.4}
+CHAT_STAGES = ['analysis', 'strategy', 'implementation']
+# The single-call fallback always gets at least this long, even if the deadline has passed
+FALLBACK_MIN_SECONDS = float(os.getenv('CHAT_FALLBACK_MIN_SECONDS', '8'))
+# Turns on one chat run one at a time (see chat_turns.py); the lease outlives the turn deadline
+CHAT_TURN_SETTINGS = chat_turns.settings(CHAT_DEADLINE_SECONDS)
+
+# Service levels under load (see load_shedding.py); LOAD_SHEDDING=0 runs every turn at full level
+load_controller = load_shedding.LoadController(
+    max_in_flight=int(os.getenv('LOAD_MAX_IN_FLIGHT', '24')),
+    max_queue_wait=float(os.getenv('LOAD_MAX_QUEUE_WAIT_SECONDS', '1')),
+    max_llm_latency=float(os.getenv('LOAD_MAX_LLM_LATENCY_SECONDS', '8')),
+    recovery_seconds=float(os.getenv('LOAD_RECOVERY_SECONDS', '30')),
+    enabled=os.getenv('LOAD_SHEDDING', '1').lower() not in ('0', 'false', 'no')
 )
+# Pipeline latencies and executor waits also feed the load controller
+stage_latencies = llm_deadlines.LatencyTracker(listener=load_controller)
+
+def llm_stage_call(stage, timeout, **kwargs):
+    """One pipeline stage call with a hard timeout and optional hedging; usage goes to the turn's ledger"""
+    # No SDK retries here: the deadline and hedging decide whether to try again
+    create = openai.with_options(max_retries=0).chat.completions.create
+    started = datetime.now(timezone.utc)
+    turn = usage_ledger.current_turn()
+    
+    def record_abandoned(response):
+        # A lost hedge or a call past the deadline is billed all the same
+        usage_ledger.record(stage, response, kwargs.get('model'), turn=turn)
+    
+    response = llm_deadlines.call_with_deadline(create, stage, timeout, stage_latencies,
+                                                on_abandoned=record_abandoned, **kwargs)
+    
+    latency_ms = int((datetime.now(timezone.utc) - started).total_seconds() * 1000)
+    usage_ledger.record(stage, response, kwargs.get('model'), latency_ms)
+    return response
+
+# Daily token budgets per user (0 disables): past the soft budget turns use the
+# single-call pipeline, past the hard budget /api/chat is rejected until the next UTC day
+USAGE_SOFT_BUDGET_TOKENS = int(os.getenv('USAGE_SOFT_BUDGET_TOKENS', '0'))
+USAGE_HARD_BUDGET_TOKENS = int(os.getenv('USAGE_HARD_BUDGET_TOKENS', '0'))
 
 # YouTube API configuration
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
-if YOUTUBE_API_KEY:
-    youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
-else:
-    youtube = None
+
+# Trimmed copy of the YouTube v3 discovery document (search resource only), so
+# building the client never fetches or parses the full document
+YOUTUBE_DISCOVERY_DOC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery', 'youtube.v3.json')
+
+def create_youtube_client():
+    from googleapiclient.discovery import build_from_document
+    with open(YOUTUBE_DISCOVERY_DOC, encoding='utf-8') as f:
+        return build_from_document(f.read(), developerKey=YOUTUBE_API_KEY)
+
+youtube = LazyClient(create_youtube_client) if YOUTUBE_API_KEY else None
+# The service object is shared; its requests run on a per-thread httplib2 transport
+youtube_http = outbound_http.ThreadLocalHttp('youtube', timeout=float(os.getenv('YOUTUBE_TIMEOUT_SECONDS', '10')))
+
+def warm_up_clients():
+    """Build the external clients now instead of on the first request that needs them"""
+    openai.get()
+    if youtube:
+        youtube.get()
+
+if os.getenv('EAGER_CLIENT_INIT', '').lower() in ('1', 'true', 'yes'):
+    warm_up_clients()
+
+_instance_prepared = False
+_prepare_lock = threading.Lock()
+
+def prepare_instance():
+    """Build the clients and the TTL indexes once per process; later calls do nothing"""
+    global _instance_prepared
+    if _instance_prepared:
+        return
+    with _prepare_lock:
+        if not _instance_prepared:
+            warm_up_clients()
+            ensure_ttl_indexes()
+            _instance_prepared = True
 
 # Multi-level problem solving system prompts
 SYSTEM_PROMPTS = {
@@ -87,7 +312,9 @@ In line with persona characteristics:
 - Highlight potential challenges in advance
 - Provide tips for success
 
-IMPORTANT: Do not start your response with any introductory sentence. Go directly into explaining the implementation steps."""
+IMPORTANT: Do not start your response with any introductory sentence. Go directly into explaining the implementation steps.""",
+    
+    "fallback": "You are a helpful assistant. Provide practical solutions to the user's problems."
 }
 
 def search_youtube_video(query, max_results=1):
@@ -97,13 +324,13 @@ def search_youtube_video(query, max_results=1):
             return None
             
         # Search for videos
-        search_response = youtube.search().list(
+        search_response = youtube_http.execute(youtube.search().list(
             q=query,
             part='id,snippet',
             maxResults=max_results,
             type='video',
             order='relevance'
-        ).execute()
+        ))
         
         if search_response['items']:
             video = search_response['items'][0]
@@ -156,6 +383,7 @@ Return only the title, with no additional text."""
             max_tokens=50,
             temperature=0.7
         )
+        usage_ledger.record('title', title_response, 'gpt-3.5-turbo')
         return title_response.choices[0].message.content.strip()
     except:
         # Fallback to simple truncation if GPT fails
@@ -163,6 +391,13 @@ Return only the title, with no additional text."""
 
 def extract_memory_info(user_message, user_id):
     """Extract personal information from user message and categorize it"""
+    memory_data = extract_memory_data(user_message)
+    if memory_data:  # Only save if there's actual memory data
+        save_memory_info(user_id, memory_data)
+    return memory_data
+
+def extract_memory_data(user_message):
+    """Ask GPT for categorized personal information in a message, without saving it"""
     try:
         memory_response = openai.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -196,6 +431,7 @@ Return only JSON, nothing else."""
             max_tokens=300,
             temperature=0.3
         )
+        usage_ledger.record('memory_extraction', memory_response, 'gpt-3.5-turbo')
         
         memory_text = memory_response.choices[0].message.content.strip()
         
@@ -203,9 +439,7 @@ Return only JSON, nothing else."""
         import json
         try:
             memory_data = json.loads(memory_text)
-            if memory_data:  # Only save if there's actual memory data
-                save_memory_info(user_id, memory_data)
-            return memory_data
+            return memory_data if isinstance(memory_data, dict) else {}
         except json.JSONDecodeError:
             return {}
             
@@ -231,10 +465,16 @@ def save_memory_info(user_id, memory_data):
                     updated_memory[category] = items
             
             updated_memory['updated_at'] = datetime.now(timezone.utc)
+            updated_memory.pop('_id', None)
+            # Every write bumps the version, so background consolidation never overwrites it
+            updated_memory.pop('version', None)
             memories_collection.update_one(
                 {"user_id": user_id},
-                {"$set": updated_memory}
+                {"$set": updated_memory, "$inc": {"version": 1}},
+                # In the request's session, so the context read later in this turn sees it
+                session=read_session()
             )
+            update_search_index(search_index.reindex_memory, user_id, updated_memory, MEMORY_CATEGORIES)
         else:
             # Create new memory document
             memory_doc = {
@@ -246,23 +486,212 @@ def save_memory_info(user_id, memory_data):
                 "personality": memory_data.get("personality", []),
                 "health": memory_data.get("health", []),
                 "others": memory_data.get("others", []),
+                "version": 1,
                 "created_at": datetime.now(timezone.utc),
                 "updated_at": datetime.now(timezone.utc)
             }
-            memories_collection.insert_one(memory_doc)
+            memories_collection.insert_one(memory_doc, session=read_session())
+            update_search_index(search_index.reindex_memory, user_id, memory_doc, MEMORY_CATEGORIES)
             
     except Exception as e:
         return
 
-def get_user_memory_context(user_id, current_topic=""):
+def json_response(payload, status=200, etag=False):
+    """Encode with fast_json and compress the body if it is large and the client accepts it.
+    
+    etag=True adds a weak ETag of the encoded payload and answers 304 if the client already has it.
+    """
+    return json_response_body(fast_json.dumps(payload), status, etag)
+
+def json_response_body(body, status=200, etag=False):
+    """json_response for a body that is already encoded"""
+    headers = {'Vary': 'Accept-Encoding'}
+    
+    if etag:
+        tag = hashlib.sha256(body).hexdigest()[:32]
+        headers.update({'ETag': f'W/"{tag}"', 'Cache-Control': 'private, no-cache'})
+        if request.if_none_match.contains_weak(tag):
+            return Response(status=304, headers=headers)
+    
+    encoding = fast_json.choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding and len(body) >= fast_json.compress_min_size():
+        body = fast_json.compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+def json_stream_response(envelope, key, items, status=200):
+    """Stream {**envelope, key: [items...]} without encoding the whole list at once.
+    
+    At least the compression threshold (in practice the first STREAM_CHUNK_SIZE chunk) is
+    encoded before the response starts: a failure in that part raises in the view and gets
+    its error status, and a list that fits is sent like json_response. A failure after that
+    aborts the transfer (see fast_json).
+    """
+    chunks = fast_json.iter_object_with_array(envelope, key, items)
+    head, rest = fast_json.read_ahead(chunks, fast_json.compress_min_size())
+    if rest is None:
+        return json_response_body(head, status)
+    
+    headers = {'Vary': 'Accept-Encoding'}
+    body = itertools.chain((head,), rest)
+    encoding = fast_json.choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        body = fast_json.iter_compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+def update_search_index(update, *args):
+    """Apply a search index update without letting index errors fail the request"""
+    try:
+        update(search_collection, *args)
+    except Exception as e:
+        print(f"Search index update failed: {e}")
+
+# Related past chats injected into the analysis stage (see related_chats.py); RELATED_CHATS_LIMIT=0 disables
+RELATED_CHATS_LIMIT = int(os.getenv('RELATED_CHATS_LIMIT', '3'))
+RELATED_CHATS_MIN_SCORE = float(os.getenv('RELATED_CHATS_MIN_SCORE', '0.05'))
+RELATED_CHATS_TOKEN_BUDGET = int(os.getenv('RELATED_CHATS_TOKEN_BUDGET', '300'))
+RELATED_CHATS_ENABLED = RELATED_CHATS_LIMIT > 0 and related_chats.available()
+# Embedding runs off the request thread, one update at a time
+related_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='related-index')
+
+def update_related_index(update, *args):
+    """Queue a related-chats index update; errors are logged, never raised"""
+    if not RELATED_CHATS_ENABLED:
+        return
+    def run():
+        try:
+            update(related_collection, *args)
+        except Exception as e:
+            print(f"Related chats index update failed: {e}")
+    related_index_executor.submit(run)
+
+def get_related_chats_context(user_id, user_message, chat_id):
+    """Summaries of the user's earlier chats closest to the message, within the token budget"""
+    if not RELATED_CHATS_ENABLED:
+        return ""
+    try:
+        related = related_chats.search(related_collection, user_id, user_message, RELATED_CHATS_LIMIT,
+                                       RELATED_CHATS_MIN_SCORE, exclude_chat_id=chat_id)
+        return related_chats.format_context(related, RELATED_CHATS_TOKEN_BUDGET)
+    except Exception as e:
+        print(f"Related chats lookup failed: {e}")
+        return ""
+
+# Per-user limits on expensive endpoints; RATE_LIMITS (JSON) overrides them per endpoint
+RATE_LIMITS = {
+    'chat': {'requests': 10, 'per_seconds': 60, 'burst': 3, 'concurrency': 2},
+    'diary': {'requests': 10, 'per_seconds': 60, 'burst': 3, 'concurrency': 1}
+}
+RATE_LIMITS.update(json.loads(os.getenv('RATE_LIMITS', '{}')))
+
+# RATE_LIMIT_SHARED=1 also counts requests in Mongo so limits hold across worker processes
+rate_limiter = rate_limit.RateLimiter(
+    RATE_LIMITS,
+    shared_collection=db['rate_limits'] if os.getenv('RATE_LIMIT_SHARED', '').lower() in ('1', 'true', 'yes') else None
+)
+
+def rate_limited(endpoint):
+    """Apply the endpoint's per-user rate limit and in-flight cap (use below @jwt_required)"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            current_user_id = get_jwt_identity()
+            decision = rate_limiter.acquire(endpoint, current_user_id)
+            if not decision.allowed:
+                return jsonify({'error': decision.reason}), 429, {'Retry-After': str(math.ceil(decision.retry_after))}
+            try:
+                return view(*args, **kwargs)
+            finally:
+                rate_limiter.release(endpoint, current_user_id)
+        return wrapper
+    return decorator
+
+def find_user_chat(chat_id, user_id):
+    """Find one of the user's chats, moving it back from the archive if it was archived"""
+    query = {'_id': ObjectId(chat_id), 'user_id': user_id}
+    chat = chats_collection.find_one(query)
+    if not chat:
+        chat = chat_archive.rehydrate(chats_collection, chats_archive_collection, query)
+    return chat
+
+def update_analytics(update, *args):
+    """Apply a feedback rollup update without letting analytics errors fail the request"""
+    try:
+        update(analytics_collection, *args)
+    except Exception as e:
+        print(f"Analytics rollup update failed: {e}")
+
+def update_usage_ledger(user_id, role, stage_usage, turns=1):
+    """Add a turn's token usage to the daily ledger without letting ledger errors fail the request.
+    
+    Calls of the turn that finish after this (lost hedges, stages past the deadline) are added
+    to the ledger as they come in, without counting another turn.
+    """
+    def write(usage, turns):
+        try:
+            usage_ledger.record_turn(usage_collection, user_id, role, usage, turns)
+        except Exception as e:
+            print(f"Usage ledger update failed: {e}")
+    
+    write(usage_ledger.close(stage_usage, lambda late_usage: write(late_usage, 0)), turns)
+
+def buffer_memory(update, *args):
+    """Record a message for batched memory extraction without letting errors fail the request"""
+    try:
+        update(chats_collection, *args)
+    except Exception as e:
+        print(f"Memory window update failed: {e}")
+
+# Memory extraction and diary summaries run here instead of in the turn at the deferred service level
+deferred_work_executor = ThreadPoolExecutor(max_workers=int(os.getenv('DEFERRED_WORK_WORKERS', '2')),
+                                            thread_name_prefix='deferred-work')
+
+def run_deferred(user_id, role, work, *args):
+    """Queue work(*args) after a turn; its LLM usage goes to the user's ledger, errors are logged"""
+    def run():
+        try:
+            with usage_ledger.collect() as stage_usage:
+                work(*args)
+            update_usage_ledger(user_id, role, stage_usage, turns=0)
+        except Exception as e:
+            print(f"Deferred {work.__name__} failed: {e}")
+    deferred_work_executor.submit(run)
+
+def get_usage_budget_status(user_id):
+    """'ok', 'soft' or 'hard' for the user's token usage today"""
+    if not USAGE_SOFT_BUDGET_TOKENS and not USAGE_HARD_BUDGET_TOKENS:
+        return 'ok'
+    try:
+        used = usage_ledger.tokens_used_today(usage_collection, user_id)
+    except Exception as e:
+        # Fail open: an unreadable ledger should not block chatting
+        print(f"Usage budget check failed: {e}")
+        return 'ok'
+    return usage_ledger.budget_status(used, USAGE_SOFT_BUDGET_TOKENS, USAGE_HARD_BUDGET_TOKENS)
+
+def get_persona_role(user_id):
+    claims = current_claims()
+    if claims and get_jwt_identity() == user_id:
+        return claims[profile_claims.ROLE_CLAIM]
+    persona = personas_collection.find_one({'user_id': user_id}, {'role': 1})
+    return persona.get('role', 'friend') if persona else 'friend'
+
+def is_admin(user_id):
+    admin_ids = [admin_id.strip() for admin_id in os.getenv('ADMIN_USER_IDS', '').split(',') if admin_id.strip()]
+    return user_id in admin_ids
+
+def get_user_memory_context(user_id, current_topic="", check_relevance=True):
     """Get user memory context for personalized responses with relevance filtering"""
     try:
-        memory = memories_collection.find_one({"user_id": user_id})
+        memory = routed(memories_collection, 'context').find_one({"user_id": user_id}, session=read_session())
         if not memory:
             return ""
         
-        # If we have a current topic, filter memory for relevance
-        if current_topic:
+        # If we have a current topic, filter memory for relevance (skipped under load)
+        if current_topic and check_relevance:
             # Use GPT to determine if memory is relevant to current topic
             try:
                 relevance_check = openai.chat.completions.create(
@@ -287,6 +716,7 @@ Examples:
                     max_tokens=10,
                     temperature=0.1
                 )
+                usage_ledger.record('memory_relevance', relevance_check, 'gpt-3.5-turbo')
                 
                 relevance_result = relevance_check.choices[0].message.content.strip()
                 if relevance_result == "NOT_RELEVANT":
@@ -320,32 +750,133 @@ Examples:
     except Exception as e:
         return ""
 
-def get_conversation_context(chat_session, max_messages=6):
-    """Get recent conversation context for GPT to remember previous messages"""
+def get_conversation_messages(chat_session, min_messages=6, step=6):
+    """Get recent conversation turns as native chat messages for GPT to remember previous messages"""
     try:
         messages = chat_session.get('messages', [])
-        if not messages:
-            return ""
         
-        # Get last few messages for context
-        recent_messages = messages[-max_messages:] if len(messages) > max_messages else messages
+        # Start the window on a multiple of `step` so it only moves every few turns.
+        # A window that slides every turn changes the prompt prefix and defeats prompt caching.
+        start = ((len(messages) - min_messages) // step) * step if len(messages) > min_messages else 0
         
-        context_parts = []
-        for msg in recent_messages:
+        history = []
+        for msg in messages[start:]:
             role = msg.get('role', '')
             content = msg.get('content', '')
-            if role and content:
+            if role in ('user', 'assistant') and content:
                 # Truncate very long messages
                 if len(content) > 300:
                     content = content[:300] + "..."
-                context_parts.append(f"{role.upper()}: {content}")
-        
-        if context_parts:
-            return f"\n\n--- CONVERSATION HISTORY ---\n{chr(10).join(context_parts)}\n"
+                history.append({"role": role, "content": content})
         
-        return ""
+        return history
     except Exception as e:
+        return []
+
+def build_stage_messages(system_prompt, persona_context, persona_style_prompt, history_messages, memory_context, user_content):
+    """Order a stage prompt from most to least stable so calls share a long cacheable prefix.
+    
+    1. stage instructions, persona and response style (change rarely)
+    2. earlier turns as native chat messages (append-only between window moves)
+    3. user memory (depends on the current topic)
+    4. the current request
+    """
+    messages = [{"role": "system", "content": system_prompt + persona_context + persona_style_prompt}]
+    messages.extend(history_messages)
+    if memory_context.strip():
+        messages.append({"role": "system", "content": memory_context.strip()})
+    messages.append({"role": "user", "content": user_content})
+    return messages
+
+# Pipeline stages: system prompt and output limit; later stages build on the outputs of earlier ones
+PIPELINE_STAGES = {
+    'analysis': {'prompt': 'analyzer', 'max_tokens': 500},
+    'strategy': {'prompt': 'strategist', 'max_tokens': 1000},
+    'implementation': {'prompt': 'implementer', 'max_tokens': 1500},
+    'fallback': {'prompt': 'fallback', 'max_tokens': 1000}
+}
+
+def stage_user_content(stage, user_message, outputs):
+    """The request a stage answers, given the outputs of the stages before it"""
+    if stage == 'strategy':
+        return f"""Create a strategy based on the analysis below. Write the titles of the steps only like "Gather necessary materials", "Cut the wood", "Provide insulation" etc...
+                        Analysis: {outputs['analysis']}
+                        
+                        DO NOT START YOUR RESPONSE WITH ANY INTRODUCTORY SENTENCE. Go directly into explaining your strategy as a continuation of the analysis. Do not repeat the analysis in your response. Do not add finishing messages to your response."""
+    if stage == 'implementation':
+        return f"""If the user input is relevant with such implementation steps, create implementation steps based on the analysis and strategy below. Else, skip this message.
+                        Analysis: {outputs['analysis']}
+                        Strategy: {outputs['strategy']}
+                        
+                        DO NOT START YOUR RESPONSE WITH ANY INTRODUCTORY SENTENCE. Go directly into explaining your implementation steps as a continuation of the analysis and strategy. Do not repeat the strategy steps in your response. Explain calculated implementation steps of strategy in a natural way. For example, if user wants to build a dog house, explain how to build it with mathematically calculated steps.(as an example: use 20x20 wooden plates, leave 50 cm space between walls, use 10x10 wooden plates for roof, use 5x5 wooden plates for floor)"""
+    return user_message
+
+def run_pipeline_stages(stages, deadline, context, user_message, outputs, instruction=None):
+    """Run `stages` in order, adding each output to `outputs` as it finishes.
+    
+    `context` holds the prompt parts shared by the stages (persona, style, history, memory,
+    related chats). `instruction` (e.g. "shorter please") is added to every stage run here.
+    Raises when a stage fails or its budget runs out; the stages before it stay in `outputs`.
+    """
+    for position, stage in enumerate(stages):
+        if stage == 'fallback':
+            # The single-call fallback always gets a minimum budget, even past the deadline
+            timeout = max(deadline.remaining(), FALLBACK_MIN_SECONDS)
+        else:
+            timeout = deadline.stage_timeout(stage, stages[position:], CHAT_STAGE_SHARES)
+        user_content = stage_user_content(stage, user_message, outputs)
+        if instruction:
+            user_content += f"\n\nThe user asked for a new version of this answer: {instruction}"
+        memory_context = context['memory_context']
+        if stage == 'analysis':
+            # Related past chats go to the analysis stage only
+            memory_context += context['related_context']
+        
+        response = llm_stage_call(
+            stage, timeout,
+            model="gpt-3.5-turbo",
+            messages=build_stage_messages(
+                SYSTEM_PROMPTS[PIPELINE_STAGES[stage]['prompt']], context['persona_context'],
+                context['persona_style_prompt'], context['history_messages'], memory_context, user_content
+            ),
+            max_tokens=PIPELINE_STAGES[stage]['max_tokens'],
+            temperature=0.7
+        )
+        outputs[stage] = response.choices[0].message.content
+
+def compose_answer(stage_outputs):
+    """The reply text from the stage outputs that are there"""
+    if 'fallback' in stage_outputs:
+        return stage_outputs['fallback']
+    
+    # Combine whatever stages finished; a late stage overrunning its budget keeps the earlier ones
+    final_response = "\n\n".join(stage_outputs[stage] for stage in CHAT_STAGES if stage_outputs.get(stage))
+    
+    # Clean up any remaining redundant phrases
+    final_response = final_response.replace("Tabii ki, ", "")
+    final_response = final_response.replace("Elbette, ", "")
+    final_response = final_response.replace("İşte ", "")
+    final_response = final_response.replace("Öncelikle, ", "")
+    return final_response
+
+def format_video_suggestion(youtube_video):
+    return f"\n\n🎥 **Relevant Video Suggestion:**\n{youtube_video['title']}\n{youtube_video['description']}\n\n[YOUTUBE_VIDEO]{youtube_video['video_id']}[/YOUTUBE_VIDEO]"
+
+def build_persona_style_prompt(persona_data, persona_response_style):
+    """Persona-specific prompt additions"""
+    if not persona_data:
         return ""
+    style = persona_response_style['style']
+    return f"""
+            
+--- PERSONA RESPONSE STYLE ---
+Tone: {style['tone']}
+Format: {style['format']}
+Approach: {style['approach']}
+Avoid: {style['avoid']}
+
+Respond according to these persona characteristics. {persona_response_style['cooperation_instructions']}
+"""
 
 def extract_conversation_memory(user_message, conversation_history):
     """Extract conversation-specific memory from user message and conversation context"""
@@ -395,6 +926,7 @@ Return an empty array if there is no conversation-specific information."""
             max_tokens=500,
             temperature=0.3
         )
+        usage_ledger.record('conversation_memory', memory_response, 'gpt-3.5-turbo')
         
         import json
         memory_data = json.loads(memory_response.choices[0].message.content)
@@ -413,7 +945,9 @@ def save_conversation_memory(chat_id, memory_facts):
                 {
                     '$addToSet': {
                         'conversation_memory': {'$each': memory_facts}
-                    }
+                    },
+                    # Every chat write bumps the revision the archiver checks (see chat_archive.py)
+                    '$inc': {'revision': 1}
                 }
             )
     except Exception as e:
@@ -558,9 +1092,10 @@ def get_user_feedback_history(user_id):
     """Get user's recent feedback history for cooperation level calculation"""
     try:
         # Get recent chats with feedback
-        recent_chats = chats_collection.find(
+        recent_chats = routed(chats_collection, 'context').find(
             {'user_id': user_id},
-            {'messages': 1}
+            {'messages': 1},
+            session=read_session()
         ).sort('updated_at', -1).limit(5)
         
         feedback_history = []
@@ -574,10 +1109,12 @@ def get_user_feedback_history(user_id):
     except Exception as e:
         return []
 
-def get_user_persona_context(user_id):
-    """Get user's persona context for GPT prompts"""
+def get_user_persona_context(user_id, persona_data=None):
+    """Get user's persona context for GPT prompts (from `persona_data` if the caller already read it)"""
     try:
-        persona_data = personas_collection.find_one({'user_id': user_id})
+        if persona_data is None:
+            persona_data = routed(personas_collection, 'context').find_one({'user_id': user_id},
+                                                                           session=read_session())
         
         if not persona_data:
             return ""
@@ -640,6 +1177,7 @@ Provide an English response and write in a personal diary style.]"""
             max_tokens=200,
             temperature=0.7
         )
+        usage_ledger.record('diary_summary', summary_response, 'gpt-3.5-turbo')
         
         summary_text = summary_response.choices[0].message.content
         
@@ -692,6 +1230,8 @@ def auto_create_diary_entry(user_id, chat_id):
         
         result = diary_collection.insert_one(diary_entry)
         print(f"Auto-created diary entry: {result.inserted_id}")
+        update_search_index(search_index.index_diary_entry, user_id, str(result.inserted_id), chat_id,
+                            diary_entry['title'], diary_entry['summary'], diary_entry['updated_at'])
         return result.inserted_id
         
     except Exception as e:
@@ -711,7 +1251,7 @@ def auto_update_diary_entry(user_id, chat_id):
             return
         
         # Update existing diary entry
-        diary_collection.update_one(
+        diary_entry = diary_collection.find_one_and_update(
             {'user_id': user_id, 'chat_id': chat_id},
             {
                 '$set': {
@@ -720,14 +1260,56 @@ def auto_update_diary_entry(user_id, chat_id):
                     'message_count': diary_summary['message_count'],
                     'updated_at': datetime.now(timezone.utc)
                 }
-            }
+            },
+            projection={'_id': 1}
         )
+        if diary_entry:
+            update_search_index(search_index.index_diary_entry, user_id, str(diary_entry['_id']), chat_id,
+                                diary_summary['title'], diary_summary['summary'], datetime.now(timezone.utc))
+            update_related_index(related_chats.index_entry, user_id, str(diary_entry['_id']), chat_id,
+                                 diary_summary['title'], diary_summary['summary'], diary_summary['date'])
         
         print(f"Auto-updated diary entry for chat: {chat_id}")
         
     except Exception as e:
         return
 
+# Profile fields and persona role travel in the access token (see profile_claims.py)
+claims_versions = profile_claims.VersionCache(users_collection, float(os.getenv('CLAIMS_VERSION_CACHE_SECONDS', '30')))
+
+def issue_access_token(user, role):
+    """Access token for a user document, carrying its profile claims"""
+    return create_access_token(identity=str(user['_id']), additional_claims=profile_claims.build_claims(user, role))
+
+def current_claims():
+    """The request token's profile claims while they are current, else None"""
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        # Not in a request with a verified token
+        return None
+    if profile_claims.CLAIM not in claims:
+        return None
+    
+    user_id = get_jwt_identity()
+    try:
+        if claims_versions.is_current(user_id, ObjectId(user_id), claims.get(profile_claims.VERSION_CLAIM)):
+            return claims
+    except Exception as e:
+        print(f"Claims version check failed: {e}")
+    return None
+
+def refresh_claims(user_id, update=None, role=None):
+    """Apply a change to the user's claim fields and return (user, headers with a fresh token).
+    
+    user is None if there is no such user. Without `role` the persona role is looked up.
+    """
+    user = claims_versions.update(user_id, ObjectId(user_id), update, USER_PROFILE_FIELDS)
+    if not user:
+        return None, {}
+    token = issue_access_token(user, role or get_persona_role(user_id))
+    return user, {profile_claims.TOKEN_HEADER: token}
+
 @app.route('/api/register', methods=['POST'])
 def register():
     try:
@@ -743,8 +1325,8 @@ def register():
         if users_collection.find_one({'$or': [{'username': username}, {'email': email}]}):
             return jsonify({'error': 'User already exists'}), 400
 
-        # Hash password
-        hashed_password = generate_password_hash(password)
+        # Hash password (runs on the password hashing process pool)
+        hashed_password = hash_password(password)
 
         # Create user
         user_data = {
@@ -760,8 +1342,8 @@ def register():
         
         result = users_collection.insert_one(user_data)
         
-        # Create access token
-        access_token = create_access_token(identity=str(result.inserted_id))
+        # Create access token; a new user has the default persona role
+        access_token = issue_access_token(dict(user_data, _id=result.inserted_id), 'friend')
         
         return jsonify({
             'message': 'User created successfully',
@@ -773,6 +1355,8 @@ def register():
             }
         }), 201
 
+    except PasswordHasherBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -789,11 +1373,22 @@ def login():
         # Find user
         user = users_collection.find_one({'username': username})
         
-        if not user or not check_password_hash(user['password'], password):
+        if not user:
+            return jsonify({'error': 'Invalid credentials'}), 401
+
+        password_ok, upgraded_hash = verify_password(user['password'], password)
+        if not password_ok:
             return jsonify({'error': 'Invalid credentials'}), 401
 
+        # Upgrade the stored hash if the configured algorithm or cost changed
+        if upgraded_hash:
+            users_collection.update_one(
+                {'_id': user['_id'], 'password': user['password']},
+                {'$set': {'password': upgraded_hash}}
+            )
+
         # Create access token
-        access_token = create_access_token(identity=str(user['_id']))
+        access_token = issue_access_token(user, get_persona_role(str(user['_id'])))
         
         return jsonify({
             'message': 'Login successful',
@@ -805,64 +1400,127 @@ def login():
             }
         }), 200
 
+    except PasswordHasherBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Fields of a user document the client sees
+USER_PROFILE_FIELDS = {'username': 1, 'email': 1, 'profileComplete': 1, 'personaSelected': 1,
+                       'ageGroup': 1, 'pronouns': 1, 'occupation': 1}
+
+def user_profile(user):
+    return {
+        'id': str(user['_id']),
+        'username': user['username'],
+        'email': user['email'],
+        'profileComplete': user.get('profileComplete', False),
+        'personaSelected': user.get('personaSelected', False),
+        'ageGroup': user.get('ageGroup'),
+        'pronouns': user.get('pronouns'),
+        'occupation': user.get('occupation')
+    }
+
 @app.route('/api/user', methods=['GET'])
 @jwt_required()
 def get_user():
     try:
         current_user_id = get_jwt_identity()
-        user = users_collection.find_one({'_id': ObjectId(current_user_id)})
+        
+        # Current claims already hold the profile
+        claims = current_claims()
+        if claims:
+            return jsonify({'user': user_profile(dict(claims[profile_claims.CLAIM], _id=current_user_id))}), 200
+        
+        user = users_collection.find_one({'_id': ObjectId(current_user_id)}, USER_PROFILE_FIELDS)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
             
-        return jsonify({
-            'user': {
-                'id': str(user['_id']),
-                'username': user['username'],
-                'email': user['email'],
-                'profileComplete': user.get('profileComplete', False),
-                'personaSelected': user.get('personaSelected', False),
-                'ageGroup': user.get('ageGroup'),
-                'pronouns': user.get('pronouns'),
-                'occupation': user.get('occupation')
-            }
-        }), 200
+        return jsonify({'user': user_profile(user)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.after_request
+def issue_read_token(response):
+    """Return a read-after token for successful writes; end the request's session once the response is sent"""
+    if READ_ROUTING_ENABLED and request.method in WRITE_METHODS and response.status_code < 400 \
+            and client.topology_description.topology_type_name != 'Single':
+        try:
+            session = read_session()
+            # A primary command in the session reports an operation time at or after this request's writes
+            db.command('ping', session=session)
+            token = read_routing.encode_token(session)
+            if token:
+                response.headers[read_routing.TOKEN_HEADER] = token
+        except Exception as e:
+            print(f"Read-after token unavailable: {e}")
+    
+    session = g.pop('read_session', None)
+    if session is not None:
+        # Streamed responses still read from cursors in this session, so it ends on close
+        response.call_on_close(session.end_session)
+    return response
+
+@app.teardown_request
+def end_read_session(exc):
+    if exc is not None:
+        session = g.pop('read_session', None)
+        if session is not None:
+            session.end_session()
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    # Liveness: the process is up and serving; no dependency checks here
     return jsonify({'status': 'healthy'}), 200
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    # Readiness: dependencies are reachable and clients are built, so traffic can be routed here
+    checks = {}
+    
+    try:
+        client.admin.command('ping', maxTimeMS=2000)
+        checks['mongodb'] = 'ok'
+    except Exception as e:
+        checks['mongodb'] = f'error: {e}'
+    
+    try:
+        # Normally done at start-up; retried here only until it has succeeded once
+        prepare_instance()
+        checks['clients'] = 'ok'
+    except Exception as e:
+        checks['clients'] = f'error: {e}'
+    
+    ready = all(status == 'ok' for status in checks.values())
+    return jsonify({'status': 'ready' if ready else 'not_ready', 'checks': checks}), 200 if ready else 503
+
 @app.route('/api/complete-profile', methods=['POST'])
 @jwt_required()
 def complete_profile():
     try:
         current_user_id = get_jwt_identity()
-        user = users_collection.find_one({'_id': ObjectId(current_user_id)})
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
         data = request.get_json()
         ageGroup = data.get('ageGroup')
         pronouns = data.get('pronouns')
         occupation = data.get('occupation')
         
-        users_collection.update_one({'_id': ObjectId(current_user_id)}, {'$set': {
+        # One write updates the profile and its claims version; the new token carries the change
+        claims = current_claims()
+        user, headers = refresh_claims(current_user_id, {'$set': {
             'ageGroup': ageGroup,
             'pronouns': pronouns,
             'occupation': occupation,
             'profileComplete': True
-        }})
+        }}, role=claims[profile_claims.ROLE_CLAIM] if claims else None)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
         
         return jsonify({
             'message': 'Profile completed successfully'
-        }), 200
+        }), 200, headers
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -872,38 +1530,135 @@ def complete_profile():
 def complete_persona_selection():
     try:
         current_user_id = get_jwt_identity()
-        user = users_collection.find_one({'_id': ObjectId(current_user_id)})
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
         
         # Mark persona selection as complete
-        users_collection.update_one({'_id': ObjectId(current_user_id)}, {'$set': {
+        claims = current_claims()
+        user, headers = refresh_claims(current_user_id, {'$set': {
             'personaSelected': True
-        }})
+        }}, role=claims[profile_claims.ROLE_CLAIM] if claims else None)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
         
         return jsonify({
             'message': 'Persona selection completed successfully'
-        }), 200
+        }), 200, headers
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/chat', methods=['POST'])
 @jwt_required()
+@rate_limited('chat')
 def chat():
     try:
         current_user_id = get_jwt_identity()
         data = request.get_json()
+        idempotency_key = request.headers.get('Idempotency-Key')
+        
+        budget_status = get_usage_budget_status(current_user_id)
+        if budget_status == 'hard':
+            return jsonify({'error': 'Daily usage limit reached'}), 429, {
+                'Retry-After': str(usage_ledger.seconds_until_reset())
+            }
+        economy = budget_status == 'soft'
+        
+        # The service level is picked once per turn, from the load when it is admitted
+        with load_controller.admit() as service_level:
+            if LLM_RECORD_PATH:
+                payload, status_code = record_chat_turn(current_user_id, data, economy, service_level)
+                return jsonify(payload), status_code
+            
+            if not idempotency_key:
+                payload, status_code = run_chat_turn(current_user_id, data, economy, service_level)
+                return jsonify(payload), status_code
+            
+            # A retried turn with the same key reuses (or waits for) the first run instead of recomputing it
+            request_fingerprint = idempotency.fingerprint(data.get('message'), data.get('chat_id'))
+            payload, status_code, replayed = idempotency.run_idempotent(
+                idempotency_collection, current_user_id, idempotency_key, request_fingerprint,
+                lambda: run_chat_turn(current_user_id, data, economy, service_level)
+            )
+        
+        headers = {'Idempotent-Replayed': 'true'} if replayed else {}
+        return jsonify(payload), status_code, headers
+        
+    except idempotency.IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except idempotency.IdempotencyInProgress as e:
+        return jsonify({'error': str(e)}), 409, {'Retry-After': '5'}
+    except chat_turns.ChatBusy as e:
+        return jsonify({'error': str(e)}), 409, {'Retry-After': '5'}
+    except Exception as e:
+        return jsonify({'error': f'Chatbot error: {str(e)}'}), 500
+
+def record_chat_turn(current_user_id, data, economy=False, service_level=load_shedding.FULL):
+    """Run a chat turn and write it, with its LLM calls, to the LLM_RECORD_PATH cassette"""
+    openai.get()  # the recording client registers itself when created
+    persona = personas_collection.find_one({'user_id': current_user_id}, {'_id': 0, 'user_id': 0})
+    memory = memories_collection.find_one({'user_id': current_user_id}, {'_id': 0, 'user_id': 0})
+    
+    llm_cassette.start_turn(
+        # Only whether the turn continued a chat is kept; chat ids differ between runs
+        {'message': data.get('message'), 'continue_chat': bool(data.get('chat_id'))},
+        setup={'persona': persona, 'memory': memory}
+    )
+    payload, status_code = run_chat_turn(current_user_id, data, economy, service_level)
+    llm_cassette.finish_turn(payload, status_code)
+    return payload, status_code
+
+def run_chat_turn(current_user_id, data, economy=False, service_level=load_shedding.FULL):
+    """Run one chat turn and return (response payload, status code).
+    
+    economy=True (the user is past the soft usage budget) answers with the single-call pipeline.
+    service_level (load_shedding.LEVELS) drops or defers auxiliary work while the server is under load.
+    Turns on the same chat run one after another; a copy of a turn that is still running gets
+    that turn's answer (marked coalesced) instead of running again. Raises chat_turns.ChatBusy.
+    """
+    turn_fingerprint = chat_turns.fingerprint(current_user_id, data.get('chat_id'), data.get('message'))
+    (payload, status_code), coalesced = chat_turns.coalesce(
+        turn_fingerprint,
+        lambda: serialized_chat_turn(current_user_id, data, economy, service_level, turn_fingerprint)
+    )
+    if coalesced:
+        payload = dict(payload, coalesced=True)
+    return payload, status_code
+
+def serialized_chat_turn(current_user_id, data, economy, service_level, turn_fingerprint):
+    """Run the turn holding the chat's turn lease"""
+    chat_id = data.get('chat_id')
+    query = {'_id': ObjectId(chat_id), 'user_id': current_user_id} if chat_id and ObjectId.is_valid(chat_id) else None
+    # A new chat (or an unknown id, which starts one) has nothing to wait for
+    if query is None or not (chats_collection.find_one(query, {'_id': 1}) or find_user_chat(chat_id, current_user_id)):
+        with usage_ledger.collect() as stage_usage:
+            return _run_chat_turn(current_user_id, data, economy, service_level, stage_usage, turn_fingerprint)
+    
+    with chat_turns.turn_lease(chats_collection, query, turn_fingerprint, CHAT_TURN_SETTINGS) as waited:
+        if waited:
+            # An identical submission handled by another worker while we waited
+            duplicate = chat_turns.finished_duplicate(chats_collection.find_one(query), turn_fingerprint,
+                                                      CHAT_TURN_SETTINGS['coalesce_window'])
+            if duplicate:
+                return {'message': duplicate['content'], 'chat_id': chat_id, 'coalesced': True}, 200
+        with usage_ledger.collect() as stage_usage:
+            return _run_chat_turn(current_user_id, data, economy, service_level, stage_usage, turn_fingerprint)
+
+def _run_chat_turn(current_user_id, data, economy, service_level, stage_usage, turn_fingerprint):
+    try:
+        deadline = llm_deadlines.Deadline(CHAT_DEADLINE_SECONDS)
         user_message = data.get('message')
         chat_id = data.get('chat_id')
         
         if not user_message:
-            return jsonify({'error': 'Mesaj gerekli'}), 400
+            return {'error': 'Mesaj gerekli'}, 400
+        
+        # Past the soft usage budget, or at the heaviest load, only the single fallback call runs
+        single_call = economy or service_level >= load_shedding.SINGLE_CALL
+        deferred = service_level >= load_shedding.DEFERRED
         
         # Get or create chat session
         if chat_id:
-            chat_session = chats_collection.find_one({'_id': ObjectId(chat_id), 'user_id': current_user_id})
+            chat_session = find_user_chat(chat_id, current_user_id)
         else:
             chat_session = None
             
@@ -915,14 +1670,21 @@ def chat():
                 'updated_at': datetime.now(timezone.utc),
                 'messages': [],
                 'title': generate_chat_title(user_message),
-                'conversation_memory': []  # Initialize empty conversation memory
+                'conversation_memory': [],  # Initialize empty conversation memory
+                'version': 0
             }
             result = chats_collection.insert_one(chat_session)
             chat_id = str(result.inserted_id)
             chat_session['_id'] = result.inserted_id
+            update_search_index(search_index.index_chat_title, current_user_id, chat_id,
+                                chat_session['title'], chat_session['created_at'])
             
             # Auto-create diary entry for new chat
             auto_create_diary_entry(current_user_id, chat_id)
+            
+            # Starting a chat ends the user's other chats, so their memory windows are due
+            if MEMORY_EXTRACTION_BATCHED:
+                buffer_memory(memory_windows.mark_ended, current_user_id, result.inserted_id)
         
         # Add user message to history
         user_msg = {
@@ -931,24 +1693,36 @@ def chat():
             'timestamp': datetime.now(timezone.utc)
         }
         
-        # Extract memory information from user message
-        memory_info = extract_memory_info(user_message, current_user_id)
+        # Get user's persona data
+        persona_data = routed(personas_collection, 'context').find_one({'user_id': current_user_id},
+                                                                       session=read_session())
+        persona_role = persona_data.get('role') if persona_data else None
+        
+        # Extract memory information from user message (after the response, under load);
+        # batched extraction only buffers the message once the turn is saved
+        if not MEMORY_EXTRACTION_BATCHED:
+            if deferred:
+                run_deferred(current_user_id, persona_role, extract_memory_info, user_message, current_user_id)
+            else:
+                extract_memory_info(user_message, current_user_id)
         
         # Get user's memory context for personalized responses
-        memory_context = get_user_memory_context(current_user_id, user_message)
+        memory_context = get_user_memory_context(current_user_id, user_message,
+                                                 check_relevance=service_level < load_shedding.REDUCED)
         
-        # Get user's persona context for personalized responses
-        persona_context = get_user_persona_context(current_user_id)
+        # Earlier chats related to this message, given to the analysis stage only
+        related_context = get_related_chats_context(current_user_id, user_message, chat_id) if not single_call else ""
         
-        # Extract conversation-specific memory
-        conversation_memory = extract_conversation_memory(user_message, chat_session.get('messages', []))
-        save_conversation_memory(chat_id, conversation_memory)
+        # Get user's persona context for personalized responses
+        persona_context = get_user_persona_context(current_user_id, persona_data)
         
-        # Get conversation-specific memory context
-        conversation_memory_context = get_conversation_context(chat_session)
+        # Extract conversation-specific memory (skipped under load)
+        if not MEMORY_EXTRACTION_BATCHED and service_level < load_shedding.REDUCED:
+            conversation_memory = extract_conversation_memory(user_message, chat_session.get('messages', []))
+            save_conversation_memory(chat_id, conversation_memory)
         
-        # Get user's persona data
-        persona_data = personas_collection.find_one({'user_id': current_user_id})
+        # Get recent conversation turns
+        history_messages = get_conversation_messages(chat_session)
         
         # Get user's feedback history
         user_feedback_history = get_user_feedback_history(current_user_id)
@@ -956,149 +1730,99 @@ def chat():
         # Get persona-specific response style and cooperation level
         persona_response_style = get_persona_response_style(persona_data, user_feedback_history)
         
-        # Multi-level problem solving approach
-        try:
-            # Build persona-specific prompt additions
-            persona_style_prompt = ""
-            if persona_data:
-                style = persona_response_style['style']
-                persona_style_prompt = f"""
-                
---- PERSONA RESPONSE STYLE ---
-Tone: {style['tone']}
-Format: {style['format']}
-Approach: {style['approach']}
-Avoid: {style['avoid']}
-
-Respond according to these persona characteristics. {persona_response_style['cooperation_instructions']}
-"""
-            
-            # Level 1: Analysis
-            analysis_response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPTS["analyzer"] + memory_context + persona_context + conversation_memory_context + persona_style_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            analysis = analysis_response.choices[0].message.content
-            
-            # Level 2: Strategy
-            strategy_response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": SYSTEM_PROMPTS["strategist"] + memory_context + persona_context + conversation_memory_context + persona_style_prompt
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"""Create a strategy based on the analysis below. Write the titles of the steps only like "Gather necessary materials", "Cut the wood", "Provide insulation" etc...
-                        Analysis: {analysis}
-                        
-                        DO NOT START YOUR RESPONSE WITH ANY INTRODUCTORY SENTENCE. Go directly into explaining your strategy as a continuation of the analysis. Do not repeat the analysis in your response. Do not add finishing messages to your response."""
-                    }
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
-            strategy = strategy_response.choices[0].message.content
-            
-            # Level 3: Implementation
-            implementation_response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": SYSTEM_PROMPTS["implementer"] + memory_context + persona_context + conversation_memory_context + persona_style_prompt
-                    },
-                    {
-                        "role": "user", 
-                        "content": f"""If the user input is relevant with such implementation steps, create implementation steps based on the analysis and strategy below. Else, skip this message.
-                        Analysis: {analysis}
-                        Strategy: {strategy}
-                        
-                        DO NOT START YOUR RESPONSE WITH ANY INTRODUCTORY SENTENCE. Go directly into explaining your implementation steps as a continuation of the analysis and strategy. Do not repeat the strategy steps in your response. Explain calculated implementation steps of strategy in a natural way. For example, if user wants to build a dog house, explain how to build it with mathematically calculated steps.(as an example: use 20x20 wooden plates, leave 50 cm space between walls, use 10x10 wooden plates for roof, use 5x5 wooden plates for floor)"""
-                    }
-                ],
-                max_tokens=1500,
-                temperature=0.7
-            )
-            implementation = implementation_response.choices[0].message.content
-            
-            # Combine all responses with smooth transitions
-            final_response = f"{analysis}\n\n{strategy}\n\n"
-            final_response += implementation
-            
-            # Clean up any remaining redundant phrases
-            final_response = final_response.replace("Tabii ki, ", "")
-            final_response = final_response.replace("Elbette, ", "")
-            final_response = final_response.replace("İşte ", "")
-            final_response = final_response.replace("Öncelikle, ", "")
-            
-        except Exception as e:
+        context = {
+            'persona_context': persona_context,
+            'persona_style_prompt': build_persona_style_prompt(persona_data, persona_response_style),
+            'history_messages': history_messages,
+            'memory_context': memory_context,
+            'related_context': related_context
+        }
+        
+        # Multi-level problem solving approach; each stage's output is kept on the message for regeneration
+        stage_outputs = {}
+        if not single_call:
+            try:
+                run_pipeline_stages(CHAT_STAGES, deadline, context, user_message, stage_outputs)
+            except Exception as e:
+                print(f"Chat pipeline stopped early: {e}")
+        
+        if not stage_outputs.get('analysis'):
             # Fallback to simple response
-            simple_response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant. Provide practical solutions to the user's problems." + memory_context + persona_context + conversation_memory_context + persona_style_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
-            final_response = simple_response.choices[0].message.content
+            run_pipeline_stages(['fallback'], deadline, context, user_message, stage_outputs)
+        
+        final_response = compose_answer(stage_outputs)
         
         # Check if user has mentor persona and add YouTube video suggestion
+        youtube_video = None
         if persona_data and persona_data.get('role') == 'mentor':
             youtube_video = search_youtube_video(user_message)
             if youtube_video:
-                final_response += f"\n\n🎥 **Relevant Video Suggestion:**\n{youtube_video['title']}\n{youtube_video['description']}\n\n[YOUTUBE_VIDEO]{youtube_video['video_id']}[/YOUTUBE_VIDEO]"
+                final_response += format_video_suggestion(youtube_video)
         
         # Add assistant response to history
         assistant_msg = {
             'role': 'assistant',
             'content': final_response,
-            'timestamp': datetime.now(timezone.utc)
+            'timestamp': datetime.now(timezone.utc),
+            'stage_outputs': stage_outputs,
+            'video_suggestion': youtube_video,
+            # Per-stage calls, prompt/completion/cached tokens, latency and cost so far in this turn
+            'stage_usage': {stage: dict(usage) for stage, usage in stage_usage.items()},
+            'pipeline_mode': 'economy' if economy else 'single_call' if single_call else 'full',
+            'service_level': load_shedding.LEVELS[service_level]
         }
         
-        # Update chat session
-        chats_collection.update_one(
-            {'_id': chat_session['_id']},
-            {
-                '$push': {'messages': {'$each': [user_msg, assistant_msg]}},
-                '$set': {'updated_at': datetime.now(timezone.utc)}
-            }
-        )
+        # Update chat session, unless another turn was appended since it was read
+        first_index = chat_turns.append_turn(chats_collection, chat_session, [user_msg, assistant_msg], turn_fingerprint)
+        if first_index is None:
+            update_usage_ledger(current_user_id, persona_role, stage_usage)
+            raise chat_turns.ChatBusy('This chat changed while the message was being answered; please send it again')
+        
+        # Index the new turn for search
+        update_search_index(search_index.index_message, current_user_id, chat_id, first_index, user_msg)
+        update_search_index(search_index.index_message, current_user_id, chat_id, first_index + 1, assistant_msg)
+        
+        if MEMORY_EXTRACTION_BATCHED:
+            buffer_memory(memory_windows.buffer_message, chat_session['_id'])
         
         # Auto-update diary entry
-        auto_update_diary_entry(current_user_id, chat_id)
+        if deferred:
+            run_deferred(current_user_id, persona_role, auto_update_diary_entry, current_user_id, chat_id)
+        else:
+            auto_update_diary_entry(current_user_id, chat_id)
         
-        return jsonify({
+        update_usage_ledger(current_user_id, persona_role, stage_usage)
+        
+        return {
             'message': final_response,
             'chat_id': chat_id
-        }), 200
+        }, 200
         
+    except chat_turns.ChatBusy:
+        raise
     except Exception as e:
-        return jsonify({'error': f'Chatbot error: {str(e)}'}), 500
+        return {'error': f'Chatbot error: {str(e)}'}, 500
 
 @app.route('/api/chat/history', methods=['GET'])
 @jwt_required()
 def get_chat_history():
     try:
         current_user_id = get_jwt_identity()
-        chats = list(chats_collection.find(
+        internal_fields = {field: 0 for field in INTERNAL_CHAT_FIELDS}
+        chats = routed(chats_collection, 'list').find(
             {'user_id': current_user_id},
-            {'messages': 0}  # Exclude messages for list view
-        ).sort('updated_at', -1))
+            {'messages': 0, **internal_fields},  # Exclude messages for list view
+            session=read_session()
+        ).sort('updated_at', -1)
+        archived_chats = routed(chats_archive_collection, 'list').find(
+            {'user_id': current_user_id},
+            {'messages_blob': 0, 'codec': 0, **internal_fields},
+            session=read_session()
+        ).sort('updated_at', -1)
         
-        # Convert ObjectId to string
-        for chat in chats:
-            chat['_id'] = str(chat['_id'])
-            
-        return jsonify({'chats': chats}), 200
+        # Merge hot and archived chats by recency, encoded chat by chat straight from the cursors
+        merged = heapq.merge(chats, archived_chats, key=lambda chat: chat['updated_at'], reverse=True)
+        return json_stream_response({}, 'chats', merged)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1108,16 +1832,12 @@ def get_chat_history():
 def get_chat_messages(chat_id):
     try:
         current_user_id = get_jwt_identity()
-        chat = chats_collection.find_one({
-            '_id': ObjectId(chat_id),
-            'user_id': current_user_id
-        })
+        chat = find_user_chat(chat_id, current_user_id)
         
         if not chat:
             return jsonify({'error': 'Chat bulunamadı'}), 404
             
-        chat['_id'] = str(chat['_id'])
-        return jsonify({'chat': chat}), 200
+        return json_response({'chat': public_chat(chat)})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1127,10 +1847,7 @@ def get_chat_messages(chat_id):
 def get_conversation_memory(chat_id):
     try:
         current_user_id = get_jwt_identity()
-        chat_session = chats_collection.find_one({
-            '_id': ObjectId(chat_id), 
-            'user_id': current_user_id
-        })
+        chat_session = find_user_chat(chat_id, current_user_id)
         
         if not chat_session:
             return jsonify({'error': 'Konuşma bulunamadı'}), 404
@@ -1152,11 +1869,13 @@ def get_conversation_memory(chat_id):
 def get_memory():
     try:
         current_user_id = get_jwt_identity()
-        memory = memories_collection.find_one({"user_id": current_user_id})
+        memory = routed(memories_collection, 'list').find_one({"user_id": current_user_id}, session=read_session())
         
         if memory:
-            # Remove MongoDB _id field
+            # Remove MongoDB _id field and the edit history (see memory_edits.py)
             memory.pop('_id', None)
+            for field in memory_edits.EDIT_FIELDS:
+                memory.pop(field, None)
             return jsonify({
                 'success': True,
                 'memory': memory
@@ -1187,30 +1906,37 @@ def update_memory():
         data = request.get_json()
         
         # Validate memory data structure
-        valid_categories = ['family_friends', 'favorites', 'opinions', 'skills', 'personality', 'health', 'others']
         memory_data = {}
         
-        for category in valid_categories:
+        for category in MEMORY_CATEGORIES:
             if category in data and isinstance(data[category], list):
                 memory_data[category] = data[category]
         
         if not memory_data:
             return jsonify({'success': False, 'message': 'Geçerli memory verisi bulunamadı'}), 400
         
+        existing_memory = memories_collection.find_one({"user_id": current_user_id})
+        # Remember what the user typed in or deleted, so rebuilding memory from chats keeps it
+        edits = memory_edits.record_edits(existing_memory, memory_data)
+        
         # Update or create memory document
+        memory_data.update(edits)
         memory_data['user_id'] = current_user_id
         memory_data['updated_at'] = datetime.now(timezone.utc)
         
-        existing_memory = memories_collection.find_one({"user_id": current_user_id})
         if existing_memory:
             memories_collection.update_one(
                 {"user_id": current_user_id},
-                {"$set": memory_data}
+                {"$set": memory_data, "$inc": {"version": 1}}
             )
         else:
             memory_data['created_at'] = datetime.now(timezone.utc)
+            memory_data['version'] = 1
             memories_collection.insert_one(memory_data)
         
+        update_search_index(search_index.reindex_memory, current_user_id,
+                            memories_collection.find_one({"user_id": current_user_id}), MEMORY_CATEGORIES)
+        
         return jsonify({'success': True, 'message': 'Memory başarıyla güncellendi'})
         
     except Exception as e:
@@ -1222,16 +1948,26 @@ def clear_memory():
     try:
         current_user_id = get_jwt_identity()
         memories_collection.delete_one({"user_id": current_user_id})
+        update_search_index(search_index.remove_memory, current_user_id)
         return jsonify({'success': True, 'message': 'Memory başarıyla temizlendi'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def default_persona(user_id):
+    return {
+        'user_id': user_id,
+        'role': 'friend',
+        'backstory': '',
+        'personality_traits': [],
+        'interests': []
+    }
+
 @app.route('/api/persona', methods=['GET'])
 @jwt_required()
 def get_persona():
     try:
         current_user_id = get_jwt_identity()
-        persona = personas_collection.find_one({"user_id": current_user_id})
+        persona = routed(personas_collection, 'list').find_one({"user_id": current_user_id}, session=read_session())
         
         if persona:
             # Remove MongoDB _id field
@@ -1244,13 +1980,7 @@ def get_persona():
             # Return default persona structure
             return jsonify({
                 'success': True,
-                'persona': {
-                    'user_id': current_user_id,
-                    'role': 'friend',
-                    'backstory': '',
-                    'personality_traits': [],
-                    'interests': []
-                }
+                'persona': default_persona(current_user_id)
             })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -1294,7 +2024,10 @@ def update_persona():
             persona_data['created_at'] = datetime.now(timezone.utc)
             personas_collection.insert_one(persona_data)
         
-        return jsonify({'success': True, 'message': 'AI kişiliği başarıyla güncellendi'})
+        # The role is a token claim
+        _, headers = refresh_claims(current_user_id, role=persona_data['role'])
+        
+        return jsonify({'success': True, 'message': 'AI kişiliği başarıyla güncellendi'}), 200, headers
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -1305,7 +2038,8 @@ def reset_persona():
     try:
         current_user_id = get_jwt_identity()
         personas_collection.delete_one({"user_id": current_user_id})
-        return jsonify({'success': True, 'message': 'AI kişiliği varsayılan ayarlara sıfırlandı'})
+        _, headers = refresh_claims(current_user_id, role='friend')
+        return jsonify({'success': True, 'message': 'AI kişiliği varsayılan ayarlara sıfırlandı'}), 200, headers
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -1323,10 +2057,7 @@ def add_message_feedback(chat_id, message_index):
             return jsonify({'error': 'Geçersiz feedback türü'}), 400
         
         # Find the chat and verify ownership
-        chat_session = chats_collection.find_one({
-            '_id': ObjectId(chat_id), 
-            'user_id': current_user_id
-        })
+        chat_session = find_user_chat(chat_id, current_user_id)
         
         if not chat_session:
             return jsonify({'error': 'Konuşma bulunamadı'}), 404
@@ -1343,16 +2074,23 @@ def add_message_feedback(chat_id, message_index):
             'timestamp': datetime.now(timezone.utc)
         }
         
+        # Remember which analytics bucket the reaction was counted in
+        rollup_bucket = feedback_analytics.current_bucket(get_persona_role(current_user_id))
+        
         # Use dot notation to update specific array element
         chats_collection.update_one(
             {'_id': ObjectId(chat_id)},
             {
                 '$set': {
-                    f'messages.{message_idx}.user_feedback': feedback_data
-                }
+                    f'messages.{message_idx}.user_feedback': {**feedback_data, 'rollup_bucket': rollup_bucket}
+                },
+                '$inc': {'revision': 1}
             }
         )
         
+        update_analytics(feedback_analytics.record_reaction,
+                         messages[message_idx].get('user_feedback'), feedback_type, rollup_bucket)
+        
         return jsonify({
             'success': True,
             'message': 'Feedback has been added successfully',
@@ -1369,10 +2107,7 @@ def remove_message_feedback(chat_id, message_index):
         current_user_id = get_jwt_identity()
         
         # Find the chat and verify ownership
-        chat_session = chats_collection.find_one({
-            '_id': ObjectId(chat_id), 
-            'user_id': current_user_id
-        })
+        chat_session = find_user_chat(chat_id, current_user_id)
         
         if not chat_session:
             return jsonify({'error': 'Konuşma bulunamadı'}), 404
@@ -1389,10 +2124,14 @@ def remove_message_feedback(chat_id, message_index):
             {
                 '$unset': {
                     f'messages.{message_idx}.user_feedback': ""
-                }
+                },
+                '$inc': {'revision': 1}
             }
         )
         
+        update_analytics(feedback_analytics.record_reaction,
+                         messages[message_idx].get('user_feedback'), None, None)
+        
         return jsonify({
             'success': True,
             'message': 'Feedback has been removed successfully'
@@ -1401,24 +2140,153 @@ def remove_message_feedback(chat_id, message_index):
     except Exception as e:
         return jsonify({'error': f'Feedback could not be removed: {str(e)}'}), 500
 
+@app.route('/api/chat/<chat_id>/message/<message_index>/regenerate', methods=['POST'])
+@jwt_required()
+@rate_limited('chat')
+def regenerate_message(chat_id, message_index):
+    """Re-run one pipeline stage of an answer and the stages after it, reusing the stored earlier outputs.
+    
+    Body (optional): {'stage': 'analysis' | 'strategy' | 'implementation' | 'fallback', 'instruction': '...'}
+    The stage defaults to the answer's last one, so a plain regenerate is a single LLM call.
+    """
+    try:
+        current_user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        
+        if get_usage_budget_status(current_user_id) == 'hard':
+            return jsonify({'error': 'Daily usage limit reached'}), 429, {
+                'Retry-After': str(usage_ledger.seconds_until_reset())
+            }
+        
+        # Find the chat and verify ownership (this also moves an archived chat back)
+        if not ObjectId.is_valid(chat_id) or not find_user_chat(chat_id, current_user_id):
+            return jsonify({'error': 'Konuşma bulunamadı'}), 404
+        
+        query = {'_id': ObjectId(chat_id), 'user_id': current_user_id}
+        instruction = (data.get('instruction') or '').strip()[:500]
+        turn_fingerprint = chat_turns.fingerprint(current_user_id, chat_id,
+                                                  f"regenerate:{message_index}:{data.get('stage')}:{instruction}")
+        
+        with load_controller.admit():
+            # Waits for a turn running on this chat, so the answer is not rewritten underneath it
+            with chat_turns.turn_lease(chats_collection, query, turn_fingerprint, CHAT_TURN_SETTINGS):
+                with usage_ledger.collect() as stage_usage:
+                    payload, status_code = regenerate_answer(current_user_id, chats_collection.find_one(query),
+                                                             int(message_index), data.get('stage'), instruction,
+                                                             stage_usage)
+        return jsonify(payload), status_code
+        
+    except chat_turns.ChatBusy as e:
+        return jsonify({'error': str(e)}), 409, {'Retry-After': '5'}
+    except Exception as e:
+        return jsonify({'error': f'Answer could not be regenerated: {str(e)}'}), 500
+
+def regenerate_answer(current_user_id, chat_session, message_idx, stage, instruction, stage_usage):
+    """Regenerate the assistant message at `message_idx`; returns (response payload, status code)"""
+    messages = chat_session.get('messages', []) if chat_session else []
+    if not 0 < message_idx < len(messages) or messages[message_idx].get('role') != 'assistant':
+        return {'error': 'Mesaj bulunamadı'}, 404
+    
+    message = messages[message_idx]
+    stage_outputs = message.get('stage_outputs')
+    if not stage_outputs or messages[message_idx - 1].get('role') != 'user':
+        return {'error': 'This answer was saved without its stage outputs and cannot be regenerated'}, 409
+    
+    stages = ['fallback'] if 'fallback' in stage_outputs else CHAT_STAGES
+    finished = [name for name in stages if stage_outputs.get(name)]
+    stage = stage or (finished[-1] if finished else stages[0])
+    if stage not in stages:
+        return {'error': f"Stage must be one of: {', '.join(stages)}"}, 400
+    position = stages.index(stage)
+    if not all(stage_outputs.get(upstream) for upstream in stages[:position]):
+        return {'error': 'An earlier stage of this answer did not finish; regenerate that stage instead'}, 409
+    
+    # The prompt context of the original turn: the same question and the history before it
+    user_message = messages[message_idx - 1]['content']
+    persona_data = routed(personas_collection, 'context').find_one({'user_id': current_user_id},
+                                                                   session=read_session())
+    persona_response_style = get_persona_response_style(persona_data, get_user_feedback_history(current_user_id))
+    context = {
+        'persona_context': get_user_persona_context(current_user_id, persona_data),
+        'persona_style_prompt': build_persona_style_prompt(persona_data, persona_response_style),
+        'history_messages': get_conversation_messages({'messages': messages[:message_idx - 1]}),
+        # No relevance check: regeneration is meant to cost only the stage calls
+        'memory_context': get_user_memory_context(current_user_id, user_message, check_relevance=False),
+        'related_context': get_related_chats_context(current_user_id, user_message, str(chat_session['_id']))
+                           if stage == 'analysis' else ""
+    }
+    
+    new_outputs = {upstream: stage_outputs[upstream] for upstream in stages[:position]}
+    try:
+        run_pipeline_stages(stages[position:], llm_deadlines.Deadline(CHAT_DEADLINE_SECONDS), context,
+                            user_message, new_outputs, instruction or None)
+    except Exception as e:
+        # Like a turn, keep the stages that finished; without the chosen one there is nothing new
+        if stage not in new_outputs:
+            update_usage_ledger(current_user_id, persona_data.get('role') if persona_data else None, stage_usage, turns=0)
+            return {'error': f'Answer could not be regenerated: {str(e)}'}, 503
+        print(f"Regeneration stopped early: {e}")
+    
+    final_response = compose_answer(new_outputs)
+    if message.get('video_suggestion'):
+        final_response += format_video_suggestion(message['video_suggestion'])
+    
+    # The reaction was to the old answer, so it goes with it. Feedback changes do not
+    # bump the version, so the filter also checks the reaction is still the one read.
+    old_feedback = message.get('user_feedback')
+    now = datetime.now(timezone.utc)
+    result = chats_collection.update_one(
+        {'_id': chat_session['_id'], 'version': chat_session.get('version'),
+         f'messages.{message_idx}.user_feedback': old_feedback},
+        {
+            '$unset': {f'messages.{message_idx}.user_feedback': ''},
+            '$set': {
+                f'messages.{message_idx}.content': final_response,
+                f'messages.{message_idx}.stage_outputs': new_outputs,
+                f'messages.{message_idx}.regenerated': {
+                    'stage': stage,
+                    'instruction': instruction or None,
+                    'stage_usage': {name: dict(usage) for name, usage in stage_usage.items()},
+                    'timestamp': now
+                },
+                'updated_at': now
+            },
+            '$inc': {'version': 1, 'revision': 1}
+        }
+    )
+    update_usage_ledger(current_user_id, persona_data.get('role') if persona_data else None, stage_usage, turns=0)
+    if not result.matched_count:
+        raise chat_turns.ChatBusy('This chat changed while the answer was being regenerated; please try again')
+    if old_feedback:
+        update_analytics(feedback_analytics.record_reaction, old_feedback, None, None)
+    
+    update_search_index(search_index.index_message, current_user_id, str(chat_session['_id']), message_idx,
+                        dict(message, content=final_response))
+    
+    return {
+        'message': final_response,
+        'chat_id': str(chat_session['_id']),
+        'message_index': message_idx,
+        'regenerated_stages': stages[position:]
+    }, 200
+
 @app.route('/api/diary', methods=['GET'])
 @jwt_required()
 def get_diary_entries():
     try:
         current_user_id = get_jwt_identity()
-        diary_entries = list(diary_collection.find({'user_id': current_user_id}).sort('date', -1))
-        
-        # Convert ObjectId to string
-        for entry in diary_entries:
-            entry['_id'] = str(entry['_id'])
+        diary_entries = routed(diary_collection, 'list').find(
+            {'user_id': current_user_id}, session=read_session()
+        ).sort('date', -1)
         
-        return jsonify({'diary_entries': diary_entries}), 200
+        return json_stream_response({}, 'diary_entries', diary_entries)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/diary', methods=['POST'])
 @jwt_required()
+@rate_limited('diary')
 def create_diary_entry():
     try:
         current_user_id = get_jwt_identity()
@@ -1428,7 +2296,7 @@ def create_diary_entry():
         if not chat_id:
             return jsonify({'error': 'Chat ID is required'}), 400
         
-        chat_session = chats_collection.find_one({'_id': ObjectId(chat_id), 'user_id': current_user_id})
+        chat_session = find_user_chat(chat_id, current_user_id)
         
         if not chat_session:
             return jsonify({'error': 'Chat not found'}), 404
@@ -1449,6 +2317,10 @@ def create_diary_entry():
         }
         
         result = diary_collection.insert_one(diary_entry)
+        update_search_index(search_index.index_diary_entry, current_user_id, str(result.inserted_id), chat_id,
+                            diary_entry['title'], diary_entry['summary'], diary_entry['created_at'])
+        update_related_index(related_chats.index_entry, current_user_id, str(result.inserted_id), chat_id,
+                             diary_entry['title'], diary_entry['summary'], diary_entry['date'])
         
         return jsonify({
             'success': True,
@@ -1488,6 +2360,8 @@ def delete_diary_entry(entry_id):
     try:
         current_user_id = get_jwt_identity()
         diary_collection.delete_one({'_id': ObjectId(entry_id), 'user_id': current_user_id})
+        update_search_index(search_index.remove_diary_entry, current_user_id, entry_id)
+        update_related_index(related_chats.remove_entry, current_user_id, entry_id)
         
         return jsonify({'success': True, 'message': 'Diary entry deleted successfully'}), 200
         
@@ -1503,11 +2377,11 @@ def get_feedback():
         feedback = feedback_collection.find_one({"user_id": current_user_id})
         
         if feedback:
-            # Remove MongoDB _id field
+            # Remove MongoDB _id and internal analytics fields
             feedback.pop('_id', None)
             return jsonify({
                 'success': True,
-                'feedback': feedback
+                'feedback': public_feedback(feedback)
             })
         else:
             # Return empty feedback structure
@@ -1546,10 +2420,7 @@ def update_feedback():
                 return jsonify({'success': False, 'message': f'Missing field: {field}'}), 400
         
         # Validate rating values (1-5)
-        rating_fields = ['design', 'usability', 'response_quality', 'speed', 
-                        'personalization', 'conversation_naturalness', 'usefulness']
-        
-        for field in rating_fields:
+        for field in feedback_analytics.RATING_DIMENSIONS:
             if not isinstance(data[field], int) or data[field] < 1 or data[field] > 5:
                 return jsonify({'success': False, 'message': f'{field} must be an integer between 1 and 5'}), 400
         
@@ -1564,7 +2435,9 @@ def update_feedback():
             'conversation_naturalness': data['conversation_naturalness'],
             'usefulness': data['usefulness'],
             'overall_satisfaction': data['overall_satisfaction'],
-            'updated_at': datetime.now(timezone.utc)
+            'updated_at': datetime.now(timezone.utc),
+            # Remember which analytics bucket these ratings were counted in
+            'rollup_bucket': feedback_analytics.current_bucket(get_persona_role(current_user_id))
         }
         
         # Check if feedback exists
@@ -1583,13 +2456,196 @@ def update_feedback():
             feedback_collection.insert_one(feedback_data)
             message = 'Feedback created successfully'
         
+        update_analytics(feedback_analytics.record_ratings,
+                         existing_feedback, feedback_data, feedback_data['rollup_bucket'])
+        
         return jsonify({'success': True, 'message': message})
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# Admin analytics endpoint
+@app.route('/api/admin/analytics/feedback', methods=['GET'])
+@jwt_required()
+def get_feedback_analytics():
+    try:
+        current_user_id = get_jwt_identity()
+        if not is_admin(current_user_id):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        days = min(max(request.args.get('days', 30, type=int), 1), 365)
+        
+        # Served from precomputed rollups, never from the raw feedback/chats collections
+        return jsonify(feedback_analytics.get_rollups(analytics_collection, days)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/metrics/outbound', methods=['GET'])
+@jwt_required()
+def get_outbound_metrics():
+    try:
+        current_user_id = get_jwt_identity()
+        if not is_admin(current_user_id):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify({'transports': outbound_http.metrics.snapshot()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/metrics/load', methods=['GET'])
+@jwt_required()
+def get_load_metrics():
+    try:
+        current_user_id = get_jwt_identity()
+        if not is_admin(current_user_id):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify({'chat': load_controller.snapshot()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/usage/top', methods=['GET'])
+@jwt_required()
+def get_top_consumers():
+    try:
+        current_user_id = get_jwt_identity()
+        if not is_admin(current_user_id):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        days = min(max(request.args.get('days', 1, type=int), 1), 90)
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        
+        return jsonify({
+            'days': days,
+            'budgets': {'soft_tokens': USAGE_SOFT_BUDGET_TOKENS, 'hard_tokens': USAGE_HARD_BUDGET_TOKENS},
+            'consumers': usage_ledger.top_consumers(usage_collection, days, limit)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Start-up data for the frontend's first screen, gathered in one request
+BOOTSTRAP_CHAT_LIMIT = int(os.getenv('BOOTSTRAP_CHAT_LIMIT', '20'))
+bootstrap_executor = ThreadPoolExecutor(max_workers=int(os.getenv('BOOTSTRAP_WORKERS', '8')),
+                                        thread_name_prefix='bootstrap')
+
+def bootstrap_user(user_id, session):
+    user = routed(users_collection, 'list').find_one({'_id': ObjectId(user_id)}, USER_PROFILE_FIELDS, session=session)
+    return user_profile(user) if user else None
+
+def bootstrap_persona(user_id, session):
+    persona = routed(personas_collection, 'list').find_one({'user_id': user_id}, {'_id': 0}, session=session)
+    return persona or default_persona(user_id)
+
+def bootstrap_chats(user_id, session):
+    """First page of chat history, hot and archived chats merged by recency"""
+    projection = {'title': 1, 'created_at': 1, 'updated_at': 1}
+    chats = routed(chats_collection, 'list').find(
+        {'user_id': user_id}, projection, session=session
+    ).sort('updated_at', -1).limit(BOOTSTRAP_CHAT_LIMIT)
+    archived_chats = routed(chats_archive_collection, 'list').find(
+        {'user_id': user_id}, projection, session=session
+    ).sort('updated_at', -1).limit(BOOTSTRAP_CHAT_LIMIT)
+    merged = heapq.merge(chats, archived_chats, key=lambda chat: chat['updated_at'], reverse=True)
+    return list(itertools.islice(merged, BOOTSTRAP_CHAT_LIMIT))
+
+BOOTSTRAP_SECTIONS = {
+    'user': bootstrap_user,
+    'persona': bootstrap_persona,
+    'chats': bootstrap_chats,
+}
+
+def run_bootstrap_read(load, user_id, session):
+    try:
+        return load(user_id, session)
+    finally:
+        if session is not None:
+            session.end_session()
+
+@app.route('/api/bootstrap', methods=['GET'])
+@jwt_required()
+def bootstrap():
+    try:
+        current_user_id = get_jwt_identity()
+        
+        # Current claims already hold the profile, so the user section needs no read
+        claims = current_claims()
+        sections = dict(BOOTSTRAP_SECTIONS)
+        if claims:
+            sections.pop('user')
+        
+        # The sections are independent, so their reads run concurrently, each in its own session
+        futures = {
+            section: bootstrap_executor.submit(run_bootstrap_read, load, current_user_id, fork_read_session())
+            for section, load in sections.items()
+        }
+        payload = {section: future.result() for section, future in futures.items()}
+        if claims:
+            payload['user'] = user_profile(dict(claims[profile_claims.CLAIM], _id=current_user_id))
+        
+        if payload['user'] is None:
+            return jsonify({'error': 'User not found'}), 404
+        
+        return json_response(payload, etag=True)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Search endpoint
+@app.route('/api/search', methods=['GET'])
+@jwt_required()
+def search():
+    try:
+        current_user_id = get_jwt_identity()
+        query = request.args.get('q', '').strip()
+        
+        if not query:
+            return jsonify({'error': 'Search query is required'}), 400
+        
+        kinds = [kind for kind in request.args.get('types', '').split(',') if kind in search_index.SEARCH_KINDS]
+        page = request.args.get('page', 1, type=int)
+        page_size = request.args.get('page_size', 20, type=int)
+        
+        results = search_index.search(search_collection, current_user_id, query,
+                                      kinds=kinds, page=page, page_size=page_size)
+        
+        return jsonify(results), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Data export endpoint
+@app.route('/api/export', methods=['GET'])
+@jwt_required()
+def export_user_data():
+    try:
+        current_user_id = get_jwt_identity()
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+        filename = 'export.ndjson.gz' if compress else 'export.ndjson'
+        headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+        mimetype = 'application/gzip' if compress else 'application/x-ndjson'
+
+        # Stream straight from the cursors instead of building the export in memory
+        return Response(iter_export(db, current_user_id, compress=compress),
+                        mimetype=mimetype, headers=headers)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == "__main__":
     import os
+    # Hashing workers spawned from here would re-run this module's set-up; serve.py
+    # starts them from a minimal entry point, so the development server hashes inline
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+    try:
+        prepare_instance()
+    except Exception as e:
+        # /api/ready retries it and reports not ready until it succeeds
+        print(f"Start-up preparation failed: {e}")
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
 
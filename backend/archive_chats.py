@@ -0,0 +1,45 @@
+"""Move chats idle past a threshold into the compressed archive collection.
+
+    python archive_chats.py --idle-days 90
+    python archive_chats.py --idle-days 30 --dry-run
+
+Archived chats are restored automatically when they are opened. Also makes
+sure the TTL indexes on ephemeral collections exist. Uses the same
+configuration (.env) as app.py.
+"""
+import argparse
+import sys
+import time
+
+import chat_archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive idle chats')
+    parser.add_argument('--idle-days', type=int, default=90, help='archive chats not updated for this many days')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many chats')
+    parser.add_argument('--dry-run', action='store_true', help='report sizes without moving anything')
+    args = parser.parse_args()
+
+    import app as webapp
+
+    webapp.ensure_ttl_indexes()
+
+    started = time.monotonic()
+    stats = chat_archive.archive_idle_chats(
+        webapp.chats_collection, webapp.chats_archive_collection, args.idle_days,
+        batch_size=args.batch_size, limit=args.limit, dry_run=args.dry_run
+    )
+    elapsed = time.monotonic() - started
+
+    ratio = stats['stored_bytes'] / stats['raw_bytes'] if stats['raw_bytes'] else 0
+    print(f"{'Would archive' if args.dry_run else 'Archived'} {stats['archived']} chats "
+          f"({stats['skipped']} skipped because they changed) in {elapsed:.1f}s")
+    print(f"Messages: {stats['raw_bytes'] / 1024:.1f}KB -> {stats['stored_bytes'] / 1024:.1f}KB "
+          f"({ratio:.0%}) using {chat_archive.current_codec()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,22 @@
+"""Count feedback and message reactions (archived chats included) written before analytics rollups existed.
+
+    python backfill_feedback_rollups.py
+
+Safe to run more than once: items that were already counted are skipped.
+Uses the same configuration (.env) as app.py.
+"""
+import sys
+
+import feedback_analytics
+
+
+def main():
+    import app as webapp
+
+    counted = feedback_analytics.backfill(webapp.db, webapp.analytics_collection)
+    print(f"Backfilled {counted['ratings']} feedback forms and {counted['reactions']} message reactions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
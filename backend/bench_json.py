@@ -0,0 +1,114 @@
+"""Micro-benchmark JSON encoding and compression on realistic chat documents.
+
+Compares Flask's default jsonify encoder with fast_json (stdlib fallback and
+orjson when installed), whole-document vs incremental array encoding, and
+gzip/brotli compression of the result.
+
+    python bench_json.py --chats 50 --messages 60 --repeat 20
+"""
+import argparse
+import gzip
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+
+import fast_json
+
+WORDS = ('today', 'mother', 'project', 'deadline', 'dog', 'house', 'wood', 'strategy', 'feel',
+         'tired', 'plan', 'interview', 'python', 'error', 'recipe', 'garden', 'exam', 'weekend')
+
+
+def make_text(words):
+    return ' '.join(random.choice(WORDS) for _ in range(words))
+
+
+def make_chat(message_count):
+    started = datetime.utcnow() - timedelta(days=random.randint(0, 300))
+    messages = []
+    for index in range(message_count):
+        message = {
+            'role': 'user' if index % 2 == 0 else 'assistant',
+            'content': make_text(30 if index % 2 == 0 else 350),
+            'timestamp': started + timedelta(minutes=index)
+        }
+        if index % 2 and random.random() < 0.3:
+            message['user_feedback'] = {'type': 'love', 'timestamp': started + timedelta(minutes=index, seconds=30)}
+        messages.append(message)
+
+    return {
+        '_id': ObjectId(),
+        'user_id': str(ObjectId()),
+        'title': make_text(4),
+        'created_at': started,
+        'updated_at': started + timedelta(minutes=message_count),
+        'messages': messages,
+        'conversation_memory': [make_text(8) for _ in range(5)]
+    }
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON encoding / compression micro-benchmark')
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(496)
+    chats = [make_chat(args.messages) for _ in range(args.chats)]
+    flask_app = Flask(__name__)
+
+    def flask_jsonify():
+        # What the endpoints did before: stringify _id, then the default provider
+        payload = [dict(chat, _id=str(chat['_id'])) for chat in chats]
+        return flask_app.json.dumps({'chats': payload}).encode('utf-8')
+
+    def fast_stdlib():
+        os.environ['JSON_SERIALIZER'] = 'json'
+        return fast_json.dumps({'chats': chats})
+
+    def fast_orjson():
+        os.environ['JSON_SERIALIZER'] = 'orjson'
+        return fast_json.dumps({'chats': chats})
+
+    def fast_incremental():
+        os.environ['JSON_SERIALIZER'] = 'orjson'
+        return b''.join(fast_json.iter_object_with_array({}, 'chats', chats))
+
+    print(f"{args.chats} chats x {args.messages} messages, best of {args.repeat}\n")
+    print(f"{'encoder':<24} {'time':>10} {'size':>12}")
+    cases = [('flask jsonify', flask_jsonify), ('fast_json (stdlib)', fast_stdlib)]
+    if fast_json.orjson is not None:
+        cases += [('fast_json (orjson)', fast_orjson), ('incremental (orjson)', fast_incremental)]
+
+    body = None
+    for name, fn in cases:
+        elapsed, body = timed(fn, args.repeat)
+        print(f"{name:<24} {elapsed:>8.2f}ms {len(body) / 1024:>10.1f}KB")
+
+    print(f"\n{'compression':<24} {'time':>10} {'size':>12}")
+    elapsed, compressed = timed(lambda: gzip.compress(body, compresslevel=6), args.repeat)
+    print(f"{'gzip (level 6)':<24} {elapsed:>8.2f}ms {len(compressed) / 1024:>10.1f}KB")
+    elapsed, compressed = timed(lambda: b''.join(fast_json.iter_compress(
+        fast_json.iter_object_with_array({}, 'chats', chats), 'gzip')), args.repeat)
+    print(f"{'encode + gzip stream':<24} {elapsed:>8.2f}ms {len(compressed) / 1024:>10.1f}KB")
+    if fast_json.brotli is not None:
+        elapsed, compressed = timed(lambda: fast_json.compress(body, 'br'), args.repeat)
+        print(f"{'brotli (quality 5)':<24} {elapsed:>8.2f}ms {len(compressed) / 1024:>10.1f}KB")
+
+
+if __name__ == '__main__':
+    main()
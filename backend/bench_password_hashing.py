@@ -0,0 +1,114 @@
+"""Benchmark login throughput alongside concurrent chat latency.
+
+Runs a burst of login-style password checks in request threads while other
+threads simulate light chat request handling, once with hashing inline and
+once with hashing on the process pool, and prints login throughput next to
+the chat latency percentiles.
+
+    python bench_password_hashing.py --login-threads 8 --chat-threads 4 --duration 5
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import password_hashing
+
+
+def simulated_chat_request():
+    """CPU work roughly like building prompts and serializing a chat response"""
+    messages = [
+        {'role': 'user' if i % 2 == 0 else 'assistant',
+         'content': 'Lorem ipsum dolor sit amet ' * 20,
+         'timestamp': datetime.now(timezone.utc).isoformat()}
+        for i in range(40)
+    ]
+    context = '\n'.join(f"{m['role'].upper()}: {m['content'][:300]}" for m in messages[-6:])
+    json.dumps({'messages': messages, 'context': context})
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(mode, stored_hash, login_threads, chat_threads, duration):
+    stop = threading.Event()
+    login_count = [0]
+    login_lock = threading.Lock()
+    chat_latencies = []
+    chat_lock = threading.Lock()
+
+    def login_worker():
+        while not stop.is_set():
+            if mode == 'inline':
+                check_password_hash(stored_hash, 'correct horse battery staple')
+            else:
+                try:
+                    password_hashing.verify_password(stored_hash, 'correct horse battery staple')
+                except password_hashing.PasswordHasherBusy:
+                    time.sleep(0.01)
+                    continue
+            with login_lock:
+                login_count[0] += 1
+
+    def chat_worker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            simulated_chat_request()
+            elapsed = time.perf_counter() - started
+            with chat_lock:
+                chat_latencies.append(elapsed * 1000)
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=login_worker) for _ in range(login_threads)]
+    threads += [threading.Thread(target=chat_worker) for _ in range(chat_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'mode': mode,
+        'logins_per_sec': login_count[0] / duration,
+        'chat_p50_ms': statistics.median(chat_latencies) if chat_latencies else 0.0,
+        'chat_p95_ms': percentile(chat_latencies, 95),
+        'chat_p99_ms': percentile(chat_latencies, 99),
+        'chat_requests': len(chat_latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--login-threads', type=int, default=8)
+    parser.add_argument('--chat-threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    stored_hash = generate_password_hash('correct horse battery staple',
+                                         method=password_hashing.get_hash_method())
+
+    # Launch the workers up front so process start-up is not counted
+    password_hashing.start()
+
+    print(f"{'mode':<8} {'logins/s':>10} {'chat p50':>10} {'chat p95':>10} {'chat p99':>10} {'chat reqs':>10}")
+    for mode in ('inline', 'pool'):
+        result = run(mode, stored_hash, args.login_threads, args.chat_threads, args.duration)
+        print(f"{result['mode']:<8} {result['logins_per_sec']:>10.1f} "
+              f"{result['chat_p50_ms']:>8.2f}ms {result['chat_p95_ms']:>8.2f}ms "
+              f"{result['chat_p99_ms']:>8.2f}ms {result['chat_requests']:>10}")
+
+    password_hashing.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark cold start: import of app.py to the first served request.
+
+Each run starts a fresh interpreter, imports app, and sends a first request
+through the Flask test client, with clients built lazily (default) and with
+EAGER_CLIENT_INIT=1 for comparison.
+
+    python bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r'''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/api/health')
+first_request = time.perf_counter()
+app.warm_up_clients()
+clients_ready = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'import_to_first_request_ms': (first_request - started) * 1000,
+    'client_init_ms': (clients_ready - first_request) * 1000,
+    'status': response.status_code
+}))
+'''
+
+
+def run_once(eager):
+    env = dict(os.environ)
+    # Placeholder credentials are enough: nothing here talks to the network
+    env.setdefault('JWT_SECRET_KEY', 'bench-secret')
+    env.setdefault('OPENAI_API_KEY', 'sk-bench')
+    env.setdefault('YOUTUBE_API_KEY', 'bench-youtube-key')
+    env['EAGER_CLIENT_INIT'] = '1' if eager else '0'
+
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'import':>10} {'1st request':>12} {'import->1st':>12} {'client init':>12}")
+    for eager in (False, True):
+        results = [run_once(eager) for _ in range(args.runs)]
+        median = {key: statistics.median(r[key] for r in results)
+                  for key in ('import_ms', 'first_request_ms', 'import_to_first_request_ms', 'client_init_ms')}
+        print(f"{'eager' if eager else 'lazy':<6} {median['import_ms']:>8.1f}ms {median['first_request_ms']:>10.1f}ms "
+              f"{median['import_to_first_request_ms']:>10.1f}ms {median['client_init_ms']:>10.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
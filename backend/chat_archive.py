@@ -0,0 +1,126 @@
+"""Tiered storage for cold chats.
+
+Chats idle for longer than a threshold move from `chats` to `chats_archive`.
+The chat fields stay queryable, but the embedded messages are stored as one
+compressed BSON blob, so old history no longer sits in the working set.
+Opening an archived chat moves it back (rehydrate), so the rest of the app
+only ever works with hot chats. Chats with turns in progress or messages
+pending memory extraction (memory_windows.py) stay hot until those finish.
+
+Every write to a chat increments its `revision` (messages, feedback,
+conversation memory, memory windows, turn leases). The hot copy is only
+removed if its revision is still the one that was archived, so a write that
+lands while a chat is being archived is never lost. `version` is not enough
+for this: it only counts appended turns and regenerations, and turns compare
+it on their own write, so other writers can not increment it.
+
+Archived document shape:
+    {_id, user_id, title, created_at, updated_at, conversation_memory, ...,
+     messages_blob: Binary, codec: "zstd" | "zlib", message_count, archived_at}
+"""
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import bson
+from bson.binary import Binary
+from pymongo.errors import DuplicateKeyError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def current_codec():
+    configured = os.getenv('ARCHIVE_CODEC', 'zstd')
+    return 'zstd' if configured == 'zstd' and zstandard is not None else 'zlib'
+
+
+def compress_messages(messages):
+    codec = current_codec()
+    raw = bson.encode({'messages': messages})
+    if codec == 'zstd':
+        return Binary(zstandard.ZstdCompressor(level=10).compress(raw)), codec
+    return Binary(zlib.compress(raw, 9)), codec
+
+
+def decompress_messages(blob, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read this archived chat')
+        raw = zstandard.ZstdDecompressor().decompress(bytes(blob))
+    else:
+        raw = zlib.decompress(bytes(blob))
+    return bson.decode(raw)['messages']
+
+
+def to_archive_document(chat):
+    archived = {key: value for key, value in chat.items() if key != 'messages'}
+    messages = chat.get('messages', [])
+    archived['messages_blob'], archived['codec'] = compress_messages(messages)
+    archived['message_count'] = len(messages)
+    archived['archived_at'] = datetime.now(timezone.utc)
+    return archived
+
+
+def from_archive_document(archived):
+    chat = {key: value for key, value in archived.items()
+            if key not in ('messages_blob', 'codec', 'message_count', 'archived_at')}
+    chat['messages'] = decompress_messages(archived['messages_blob'], archived['codec'])
+    return chat
+
+
+def ensure_indexes(archive):
+    archive.create_index([('user_id', 1), ('updated_at', -1)], name='user_updated_at')
+
+
+def archive_idle_chats(chats, archive, idle_days, batch_size=100, limit=0, dry_run=False):
+    """Move chats idle for more than `idle_days` into the archive collection"""
+    ensure_indexes(archive)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=idle_days)
+    stats = {'archived': 0, 'skipped': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+
+    # A chat with a turn in progress is not idle, whatever its updated_at says. Nor is one
+    # with messages waiting for batched memory extraction, which only reads hot chats.
+    cursor = chats.find({'updated_at': {'$lt': cutoff}, 'turn_lease': None, 'memory_pending': {'$in': [None, 0]}})
+    cursor = cursor.sort('updated_at', 1).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    for chat in cursor:
+        archived = to_archive_document(chat)
+        stats['raw_bytes'] += len(bson.encode({'messages': chat.get('messages', [])}))
+        stats['stored_bytes'] += len(archived['messages_blob'])
+        if dry_run:
+            stats['archived'] += 1
+            continue
+
+        archive.replace_one({'_id': chat['_id']}, archived, upsert=True)
+
+        # Only remove the hot copy if nobody wrote to the chat in the meantime
+        # (a chat written before revisions existed has none, which matches None)
+        removed = chats.delete_one({'_id': chat['_id'], 'revision': chat.get('revision')})
+        if removed.deleted_count:
+            stats['archived'] += 1
+        else:
+            archive.delete_one({'_id': chat['_id']})
+            stats['skipped'] += 1
+
+    return stats
+
+
+def rehydrate(chats, archive, query):
+    """Move an archived chat matching `query` back to the hot collection and return it"""
+    archived = archive.find_one(query)
+    if not archived:
+        return None
+
+    chat = from_archive_document(archived)
+    try:
+        chats.insert_one(chat)
+    except DuplicateKeyError:
+        # Another request restored it first
+        chat = chats.find_one({'_id': archived['_id']})
+    archive.delete_one({'_id': archived['_id']})
+    return chat
@@ -0,0 +1,191 @@
+"""Serialize chat turns per chat and coalesce duplicate submissions.
+
+Two posts to the same chat (a double-click, two tabs) used to read the same
+chat document, run the pipeline on the same stale context and append their
+messages in arbitrary order. Now:
+
+- A turn on an existing chat holds a lease on the chat document
+  (turn_lease: {owner, fingerprint, expires_at}) for its whole run. Other
+  turns on that chat wait for it; turns in the same process wait on a lock
+  instead of polling. An expired lease (crashed worker) can be taken over.
+- The chat has a `version` that every message append increments. A turn
+  appends only if the version is still the one it read, so even a turn whose
+  lease expired cannot interleave with another one.
+- A submission of the same text while an identical one is running is
+  coalesced: in the same process it waits for the running turn and returns
+  its result; in another process it finds the finished turn in `last_turn`
+  once it gets the lease, and returns that answer instead of running again.
+
+Every write here also increments the chat's `revision` (see chat_archive.py).
+
+Chat fields:
+    version, revision, turn_lease: {owner, fingerprint, expires_at},
+    last_turn: {fingerprint, message_index, finished_at}
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+POLL_INTERVAL = 0.2
+
+# Identical turns being computed by this process: key -> {'done': Event, 'result': ...}
+_local_turns = {}
+_local_turns_lock = threading.Lock()
+
+# Per-chat locks for turns in this process: chat id -> [lock, users]
+_chat_locks = {}
+_chat_locks_lock = threading.Lock()
+
+
+class ChatBusy(Exception):
+    """Another turn on the chat is still running after the wait timeout"""
+
+
+def settings(deadline_seconds):
+    return {
+        # A lease must outlive the longest turn, or a slow turn loses it to a waiting one
+        'lease': float(os.getenv('CHAT_TURN_LEASE_SECONDS', str(deadline_seconds + 30))),
+        'wait': float(os.getenv('CHAT_TURN_WAIT_SECONDS', str(deadline_seconds + 15))),
+        'coalesce_window': float(os.getenv('CHAT_TURN_COALESCE_SECONDS', '120'))
+    }
+
+
+def fingerprint(user_id, chat_id, message):
+    digest = hashlib.sha256()
+    for part in (user_id, chat_id or '', (message or '').strip()):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def coalesce(key, compute):
+    """Run compute() once for concurrent calls with the same key in this process.
+
+    Returns (result, coalesced): followers get the leader's result with coalesced=True.
+    """
+    with _local_turns_lock:
+        running = _local_turns.get(key)
+        if running is None:
+            running = _local_turns[key] = {'done': threading.Event(), 'result': None}
+            leader = True
+        else:
+            leader = False
+
+    if not leader:
+        running['done'].wait()
+        if running['result'] is not None:
+            return running['result'], True
+        # The leader raised; run on our own
+        return compute(), False
+
+    try:
+        running['result'] = compute()
+        return running['result'], False
+    finally:
+        with _local_turns_lock:
+            _local_turns.pop(key, None)
+        running['done'].set()
+
+
+@contextmanager
+def _local_chat_lock(chat_key, timeout):
+    """Per-chat lock for this process; yields whether another turn held it first"""
+    with _chat_locks_lock:
+        entry = _chat_locks.setdefault(chat_key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        waited = not entry[0].acquire(blocking=False)
+        if waited and not entry[0].acquire(timeout=timeout):
+            raise ChatBusy('Another message in this chat is still being answered')
+        try:
+            yield waited
+        finally:
+            entry[0].release()
+    finally:
+        with _chat_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                _chat_locks.pop(chat_key, None)
+
+
+def _acquire_lease(collection, query, owner, turn_fingerprint, lease_seconds):
+    now = datetime.now(timezone.utc)
+    result = collection.update_one(
+        dict(query, **{'$or': [{'turn_lease': None}, {'turn_lease.expires_at': {'$lt': now}}]}),
+        {'$set': {'turn_lease': {
+            'owner': owner,
+            'fingerprint': turn_fingerprint,
+            'expires_at': now + timedelta(seconds=lease_seconds)
+        }}, '$inc': {'revision': 1}}
+    )
+    return bool(result.matched_count)
+
+
+@contextmanager
+def turn_lease(collection, query, turn_fingerprint, settings):
+    """Hold the chat's turn lease; yields whether another turn had to finish first.
+
+    `query` selects the chat ({_id, user_id}); the caller makes sure it exists.
+    Raises ChatBusy after settings['wait'] seconds.
+    """
+    deadline = time.monotonic() + settings['wait']
+    owner = uuid.uuid4().hex
+
+    with _local_chat_lock(str(query['_id']), settings['wait']) as waited:
+        while not _acquire_lease(collection, query, owner, turn_fingerprint, settings['lease']):
+            waited = True
+            if time.monotonic() >= deadline:
+                raise ChatBusy('Another message in this chat is still being answered')
+            time.sleep(POLL_INTERVAL)
+        try:
+            yield waited
+        finally:
+            collection.update_one({'_id': query['_id'], 'turn_lease.owner': owner},
+                                  {'$unset': {'turn_lease': ''}, '$inc': {'revision': 1}})
+
+
+def finished_duplicate(chat, turn_fingerprint, coalesce_window):
+    """The assistant message of a just-finished identical turn in `chat`, or None"""
+    last_turn = chat.get('last_turn') or {}
+    if last_turn.get('fingerprint') != turn_fingerprint or not last_turn.get('finished_at'):
+        return None
+    finished_at = last_turn['finished_at']
+    if finished_at.tzinfo is None:
+        finished_at = finished_at.replace(tzinfo=timezone.utc)
+    if (datetime.now(timezone.utc) - finished_at).total_seconds() > coalesce_window:
+        return None
+    messages = chat.get('messages', [])
+    index = last_turn.get('message_index', -1) + 1
+    if 0 < index < len(messages) and messages[index].get('role') == 'assistant':
+        return messages[index]
+    return None
+
+
+def append_turn(collection, chat, messages, turn_fingerprint):
+    """Append the turn's messages if the chat is still at the version that was read.
+
+    Returns the index of the first appended message, or None if the chat changed meanwhile.
+    """
+    first_index = len(chat.get('messages', []))
+    now = datetime.now(timezone.utc)
+    result = collection.update_one(
+        # A missing version (chats created before versioning) matches None
+        {'_id': chat['_id'], 'version': chat.get('version')},
+        {
+            '$push': {'messages': {'$each': messages}},
+            '$set': {
+                'updated_at': now,
+                'last_turn': {
+                    'fingerprint': turn_fingerprint,
+                    'message_index': first_index,
+                    'finished_at': now
+                }
+            },
+            '$inc': {'version': 1, 'revision': 1}
+        }
+    )
+    return first_index if result.matched_count else None
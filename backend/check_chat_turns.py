@@ -0,0 +1,141 @@
+"""Check that concurrent turns on one chat are serialized and duplicates coalesced.
+
+    python check_chat_turns.py --concurrency 8
+    STORAGE_BACKEND=sqlite SQLITE_PATH=/tmp/turns.sqlite3 python check_chat_turns.py
+
+Uses the fake LLM with some latency so turns really overlap, and runs in a
+local scratch database (--db, default webapp_turns_check; see
+scratch_database.py). Scenarios:
+  - distinct messages posted to one chat at once: every turn is appended
+    whole, in some order, each answer right after its own question, and the
+    chat version counts the turns
+  - the same message posted at once (double-click): one pipeline run, the
+    other requests get its answer marked coalesced
+  - the same message from several workers (bypassing in-process
+    coalescing): still one turn, found through the chat's last_turn
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import scratch_database
+
+
+def check_chat(chat, expected_turns, failures, label):
+    messages = chat.get('messages', [])
+    if len(messages) != 2 * expected_turns:
+        failures.append(f'{label}: {len(messages)} messages, expected {2 * expected_turns}')
+    for index, message in enumerate(messages):
+        expected_role = 'user' if index % 2 == 0 else 'assistant'
+        if message.get('role') != expected_role:
+            failures.append(f"{label}: message {index} is {message.get('role')}, expected {expected_role}")
+        elif expected_role == 'assistant' and messages[index - 1]['content'] not in message['content']:
+            # The fake LLM echoes the question, so an answer must follow its own question
+            failures.append(f'{label}: answer {index} does not belong to question {index - 1}')
+    if chat.get('version') != expected_turns:
+        failures.append(f"{label}: version {chat.get('version')}, expected {expected_turns}")
+    if chat.get('turn_lease'):
+        failures.append(f'{label}: turn lease left behind')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check per-chat turn serialization')
+    parser.add_argument('--concurrency', type=int, default=6)
+    parser.add_argument('--latency-ms', type=int, default=150, help='fake LLM latency per call')
+    scratch_database.add_arguments(parser, 'webapp_turns_check')
+    args = parser.parse_args()
+
+    scratch_database.select(args)
+    os.environ['LLM_PROVIDER'] = 'fake'
+    os.environ['FAKE_LLM_LATENCY_MS'] = str(args.latency_ms)
+    os.environ['LLM_HEDGING'] = '0'
+    os.environ.setdefault('JWT_SECRET_KEY', 'chat-turns-check-secret-of-enough-length')
+    # Every turn of a scenario waits behind the others
+    os.environ.setdefault('CHAT_TURN_WAIT_SECONDS', '600')
+    # The per-user rate limits would turn concurrent posts into 429s
+    os.environ['RATE_LIMITS'] = json.dumps({'chat': {'requests': 10000, 'per_seconds': 60, 'burst': 10000,
+                                                     'concurrency': 10000}})
+
+    import app as webapp
+    from bson import ObjectId
+
+    refusal = scratch_database.refusal(webapp, args)
+    if refusal:
+        print(f'Refusing to run: {refusal}')
+        return 2
+    webapp.client.drop_database(webapp.db.name)
+    webapp.youtube = None
+
+    user_id = str(webapp.users_collection.insert_one({'username': 'turns-check'}).inserted_id)
+    webapp.personas_collection.insert_one({'user_id': user_id, 'role': 'friend'})
+    with webapp.app.app_context():
+        auth = {'Authorization': f'Bearer {webapp.create_access_token(identity=user_id)}'}
+
+    def post(message, chat_id):
+        test_client = webapp.app.test_client()
+        response = test_client.post('/api/chat', json={'message': message, 'chat_id': chat_id}, headers=auth)
+        return response.status_code, response.get_json()
+
+    def get_chat(chat_id):
+        return webapp.chats_collection.find_one({'_id': ObjectId(chat_id)})
+
+    failures = []
+    status, body = post('first message', None)
+    chat_id = body.get('chat_id')
+    if status != 200:
+        print(f'Could not start a chat: {status} {body}')
+        return 1
+
+    # Distinct messages at once
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(lambda n: post(f'question {n}', chat_id), range(args.concurrency)))
+    for status, body in results:
+        if status != 200:
+            failures.append(f'distinct: request failed with {status} {body}')
+    check_chat(get_chat(chat_id), 1 + args.concurrency, failures, 'distinct')
+
+    # The same message at once (double-click)
+    turns_before = len(get_chat(chat_id)['messages']) // 2
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(lambda n: post('same question', chat_id), range(args.concurrency)))
+    answers = {body.get('message') for status, body in results if status == 200}
+    coalesced = sum(1 for status, body in results if body.get('coalesced'))
+    if len(answers) != 1 or any(status != 200 for status, body in results):
+        failures.append(f'duplicates: expected one answer for all, got {[status for status, _ in results]}')
+    if coalesced != args.concurrency - 1:
+        failures.append(f'duplicates: {coalesced} coalesced responses, expected {args.concurrency - 1}')
+    check_chat(get_chat(chat_id), turns_before + 1, failures, 'duplicates')
+
+    # The same message from several workers: no shared in-process state but the chat lock
+    turns_before = len(get_chat(chat_id)['messages']) // 2
+    data = {'message': 'cross worker question', 'chat_id': chat_id}
+    turn_fingerprint = webapp.chat_turns.fingerprint(user_id, chat_id, data['message'])
+    barrier = threading.Barrier(args.concurrency)
+
+    def worker(_):
+        with webapp.app.test_request_context('/api/chat', method='POST', headers=auth):
+            barrier.wait()
+            return webapp.serialized_chat_turn(user_id, data, False, webapp.load_shedding.FULL, turn_fingerprint)
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(worker, range(args.concurrency)))
+    coalesced = sum(1 for payload, status in results if payload.get('coalesced'))
+    if coalesced != args.concurrency - 1:
+        failures.append(f'workers: {coalesced} coalesced responses, expected {args.concurrency - 1}')
+    check_chat(get_chat(chat_id), turns_before + 1, failures, 'workers')
+
+    webapp.client.drop_database(webapp.db.name)
+    if failures:
+        print(f'{len(failures)} problems:')
+        for failure in failures:
+            print(f'  {failure}')
+        return 1
+    print(f'{args.concurrency} concurrent posts per scenario: turns serialized, duplicates coalesced')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
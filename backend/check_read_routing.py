@@ -0,0 +1,150 @@
+"""Check read routing and read-your-own-writes against a replica set.
+
+A single-host replica set is enough. List and context reads stay on the
+primary unless configured otherwise, so the check routes them with
+secondaryPreferred unless READ_PREFERENCE_LIST / READ_PREFERENCE_CONTEXT are
+set:
+
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0 --fork --logpath /tmp/rs0.log
+    mongosh --port 27018 --eval 'rs.initiate()'
+    MONGODB_URI='mongodb://localhost:27018/?replicaSet=rs0' python check_read_routing.py --rounds 50
+
+Through the Flask test client it repeatedly updates the memory document and
+reads it back with the returned X-Read-After token, and checks that:
+  - every successful write returns a token,
+  - every read sees the value just written,
+  - list reads use the configured read preference and carry an
+    afterClusterTime read concern once a token was sent.
+Runs in a local scratch database (--db, default webapp_routing_check; see
+scratch_database.py).
+
+Not yet run against a replica set, which is why read_routing.py keeps
+every read class on the primary by default. A failure may still be a bug in
+the check itself rather than in the routing.
+"""
+import argparse
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+
+from pymongo import monitoring
+
+import scratch_database
+
+
+class ReadCommandLog(monitoring.CommandListener):
+    def __init__(self):
+        self.database = None
+        self.reads = []
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.database_name != self.database or event.command_name not in ('find', 'aggregate'):
+            return
+        with self._lock:
+            self.reads.append({
+                'collection': event.command.get(event.command_name),
+                # The driver may leave $readPreference out when it changes nothing (e.g. a single host)
+                'read_preference': (event.command.get('$readPreference') or {}).get('mode'),
+                'after_cluster_time': 'afterClusterTime' in (event.command.get('readConcern') or {})
+            })
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self):
+        with self._lock:
+            reads, self.reads = self.reads, []
+        return reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check read routing against a replica set')
+    parser.add_argument('--rounds', type=int, default=20)
+    scratch_database.add_arguments(parser, 'webapp_routing_check')
+    args = parser.parse_args()
+
+    scratch_database.select(args)
+    os.environ.setdefault('LLM_PROVIDER', 'fake')
+    os.environ.setdefault('JWT_SECRET_KEY', 'routing-check-secret')
+    os.environ.setdefault('READ_PREFERENCE_LIST', 'secondaryPreferred')
+    os.environ.setdefault('READ_PREFERENCE_CONTEXT', 'secondaryPreferred')
+
+    log = ReadCommandLog()
+    monitoring.register(log)
+
+    import app as webapp
+
+    refusal = scratch_database.refusal(webapp, args)
+    if refusal:
+        print(f'Refusing to run: {refusal}')
+        return 2
+    if not webapp.READ_ROUTING_ENABLED:
+        print('All read classes are set to primary; nothing to check')
+        return 2
+    log.database = webapp.db.name
+
+    # On a standalone server every read goes to the one host and the check would pass without
+    # testing any routing, so it only counts against a replica set
+    webapp.client.admin.command('ping')
+    topology = webapp.client.topology_description.topology_type_name
+    if topology != 'ReplicaSetWithPrimary':
+        print(f'Refusing to run: topology is {topology}, not a replica set with a primary')
+        return 2
+
+    webapp.client.drop_database(webapp.db.name)
+    print(f"Topology: {topology}; read preferences: "
+          f"{ {name: preference.mongos_mode for name, preference in webapp.READ_PREFERENCES.items()} }")
+
+    user_id = str(webapp.users_collection.insert_one({
+        'username': 'routing-check', 'email': 'routing-check@example.com',
+        'created_at': datetime.now(timezone.utc)
+    }).inserted_id)
+    with webapp.app.app_context():
+        auth = {'Authorization': f'Bearer {webapp.create_access_token(identity=user_id)}'}
+
+    test_client = webapp.app.test_client()
+    failures = []
+    token = None
+    for round_number in range(args.rounds):
+        value = f'round-{round_number}'
+        headers = dict(auth, **({webapp.read_routing.TOKEN_HEADER: token} if token else {}))
+        response = test_client.put('/api/memory', json={'others': [value]}, headers=headers)
+        token = response.headers.get(webapp.read_routing.TOKEN_HEADER) or token
+        if response.status_code != 200:
+            failures.append(f'round {round_number}: write returned {response.status_code}')
+            continue
+        if not response.headers.get(webapp.read_routing.TOKEN_HEADER):
+            failures.append(f'round {round_number}: no read-after token')
+
+        log.take()
+        response = test_client.get('/api/memory', headers=dict(auth, **{webapp.read_routing.TOKEN_HEADER: token}))
+        memory = (response.get_json() or {}).get('memory', {})
+        if memory.get('others') != [value]:
+            failures.append(f"round {round_number}: read {memory.get('others')}, expected [{value!r}]")
+
+        for read in log.take():
+            if read['collection'] != 'memories':
+                continue
+            expected = webapp.READ_PREFERENCES['list'].mongos_mode
+            if read['read_preference'] not in (None, expected):
+                failures.append(f"round {round_number}: unexpected read preference {read['read_preference']}")
+            if not read['after_cluster_time']:
+                failures.append(f'round {round_number}: memory read without afterClusterTime')
+
+    webapp.client.drop_database(webapp.db.name)
+    if failures:
+        print(f'{len(failures)} problems:')
+        for failure in failures:
+            print(f'  {failure}')
+        return 1
+    print(f'{args.rounds} write/read rounds: every read saw its own write')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Compare per-message and batched (windowed) memory extraction on the same conversations.
+
+    python compare_memory_extraction.py --fake
+    python compare_memory_extraction.py --conversations conversations.json --window 8
+
+Runs each conversation through both extractors without saving anything:
+per-message extraction makes its two calls (personal facts, conversation
+facts) for every user message, as a chat turn does; batched extraction makes
+one call per window of --window user messages, as extract_memories.py does.
+It prints the calls and tokens of each mode and which memory items only one
+of them found, so a drop in recall shows up before batched extraction is
+switched on. The fake LLM (--fake) only checks the plumbing; judging quality
+needs the configured provider and costs tokens.
+
+--conversations is a JSON list of conversations, each a list of
+{"role": "user" | "assistant", "content": ...} messages. Without it a few
+built-in conversations are used. Uses the same configuration (.env) as app.py.
+"""
+import argparse
+import json
+import os
+import sys
+
+import memory_windows
+
+SAMPLE_CONVERSATIONS = [
+    [
+        {'role': 'user', 'content': 'I want to buy a gift for my mom, her birthday is next Friday'},
+        {'role': 'assistant', 'content': 'That is lovely! What does she enjoy doing?'},
+        {'role': 'user', 'content': 'She loves gardening and I love cooking with her on weekends'},
+        {'role': 'assistant', 'content': 'A set of good garden tools or a cooking class together could work.'},
+        {'role': 'user', 'content': 'A cooking class is a great idea, I will book one for Saturday'},
+        {'role': 'assistant', 'content': 'She will love spending the day with you.'},
+    ],
+    [
+        {'role': 'user', 'content': 'My back hurts after moving apartments with my brother'},
+        {'role': 'assistant', 'content': 'Sorry to hear that. Are you resting it?'},
+        {'role': 'user', 'content': 'A bit, but I have a deadline at work on Thursday'},
+        {'role': 'assistant', 'content': 'Short breaks and stretching can help while you work.'},
+        {'role': 'user', 'content': 'My favorite way to relax is swimming, maybe I will go tomorrow'},
+        {'role': 'assistant', 'content': 'Swimming is gentle on the back, good plan.'},
+        {'role': 'user', 'content': 'I also play piano, which keeps my mind off the pain'},
+        {'role': 'assistant', 'content': 'Music is a great distraction.'},
+    ],
+]
+
+
+def memory_items(memory_data, categories):
+    """{(category, normalized item)} of an extraction result"""
+    items = set()
+    for category in categories:
+        for item in memory_data.get(category) or []:
+            if isinstance(item, str) and item.strip():
+                items.add((category, item.strip().lower()))
+    return items
+
+
+def usage_totals(stage_usage):
+    calls = sum(entry['calls'] for entry in stage_usage.values())
+    tokens = sum(entry['prompt_tokens'] + entry['completion_tokens'] for entry in stage_usage.values())
+    return calls, tokens
+
+
+def per_message(webapp, conversation, categories):
+    items, facts = set(), []
+    with webapp.usage_ledger.collect() as stage_usage:
+        for index, message in enumerate(conversation):
+            if message['role'] != 'user':
+                continue
+            items |= memory_items(webapp.extract_memory_data(message['content']), categories)
+            # A turn extracts conversation facts before its own message is saved
+            facts += webapp.extract_conversation_memory(message['content'], conversation[:index])
+    return items, facts, usage_totals(stage_usage)
+
+
+def batched(webapp, conversation, categories, window):
+    items, facts, failed = set(), [], 0
+    user_indexes = [index for index, message in enumerate(conversation) if message['role'] == 'user']
+
+    def complete(messages):
+        response = webapp.openai.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=800,
+            temperature=0.3
+        )
+        webapp.usage_ledger.record('memory_window', response, 'gpt-3.5-turbo')
+        return response.choices[0].message.content
+
+    with webapp.usage_ledger.collect() as stage_usage:
+        for start in range(0, len(user_indexes), window):
+            pending = user_indexes[start:start + window]
+            # The worker sees the chat after the answer to the window's last message
+            end = user_indexes[start + window] if start + window < len(user_indexes) else len(conversation)
+            chat = {'messages': conversation[:end], 'memory_pending': len(pending)}
+            parsed = memory_windows.parse_window(complete(memory_windows.build_messages(chat)), categories)
+            if parsed is None:
+                failed += 1
+                continue
+            items |= memory_items(parsed[0], categories)
+            facts += parsed[1]
+    return items, facts, usage_totals(stage_usage), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-message and batched memory extraction')
+    parser.add_argument('--conversations', help='JSON file with a list of conversations (lists of messages)')
+    parser.add_argument('--window', type=int, default=int(os.getenv('MEMORY_WINDOW_MESSAGES', '8')),
+                        help='user messages per batched extraction call')
+    parser.add_argument('--fake', action='store_true', help='use the offline fake LLM provider')
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ['LLM_PROVIDER'] = 'fake'
+
+    conversations = SAMPLE_CONVERSATIONS
+    if args.conversations:
+        with open(args.conversations, encoding='utf-8') as f:
+            conversations = json.load(f)
+
+    # Imported late so --fake takes effect before the clients are configured
+    import app as webapp
+    categories = webapp.MEMORY_CATEGORIES
+
+    totals = {'per_message': [0, 0, 0, 0], 'batched': [0, 0, 0, 0]}
+    shared = only_per_message = only_batched = failed = 0
+    for number, conversation in enumerate(conversations, 1):
+        message_items, message_facts, (message_calls, message_tokens) = per_message(webapp, conversation, categories)
+        window_items, window_facts, (window_calls, window_tokens), window_failed = batched(
+            webapp, conversation, categories, args.window)
+        failed += window_failed
+
+        for mode, result in (('per_message', (message_calls, message_tokens, len(message_items), len(message_facts))),
+                             ('batched', (window_calls, window_tokens, len(window_items), len(window_facts)))):
+            totals[mode] = [total + value for total, value in zip(totals[mode], result)]
+        shared += len(message_items & window_items)
+        only_per_message += len(message_items - window_items)
+        only_batched += len(window_items - message_items)
+
+        print(f"conversation {number}: per-message {message_calls} calls, {len(message_items)} memory items, "
+              f"{len(message_facts)} facts; batched {window_calls} calls, {len(window_items)} memory items, "
+              f"{len(window_facts)} facts" + (f", {window_failed} unusable replies" if window_failed else ''))
+        for category, item in sorted(message_items - window_items):
+            print(f"  only per-message: {category}: {item}")
+        for category, item in sorted(window_items - message_items):
+            print(f"  only batched:     {category}: {item}")
+
+    for mode, (calls, tokens, items, facts) in totals.items():
+        print(f"{mode}: {calls} calls, {tokens} tokens, {items} memory items, {facts} facts")
+    print(f"memory items found by both: {shared}, only per-message: {only_per_message}, "
+          f"only batched: {only_batched}; {failed} unusable batched replies")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Merge and deduplicate large user memories (see memory_consolidation.py).
+
+    python consolidate_memories.py --min-items 30
+    python consolidate_memories.py --fake --dry-run --limit 5
+    python consolidate_memories.py --interval 60      # keep running, one pass an hour
+
+Each selected user costs one LLM call. Uses the same configuration (.env)
+as app.py.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import memory_consolidation
+
+
+def run_pass(webapp, args):
+    stats = {'users': 0, 'consolidated': 0, 'conflict': 0, 'rejected': 0, 'dry_run': 0, 'failed': 0,
+             'items_before': 0, 'items_after': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    stats_lock = threading.Lock()
+    categories = webapp.MEMORY_CATEGORIES
+
+    def complete(messages):
+        response = webapp.openai.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=1500,
+            temperature=0.2
+        )
+        usage = response.usage
+        if usage:
+            with stats_lock:
+                stats['prompt_tokens'] += usage.prompt_tokens or 0
+                stats['completion_tokens'] += usage.completion_tokens or 0
+        return response.choices[0].message.content
+
+    def consolidate(memory):
+        try:
+            status, consolidated = memory_consolidation.consolidate_user(
+                webapp.memories_collection, memory, categories, complete, dry_run=args.dry_run
+            )
+        except Exception as e:
+            print(f"  user {memory['user_id']}: failed ({e})")
+            return memory, 'failed', None
+        if status == 'consolidated':
+            webapp.update_search_index(webapp.search_index.reindex_memory, memory['user_id'],
+                                       dict(memory, **consolidated), categories)
+        return memory, status, consolidated
+
+    candidates = memory_consolidation.select_candidates(
+        webapp.memories_collection, categories, args.min_items, args.limit, args.user
+    )
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for memory, status, consolidated in executor.map(consolidate, candidates):
+            stats['users'] += 1
+            stats[status] += 1
+            before = memory_consolidation.count_items(memory, categories)
+            if consolidated is not None:
+                after = memory_consolidation.count_items(consolidated, categories)
+                stats['items_before'] += before
+                stats['items_after'] += after
+                print(f"  user {memory['user_id']}: {before} -> {after} items ({status})")
+            elif status != 'failed':
+                print(f"  user {memory['user_id']}: {before} items ({status})")
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consolidate large user memories')
+    parser.add_argument('--min-items', type=int, default=int(os.getenv('MEMORY_CONSOLIDATION_MIN_ITEMS', '30')),
+                        help='only users with at least this many memory items')
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many users per pass')
+    parser.add_argument('--user', help='only this user id')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=0, help='minutes between passes; 0 runs once')
+    parser.add_argument('--dry-run', action='store_true', help='call the LLM but write nothing')
+    parser.add_argument('--fake', action='store_true', help='use the offline fake LLM provider')
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ['LLM_PROVIDER'] = 'fake'
+
+    # Imported late so --fake takes effect before the clients are configured
+    import app as webapp
+
+    while True:
+        started = time.monotonic()
+        stats = run_pass(webapp, args)
+        saved = stats['items_before'] - stats['items_after']
+        print(f"{stats['users']} users in {time.monotonic() - started:.1f}s: {stats['consolidated']} consolidated, "
+              f"{stats['conflict']} changed meanwhile, {stats['rejected']} rejected, {stats['failed']} failed; "
+              f"{saved} items removed, {stats['prompt_tokens']}+{stats['completion_tokens']} tokens")
+        if not args.interval:
+            return 1 if stats['failed'] else 0
+        time.sleep(args.interval * 60)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Streaming NDJSON export of everything stored for one user.
+
+Every record is written as one JSON line straight from a server-side cursor,
+so memory use stays constant no matter how many chats a user has. Used by the
+/api/export endpoint in app.py and by export_user.py on the command line.
+
+Line format:
+    {"type": "export", "user_id": "...", "exported_at": "...", "version": 1}
+    {"type": "<collection>", "data": {...}}
+    ...
+    {"type": "end", "counts": {"chats": 12, ...}}
+
+Chats are exported as their owner sees them in the app (public_chat), without
+the fields the server keeps for turn serialization, batched memory
+extraction, archiving and regeneration.
+"""
+import json
+import zlib
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.objectid import InvalidId
+
+import chat_archive
+import fast_json
+
+EXPORT_VERSION = 1
+CURSOR_BATCH_SIZE = 100
+GZIP_FLUSH_BYTES = 64 * 1024
+
+# Chat and message fields that only the server uses
+INTERNAL_CHAT_FIELDS = ('turn_lease', 'last_turn', 'memory_pending', 'memory_due', 'version', 'revision')
+INTERNAL_MESSAGE_FIELDS = ('stage_outputs', 'stage_usage')
+# Feedback fields that only the analytics rollups use
+INTERNAL_FEEDBACK_FIELDS = ('rollup_bucket',)
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    # Same date format as the API responses
+    return fast_json.default(value)
+
+
+def _line(record):
+    return (json.dumps(record, default=_json_default, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def public_message(message):
+    public = {key: value for key, value in message.items() if key not in INTERNAL_MESSAGE_FIELDS}
+    if isinstance(public.get('regenerated'), dict):
+        public['regenerated'] = {key: value for key, value in public['regenerated'].items() if key != 'stage_usage'}
+    if isinstance(public.get('user_feedback'), dict):
+        public['user_feedback'] = public_feedback(public['user_feedback'])
+    return public
+
+
+def public_feedback(feedback):
+    """A reaction or survey as shown to its author: without the analytics bucket it was counted in"""
+    return {key: value for key, value in feedback.items() if key not in INTERNAL_FEEDBACK_FIELDS}
+
+
+def public_chat(chat):
+    """A chat as shown to its owner: without the server's bookkeeping fields"""
+    public = {key: value for key, value in chat.items() if key not in INTERNAL_CHAT_FIELDS}
+    if 'messages' in public:
+        public['messages'] = [public_message(message) for message in public['messages']]
+    return public
+
+
+def _export_sources(db, user_id):
+    """(type, cursor factory, document transform) triples, in the order they are written"""
+    try:
+        user_filter = {'_id': ObjectId(user_id)}
+    except (InvalidId, TypeError):
+        user_filter = {'_id': user_id}
+
+    return [
+        ('user', lambda: db['users'].find(user_filter, {'password': 0}), None),
+        ('persona', lambda: db['personas'].find({'user_id': user_id}), None),
+        ('memory', lambda: db['memories'].find({'user_id': user_id}), None),
+        ('feedback', lambda: db['feedback'].find({'user_id': user_id}), public_feedback),
+        ('diary', lambda: db['diary'].find({'user_id': user_id}).sort('_id', 1), None),
+        ('chat', lambda: db['chats'].find({'user_id': user_id}).sort('_id', 1), public_chat),
+        # Archived chats are exported with their messages decompressed
+        ('chat', lambda: db['chats_archive'].find({'user_id': user_id}).sort('_id', 1),
+         lambda archived: public_chat(chat_archive.from_archive_document(archived))),
+    ]
+
+
+def iter_export_lines(db, user_id):
+    """Yield the export as NDJSON lines (bytes)"""
+    yield _line({
+        'type': 'export',
+        'user_id': user_id,
+        'exported_at': datetime.now(timezone.utc),
+        'version': EXPORT_VERSION
+    })
+
+    counts = {}
+    for record_type, make_cursor, transform in _export_sources(db, user_id):
+        counts.setdefault(record_type, 0)
+        cursor = make_cursor().batch_size(CURSOR_BATCH_SIZE)
+        try:
+            for document in cursor:
+                counts[record_type] += 1
+                yield _line({'type': record_type, 'data': transform(document) if transform else document})
+        finally:
+            cursor.close()
+
+    yield _line({'type': 'end', 'counts': counts})
+
+
+def iter_export(db, user_id, compress=False):
+    """Yield the export as bytes chunks, optionally gzip-compressed"""
+    if not compress:
+        yield from iter_export_lines(db, user_id)
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    pending = 0
+    for line in iter_export_lines(db, user_id):
+        chunk = compressor.compress(line)
+        pending += len(line)
+        if chunk:
+            yield chunk
+        if pending >= GZIP_FLUSH_BYTES:
+            # Push compressed data out regularly so the client sees progress
+            yield compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+    yield compressor.flush()
@@ -0,0 +1,55 @@
+"""Export all data for one user as NDJSON.
+
+    python export_user.py <user_id or username> [-o export.ndjson] [--gzip]
+
+Writes to stdout when no output file is given. Uses the same storage settings (STORAGE_BACKEND, MONGODB_URI, SQLITE_PATH) as app.py.
+"""
+import argparse
+import os
+import sys
+
+from bson import ObjectId
+from dotenv import load_dotenv
+
+import storage
+from data_export import iter_export
+
+
+def resolve_user_id(db, user):
+    if ObjectId.is_valid(user) and db['users'].find_one({'_id': ObjectId(user)}, {'_id': 1}):
+        return user
+    found = db['users'].find_one({'username': user}, {'_id': 1})
+    return str(found['_id']) if found else None
+
+
+def main():
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description='Export all data for one user as NDJSON')
+    parser.add_argument('user', help='user id or username')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('--gzip', action='store_true', help='gzip-compress the output')
+    args = parser.parse_args()
+
+    client = storage.create_client()
+    db = client[os.getenv('MONGODB_DB', 'webapp_db')]
+
+    user_id = resolve_user_id(db, args.user)
+    if not user_id:
+        print(f'User not found: {args.user}', file=sys.stderr)
+        return 1
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_export(db, user_id, compress=args.gzip):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        client.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
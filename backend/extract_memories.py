@@ -0,0 +1,109 @@
+"""Extract memory from buffered chat messages, one window per chat (see memory_windows.py).
+
+    python extract_memories.py --interval 1      # keep running, one pass a minute
+    python extract_memories.py --window 8 --idle-minutes 30
+    python extract_memories.py --fake --dry-run --limit 5
+
+Only useful with MEMORY_EXTRACTION=batched in the app's configuration; each
+due chat costs one LLM call for all of its pending messages, where
+per-message extraction makes two calls per message. Uses the same
+configuration (.env) as app.py. Run a single instance.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import memory_windows
+
+
+def run_pass(webapp, args):
+    stats = {'chats': 0, 'messages': 0, 'extracted': 0, 'rejected': 0, 'dry_run': 0, 'empty': 0, 'failed': 0,
+             'memory_items': 0, 'conversation_facts': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    stats_lock = threading.Lock()
+    categories = webapp.MEMORY_CATEGORIES
+
+    def complete(messages):
+        response = webapp.openai.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=800,
+            temperature=0.3
+        )
+        webapp.usage_ledger.record('memory_window', response, 'gpt-3.5-turbo')
+        usage = response.usage
+        if usage:
+            with stats_lock:
+                stats['prompt_tokens'] += usage.prompt_tokens or 0
+                stats['completion_tokens'] += usage.completion_tokens or 0
+        return response.choices[0].message.content
+
+    def extract(chat):
+        try:
+            # The extraction counts towards the user's daily usage, but not as a turn
+            with webapp.usage_ledger.collect() as stage_usage:
+                status, memory_data, facts = memory_windows.extract_chat(
+                    webapp.chats_collection, chat, categories, complete, webapp.save_memory_info,
+                    webapp.save_conversation_memory, dry_run=args.dry_run
+                )
+            webapp.update_usage_ledger(chat['user_id'], webapp.get_persona_role(chat['user_id']), stage_usage,
+                                       turns=0)
+        except Exception as e:
+            print(f"  chat {chat['_id']}: failed ({e})")
+            return chat, 'failed', {}, []
+        return chat, status, memory_data, facts
+
+    chats = memory_windows.select_due(webapp.chats_collection, args.window, args.idle_minutes * 60,
+                                      args.limit, args.user)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for chat, status, memory_data, facts in executor.map(extract, chats):
+            stats['chats'] += 1
+            stats['messages'] += chat.get('memory_pending', 0)
+            stats[status] += 1
+            stats['memory_items'] += sum(len(items) for items in memory_data.values())
+            stats['conversation_facts'] += len(facts)
+            if status != 'failed':
+                print(f"  chat {chat['_id']}: {chat.get('memory_pending', 0)} messages, "
+                      f"{sum(len(items) for items in memory_data.values())} memory items, {len(facts)} facts ({status})")
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract memory from buffered chat messages')
+    parser.add_argument('--window', type=int, default=int(os.getenv('MEMORY_WINDOW_MESSAGES', '8')),
+                        help='extract a chat once this many of its messages are pending')
+    parser.add_argument('--idle-minutes', type=float, default=float(os.getenv('MEMORY_WINDOW_IDLE_MINUTES', '30')),
+                        help='or once it has been idle this long')
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many chats per pass')
+    parser.add_argument('--user', help='only chats of this user id')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=0, help='minutes between passes; 0 runs once')
+    parser.add_argument('--dry-run', action='store_true', help='call the LLM but write nothing')
+    parser.add_argument('--fake', action='store_true', help='use the offline fake LLM provider')
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ['LLM_PROVIDER'] = 'fake'
+
+    # Imported late so --fake takes effect before the clients are configured
+    import app as webapp
+
+    while True:
+        started = time.monotonic()
+        stats = run_pass(webapp, args)
+        calls = stats['extracted'] + stats['rejected'] + stats['dry_run'] + stats['failed']
+        print(f"{stats['chats']} chats in {time.monotonic() - started:.1f}s: {stats['messages']} messages in "
+              f"{calls} calls (per-message extraction: {2 * stats['messages']}), {stats['memory_items']} memory "
+              f"items, {stats['conversation_facts']} facts, {stats['rejected']} rejected, {stats['failed']} failed; "
+              f"{stats['prompt_tokens']}+{stats['completion_tokens']} tokens")
+        if not args.interval:
+            return 1 if stats['failed'] else 0
+        time.sleep(args.interval * 60)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Offline stand-in for the OpenAI client.
+
+Selected with LLM_PROVIDER=fake. It answers `chat.completions.create` with
+deterministic, well-formed responses for each of the prompts used in app.py,
+so batch jobs and local runs work without an API key or network access.
+FAKE_LLM_LATENCY_MS adds an artificial delay per call.
+"""
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+
+def _count_tokens(text):
+    # Rough whitespace token count; good enough for usage numbers in tests
+    return max(1, len(text.split()))
+
+
+def _personal_facts(text):
+    facts = {}
+    lowered = text.lower()
+    for word, category, fact in (
+        ('mom', 'family_friends', 'has a mother'),
+        ('mother', 'family_friends', 'has a mother'),
+        ('brother', 'family_friends', 'has a brother'),
+        ('love', 'favorites', 'enjoys things they love'),
+        ('favorite', 'favorites', 'has favorites'),
+    ):
+        if word in lowered:
+            facts.setdefault(category, [])
+            if fact not in facts[category]:
+                facts[category].append(fact)
+    return facts
+
+
+def _reply_for(system_prompt, user_content):
+    if 'chat title generation' in system_prompt:
+        return ' '.join(user_content.split()[:4]).title() or 'New Conversation'
+    if 'personal information extraction' in system_prompt:
+        return json.dumps(_personal_facts(user_content))
+    if 'memory window extraction expert' in system_prompt:
+        new_messages = user_content.split('\n\nConversation before them:')[0]
+        user_lines = [line.split(': ', 1)[1] for line in new_messages.splitlines() if line.startswith('User (')]
+        return json.dumps({
+            'user_memory': _personal_facts('\n'.join(user_lines)),
+            'conversation_facts': [line[:80] for line in user_lines]
+        })
+    if 'conversation memory expert' in system_prompt:
+        first_line = user_content.splitlines()[0] if user_content else ''
+        return json.dumps({'conversation_facts': [first_line[:80]] if first_line else []})
+    if 'memory consolidation expert' in system_prompt:
+        # Case-insensitive de-duplication stands in for the real merge
+        memory = json.loads(user_content or '{}')
+        return json.dumps({
+            category: list({item.lower(): item for item in reversed(items)}.values())[::-1]
+            for category, items in memory.items()
+        })
+    if 'memory relevance expert' in system_prompt:
+        return 'RELEVANT'
+    if 'diary summary expert' in system_prompt:
+        words = user_content.split()
+        return f"TITLE: {' '.join(words[3:7]).title() or 'Daily Conversation'}\nSUMMARY: Today I talked about {' '.join(words[3:30])}."
+    return f"(fake reply) {user_content[:200]}"
+
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model=None, messages=None, max_tokens=None, temperature=None, **kwargs):
+        latency = float(os.getenv('FAKE_LLM_LATENCY_MS', '0')) / 1000
+        if latency:
+            time.sleep(latency)
+
+        messages = messages or []
+        system_prompt = '\n'.join(m['content'] for m in messages if m.get('role') == 'system')
+        user_content = messages[-1]['content'] if messages else ''
+        content = _reply_for(system_prompt, user_content)
+
+        prompt_tokens = sum(_count_tokens(m.get('content', '')) for m in messages)
+        completion_tokens = _count_tokens(content)
+
+        with self._client._lock:
+            self._client.call_count += 1
+
+        return SimpleNamespace(
+            id=f'fake-{self._client.call_count}',
+            model=model,
+            choices=[SimpleNamespace(
+                index=0,
+                finish_reason='stop',
+                message=SimpleNamespace(role='assistant', content=content)
+            )],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=0)
+            )
+        )
+
+
+class FakeOpenAI:
+    """Mimics the subset of the OpenAI client used by app.py"""
+
+    def __init__(self):
+        self.call_count = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    def with_options(self, **kwargs):
+        return self
@@ -0,0 +1,160 @@
+"""Fast JSON encoding and response compression for large API payloads.
+
+Uses orjson when it is installed and falls back to the standard json module
+otherwise. Both handle the BSON types we return (ObjectId, datetime). Large
+arrays such as chat lists and message histories can be encoded item by item
+so the full document never has to be serialized into one buffer, and
+responses are compressed with brotli (if the `brotli` package is installed)
+or gzip when the client accepts it and the body is big enough to be worth it.
+
+Configuration:
+- JSON_SERIALIZER: "orjson" (default when available) or "json"
+- COMPRESS_MIN_SIZE: smallest body in bytes that gets compressed (default 1024)
+"""
+import gzip
+import itertools
+import json
+import os
+import zlib
+from datetime import datetime, date, timezone
+
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def default(value):
+    """Encode the BSON types we return; datetimes become ISO-8601 in UTC everywhere in the API"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _use_orjson():
+    return orjson is not None and os.getenv('JSON_SERIALIZER', 'orjson') == 'orjson'
+
+
+def dumps(value):
+    """Encode `value` to UTF-8 JSON bytes"""
+    if _use_orjson():
+        # Mongo returns naive UTC datetimes; tag them so clients parse them as UTC
+        return orjson.dumps(value, default=default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def iter_object_with_array(envelope, key, items):
+    """Encode {**envelope, key: [items...]} incrementally, one item at a time.
+
+    `items` can be any iterable, including a live pymongo cursor. An item that
+    fails to load or encode is re-raised from the generator: once part of the
+    body has been sent, the server has to abort the transfer, so a client
+    never takes a cut-short list for a complete one.
+    """
+    head = dumps(envelope)
+    if head == b'{}':
+        prefix = b'{' + dumps(key) + b':['
+    else:
+        prefix = head[:-1] + b',' + dumps(key) + b':['
+
+    buffer = bytearray(prefix)
+    first = True
+    try:
+        for item in items:
+            encoded = dumps(item)
+            if not first:
+                buffer += b','
+            buffer += encoded
+            first = False
+            if len(buffer) >= STREAM_CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+    except Exception as e:
+        print(f"Streaming {key} failed: {e}")
+        raise
+    buffer += b']}'
+    yield bytes(buffer)
+
+
+def read_ahead(chunks, size):
+    """Read `chunks` until at least `size` bytes are buffered.
+
+    Returns (head, rest): rest is the iterator for the remaining chunks, or
+    None if everything fit in head. Errors in the part read here raise to the
+    caller, which can still answer with an error status.
+    """
+    chunks = iter(chunks)
+    head = bytearray()
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= size:
+            return bytes(head), chunks
+    return bytes(head), None
+
+
+def choose_encoding(accept_encoding):
+    """Pick the best supported content encoding from an Accept-Encoding header"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+def iter_compress(chunks, encoding):
+    """Compress a stream of byte chunks on the fly"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            output = compressor.process(chunk)
+            if output:
+                yield output
+        yield compressor.finish()
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            output = compressor.compress(chunk)
+            if output:
+                yield output
+        yield compressor.flush()
+    else:
+        yield from chunks
+
+
+def compress_min_size():
+    return int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
@@ -0,0 +1,182 @@
+"""Incremental rollups of feedback ratings and message reactions.
+
+Rollups are kept up to date with $inc upserts whenever feedback changes, so
+the admin analytics endpoint reads a handful of small documents instead of
+scanning feedback and chats.
+
+One document per (day, persona role), plus a running total per role:
+    {_id: "2026-10-19:mentor" | "total:mentor", day: "2026-10-19" | "total", role,
+     ratings: {<dimension>: {count, sum, hist: {"1": n, ..., "5": n}}},
+     reactions: {<type>: n},
+     updated_at}
+
+Each change records which bucket it was counted in, so an update or removal
+decrements exactly that bucket even if the persona changed in between.
+"""
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+import chat_archive
+
+RATING_DIMENSIONS = ['design', 'usability', 'response_quality', 'speed',
+                     'personalization', 'conversation_naturalness', 'usefulness']
+REACTION_TYPES = ['thumbs_up', 'thumbs_down', 'love', 'funny', 'meaningless', 'offensive']
+TOTAL_DAY = 'total'
+
+
+def current_bucket(role):
+    return {'day': datetime.now(timezone.utc).strftime('%Y-%m-%d'), 'role': role or 'friend'}
+
+
+def _rating_increments(ratings, sign):
+    increments = {}
+    for dimension in RATING_DIMENSIONS:
+        value = ratings.get(dimension)
+        if isinstance(value, int) and 1 <= value <= 5:
+            increments[f'ratings.{dimension}.count'] = sign
+            increments[f'ratings.{dimension}.sum'] = sign * value
+            increments[f'ratings.{dimension}.hist.{value}'] = sign
+    return increments
+
+
+def _bucket_operations(bucket, increments):
+    """$inc the day bucket and the role's running total"""
+    if not increments:
+        return []
+    now = datetime.now(timezone.utc)
+    return [
+        UpdateOne(
+            {'_id': f"{day}:{bucket['role']}"},
+            {
+                '$inc': increments,
+                '$set': {'updated_at': now},
+                '$setOnInsert': {'day': day, 'role': bucket['role']}
+            },
+            upsert=True
+        )
+        for day in (bucket['day'], TOTAL_DAY)
+    ]
+
+
+def record_ratings(collection, old_feedback, new_ratings, bucket):
+    """Move a user's ratings from their previous bucket (if any) to `bucket`"""
+    operations = []
+    if old_feedback and old_feedback.get('rollup_bucket'):
+        operations += _bucket_operations(old_feedback['rollup_bucket'], _rating_increments(old_feedback, -1))
+    operations += _bucket_operations(bucket, _rating_increments(new_ratings, 1))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+
+def record_reaction(collection, old_reaction, new_type, bucket):
+    """Replace a message reaction (old_reaction is the stored user_feedback, or None).
+
+    new_type None means the reaction was removed.
+    """
+    operations = []
+    if old_reaction and old_reaction.get('rollup_bucket') and old_reaction.get('type') in REACTION_TYPES:
+        operations += _bucket_operations(old_reaction['rollup_bucket'], {f"reactions.{old_reaction['type']}": -1})
+    if new_type in REACTION_TYPES:
+        operations += _bucket_operations(bucket, {f'reactions.{new_type}': 1})
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+
+def _merge(target, source):
+    for dimension, stats in source.get('ratings', {}).items():
+        merged = target['ratings'].setdefault(dimension, {'count': 0, 'sum': 0, 'hist': {}})
+        merged['count'] += stats.get('count', 0)
+        merged['sum'] += stats.get('sum', 0)
+        for value, count in stats.get('hist', {}).items():
+            merged['hist'][value] = merged['hist'].get(value, 0) + count
+    for reaction, count in source.get('reactions', {}).items():
+        target['reactions'][reaction] = target['reactions'].get(reaction, 0) + count
+
+
+def _summarize(rollup):
+    for stats in rollup['ratings'].values():
+        stats['average'] = round(stats['sum'] / stats['count'], 2) if stats['count'] else None
+    return rollup
+
+
+def get_rollups(collection, days=30):
+    """Per-day and total rollups; reads at most (days + 1) x roles small documents"""
+    today = datetime.now(timezone.utc).date()
+    day_keys = [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+
+    by_day = {day: {'day': day, 'ratings': {}, 'reactions': {}, 'roles': {}} for day in day_keys}
+    totals = {'ratings': {}, 'reactions': {}, 'roles': {}}
+
+    for document in collection.find({'day': {'$in': day_keys + [TOTAL_DAY]}}):
+        target = totals if document['day'] == TOTAL_DAY else by_day[document['day']]
+        role_rollup = {'ratings': {}, 'reactions': {}}
+        _merge(role_rollup, document)
+        target['roles'][document['role']] = _summarize(role_rollup)
+        _merge(target, document)
+
+    return {
+        'days': [_summarize(by_day[day]) for day in day_keys],
+        'totals': _summarize(totals)
+    }
+
+
+def _bucket_for(user_id, timestamp, roles):
+    day = (timestamp or datetime.now(timezone.utc)).strftime('%Y-%m-%d')
+    return {'day': day, 'role': roles.get(user_id, 'friend')}
+
+
+def _uncounted_reactions(chat, roles):
+    """(index, reaction, bucket) for the chat's reactions not yet counted in a rollup"""
+    for index, message in enumerate(chat.get('messages', [])):
+        reaction = message.get('user_feedback')
+        if not isinstance(reaction, dict) or reaction.get('rollup_bucket'):
+            continue
+        yield index, reaction, _bucket_for(chat['user_id'], reaction.get('timestamp'), roles)
+
+
+def backfill(db, collection):
+    """Count feedback and reactions written before rollups existed (those without a rollup_bucket),
+    in archived chats too"""
+    roles = {persona['user_id']: persona.get('role', 'friend')
+             for persona in db['personas'].find({}, {'user_id': 1, 'role': 1})}
+    counted = {'ratings': 0, 'reactions': 0}
+
+    for feedback in db['feedback'].find({'rollup_bucket': {'$exists': False}}):
+        bucket = _bucket_for(feedback['user_id'], feedback.get('updated_at'), roles)
+        record_ratings(collection, None, feedback, bucket)
+        db['feedback'].update_one({'_id': feedback['_id']}, {'$set': {'rollup_bucket': bucket}})
+        counted['ratings'] += 1
+
+    chats = db['chats'].find({'messages.user_feedback': {'$exists': True}}, {'user_id': 1, 'messages': 1})
+    for chat in chats:
+        updates = {}
+        for index, reaction, bucket in _uncounted_reactions(chat, roles):
+            record_reaction(collection, None, reaction.get('type'), bucket)
+            updates[f'messages.{index}.user_feedback.rollup_bucket'] = bucket
+            counted['reactions'] += 1
+        if updates:
+            db['chats'].update_one({'_id': chat['_id']}, {'$set': updates, '$inc': {'revision': 1}})
+
+    # Archived chats keep their messages in a compressed blob (chat_archive.py), so the
+    # buckets are written by re-encoding it; reactions are only counted once that write lands
+    archived_chats = db['chats_archive'].find({}, {'user_id': 1, 'messages_blob': 1, 'codec': 1, 'revision': 1})
+    for archived in archived_chats:
+        chat = chat_archive.from_archive_document(archived)
+        uncounted = list(_uncounted_reactions(chat, roles))
+        if not uncounted:
+            continue
+        for _, reaction, bucket in uncounted:
+            reaction['rollup_bucket'] = bucket
+        messages_blob, codec = chat_archive.compress_messages(chat['messages'])
+        written = db['chats_archive'].update_one(
+            {'_id': archived['_id'], 'revision': archived.get('revision')},
+            {'$set': {'messages_blob': messages_blob, 'codec': codec}, '$inc': {'revision': 1}}
+        )
+        if not written.matched_count:
+            continue
+        for _, reaction, bucket in uncounted:
+            record_reaction(collection, None, reaction.get('type'), bucket)
+            counted['reactions'] += 1
+
+    return counted
@@ -0,0 +1,175 @@
+"""Idempotency keys for expensive POST endpoints.
+
+A client sends an Idempotency-Key header; the first request with a given key
+runs and its response is stored in a TTL-indexed collection. A retry with the
+same key gets the stored response instead of running again, and a retry that
+arrives while the first request is still running waits for it and returns
+its result.
+
+Record shape:
+    {_id: "<user_id>:<key>", user_id, key, fingerprint, status: "in_progress" | "completed",
+     response, status_code, created_at, lease_expires_at, expires_at}
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+POLL_INTERVAL = 0.25
+
+_indexed_collections = set()
+_index_lock = threading.Lock()
+
+# Requests being computed by this process, so same-process retries wait on an event instead of polling
+_local_runs = {}
+_local_runs_lock = threading.Lock()
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request body"""
+
+
+class IdempotencyInProgress(Exception):
+    """The original request is still running after the wait timeout"""
+
+
+def _settings():
+    return {
+        'ttl': int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600))),
+        'lease': int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '120')),
+        'wait': float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '60'))
+    }
+
+
+def ensure_indexes(collection):
+    if collection.full_name in _indexed_collections:
+        return
+    with _index_lock:
+        if collection.full_name in _indexed_collections:
+            return
+        collection.create_index('expires_at', name='expires_at_ttl', expireAfterSeconds=0)
+        _indexed_collections.add(collection.full_name)
+
+
+def fingerprint(*parts):
+    """Hash of the request fields that must match for a key to be reused"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _as_utc(value):
+    # pymongo returns naive datetimes (UTC) unless the client is tz_aware
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _claim(collection, record_id, user_id, key, request_fingerprint, settings):
+    """Try to become the request that computes the response for this key"""
+    now = datetime.now(timezone.utc)
+    try:
+        collection.insert_one({
+            '_id': record_id,
+            'user_id': user_id,
+            'key': key,
+            'fingerprint': request_fingerprint,
+            'status': 'in_progress',
+            'created_at': now,
+            'lease_expires_at': now + timedelta(seconds=settings['lease']),
+            'expires_at': now + timedelta(seconds=settings['ttl'])
+        })
+        return True, None
+    except DuplicateKeyError:
+        pass
+
+    existing = collection.find_one({'_id': record_id})
+    if existing is None:
+        # Removed between our insert and read (failed run or TTL); try again
+        return _claim(collection, record_id, user_id, key, request_fingerprint, settings)
+
+    if existing['fingerprint'] != request_fingerprint:
+        raise IdempotencyConflict('Idempotency-Key was already used for a different request')
+
+    if existing['status'] == 'in_progress' and _as_utc(existing['lease_expires_at']) < now:
+        # The original run died without finishing; take it over
+        taken = collection.update_one(
+            {'_id': record_id, 'status': 'in_progress', 'lease_expires_at': existing['lease_expires_at']},
+            {'$set': {'lease_expires_at': now + timedelta(seconds=settings['lease'])}}
+        )
+        if taken.modified_count:
+            return True, None
+
+    return False, existing
+
+
+def _wait_for_result(collection, record_id, settings):
+    deadline = time.monotonic() + settings['wait']
+
+    with _local_runs_lock:
+        local_run = _local_runs.get(record_id)
+    if local_run is not None:
+        local_run.wait(timeout=settings['wait'])
+
+    while True:
+        existing = collection.find_one({'_id': record_id})
+        if existing is None or existing['status'] == 'completed':
+            return existing
+        if time.monotonic() >= deadline:
+            raise IdempotencyInProgress('The original request is still being processed')
+        time.sleep(POLL_INTERVAL)
+
+
+def run_idempotent(collection, user_id, key, request_fingerprint, compute):
+    """Run compute() at most once per (user, key) and replay its result.
+
+    compute returns (payload, status_code). Returns (payload, status_code, replayed).
+    Server errors (5xx) are not stored, so a retry after a failure runs again.
+    """
+    ensure_indexes(collection)
+    settings = _settings()
+    record_id = f'{user_id}:{key}'
+
+    while True:
+        owner, existing = _claim(collection, record_id, user_id, key, request_fingerprint, settings)
+
+        if not owner:
+            if existing['status'] != 'completed':
+                existing = _wait_for_result(collection, record_id, settings)
+            if existing is None:
+                # The original run failed and released the key; run it ourselves
+                continue
+            return existing['response'], existing['status_code'], True
+
+        done = threading.Event()
+        with _local_runs_lock:
+            _local_runs[record_id] = done
+        try:
+            try:
+                payload, status_code = compute()
+            except Exception:
+                collection.delete_one({'_id': record_id, 'status': 'in_progress'})
+                raise
+
+            if status_code >= 500:
+                collection.delete_one({'_id': record_id, 'status': 'in_progress'})
+            else:
+                collection.update_one(
+                    {'_id': record_id},
+                    {'$set': {
+                        'status': 'completed',
+                        'response': payload,
+                        'status_code': status_code,
+                        'completed_at': datetime.now(timezone.utc)
+                    }}
+                )
+            return payload, status_code, False
+        finally:
+            with _local_runs_lock:
+                _local_runs.pop(record_id, None)
+            done.set()
@@ -0,0 +1,231 @@
+"""Record and replay the LLM calls made by /api/chat turns.
+
+Recording (LLM_RECORD_PATH=cassettes/<scenario>.json) wraps the real OpenAI
+client and writes every call of every chat turn to a cassette:
+
+    {"scenario": "...",
+     "setup": {"persona": {...}, "memory": {...}},
+     "turns": [{"request": {"message": "...", "continue_chat": true},
+                "llm_calls": [{"stage": "analysis", "request": {...},
+                               "response": {"content": "...", "usage": {...}}}],
+                "response": {...}, "status_code": 200}]}
+
+Replaying (LLM_PROVIDER=replay) answers each call with the recorded
+response for the same stage of the same turn, so the pipeline runs offline
+and deterministically. replay_cassettes.py drives the replay and reports
+calls, tokens and Mongo operations per scenario.
+"""
+import contextvars
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# System prompt phrase -> stage name
+STAGE_MARKERS = [
+    ('chat title generation expert', 'title'),
+    ('personal information extraction expert', 'memory_extraction'),
+    ('memory relevance expert', 'memory_relevance'),
+    ('conversation memory expert', 'conversation_memory'),
+    ('memory window extraction expert', 'memory_window'),
+    ('memory consolidation expert', 'memory_consolidation'),
+    ('diary summary expert', 'diary_summary'),
+    ('problem analysis expert', 'analysis'),
+    ('strategy development expert', 'strategy'),
+    ('implementation expert', 'implementation'),
+    ('helpful assistant. Provide practical solutions', 'fallback'),
+]
+
+_current_turn = contextvars.ContextVar('llm_cassette_turn', default=None)
+
+
+def classify_call(messages):
+    """Name the pipeline stage a call belongs to from its system prompt"""
+    system_prompt = '\n'.join(m.get('content', '') for m in messages or [] if m.get('role') == 'system')
+    for marker, stage in STAGE_MARKERS:
+        if marker in system_prompt:
+            return stage
+    return 'other'
+
+
+def estimate_tokens(messages):
+    """Prompt tokens for `messages` (tiktoken if installed, otherwise ~4 characters per token)"""
+    text = '\n'.join(m.get('content', '') for m in messages or [])
+    if tiktoken is not None:
+        return len(tiktoken.get_encoding('cl100k_base').encode(text)) + 4 * len(messages or [])
+    return len(text) // 4 + 4 * len(messages or [])
+
+
+def _usage_dict(usage):
+    if not usage:
+        return {}
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens,
+        'completion_tokens': usage.completion_tokens,
+        'cached_tokens': getattr(details, 'cached_tokens', 0) if details else 0
+    }
+
+
+def _response(content, usage, model=None):
+    details = SimpleNamespace(cached_tokens=usage.get('cached_tokens', 0))
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(index=0, finish_reason='stop',
+                                 message=SimpleNamespace(role='assistant', content=content))],
+        usage=SimpleNamespace(
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+            total_tokens=usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0),
+            prompt_tokens_details=details
+        )
+    )
+
+
+class Cassette:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.data = json.load(f)
+        else:
+            self.data = {'scenario': os.path.splitext(os.path.basename(path))[0], 'setup': None, 'turns': []}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2, ensure_ascii=False, default=str)
+
+
+_recorder = None
+
+
+def recording():
+    return _recorder is not None
+
+
+def start_turn(request, setup=None):
+    """Begin recording a chat turn; calls made in this context are attached to it"""
+    if _recorder is None:
+        return
+    turn = {'request': request, 'llm_calls': []}
+    with _recorder.cassette.lock:
+        if _recorder.cassette.data.get('setup') is None:
+            _recorder.cassette.data['setup'] = setup
+        _recorder.cassette.data['turns'].append(turn)
+    _current_turn.set(turn)
+
+
+def finish_turn(response, status_code):
+    if _recorder is None:
+        return
+    turn = _current_turn.get()
+    if turn is not None:
+        turn['response'] = response
+        turn['status_code'] = status_code
+        _current_turn.set(None)
+    _recorder.cassette.save()
+
+
+class _RecordingCompletions:
+    def __init__(self, inner, cassette):
+        self._inner = inner
+        self._cassette = cassette
+
+    def create(self, **kwargs):
+        response = self._inner.create(**kwargs)
+        turn = _current_turn.get()
+        if turn is not None:
+            with self._cassette.lock:
+                turn['llm_calls'].append({
+                    'stage': classify_call(kwargs.get('messages')),
+                    'request': {key: value for key, value in kwargs.items() if key != 'timeout'},
+                    'response': {
+                        'content': response.choices[0].message.content,
+                        'usage': _usage_dict(getattr(response, 'usage', None))
+                    }
+                })
+        return response
+
+
+class RecordingOpenAI:
+    """Wraps a real client and records calls made during chat turns"""
+
+    def __init__(self, inner, cassette):
+        global _recorder
+        self._inner = inner
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=_RecordingCompletions(inner.chat.completions, cassette))
+        _recorder = self
+
+    def with_options(self, **kwargs):
+        wrapped = RecordingOpenAI.__new__(RecordingOpenAI)
+        wrapped._inner = self._inner.with_options(**kwargs)
+        wrapped.cassette = self.cassette
+        wrapped.chat = SimpleNamespace(completions=_RecordingCompletions(wrapped._inner.chat.completions, self.cassette))
+        return wrapped
+
+
+class _ReplayCompletions:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model=None, messages=None, **kwargs):
+        return self._client.answer(model, messages or [])
+
+
+class ReplayOpenAI:
+    """Answers calls from a loaded cassette turn and records what was asked"""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_ReplayCompletions(self))
+        self._lock = threading.Lock()
+        self._queues = {}
+        self.calls = []
+
+    def with_options(self, **kwargs):
+        return self
+
+    def load_turn(self, turn):
+        """Queue the recorded responses of one turn, grouped by stage"""
+        with self._lock:
+            self._queues = {}
+            for call in turn.get('llm_calls', []):
+                self._queues.setdefault(call['stage'], []).append(call)
+            self.calls = []
+
+    def unused_calls(self):
+        with self._lock:
+            return [call['stage'] for queue in self._queues.values() for call in queue]
+
+    def answer(self, model, messages):
+        stage = classify_call(messages)
+        with self._lock:
+            queue = self._queues.get(stage) or []
+            recorded = queue.pop(0) if queue else None
+
+        if recorded is None:
+            # The pipeline now makes a call the cassette does not have; answer like the fake provider
+            from fake_llm import FakeOpenAI
+            fake = FakeOpenAI().chat.completions.create(model=model, messages=messages)
+            content, usage = fake.choices[0].message.content, {'completion_tokens': fake.usage.completion_tokens}
+        else:
+            content, usage = recorded['response']['content'], dict(recorded['response'].get('usage', {}))
+
+        # Prompt tokens come from the prompt actually sent now, so prompt changes show up in the report
+        usage['prompt_tokens'] = estimate_tokens(messages)
+        with self._lock:
+            self.calls.append({
+                'stage': stage,
+                'recorded': recorded is not None,
+                'prompt_tokens': usage['prompt_tokens'],
+                'completion_tokens': usage.get('completion_tokens', 0)
+            })
+        return _response(content, usage, model)
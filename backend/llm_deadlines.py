@@ -0,0 +1,160 @@
+"""Deadlines, per-stage budgets and hedged requests for LLM calls.
+
+Each /api/chat turn gets one overall Deadline. Every pipeline stage is given
+a share of whatever time is left, so time saved by a fast stage rolls over
+to the later ones. A call that runs past its budget raises DeadlineExceeded
+and the caller keeps the stages that already finished.
+
+With hedging enabled, a stage that has not answered by its recent p95
+latency gets a second, identical request; whichever finishes first wins.
+The attempts that are not returned (the losing hedge, a call abandoned at
+the deadline) keep running and are billed, so their results are passed to
+`on_abandoned` when they finish.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+HEDGE_MIN_SAMPLES = 20
+
+
+class DeadlineExceeded(Exception):
+    """The stage budget ran out before the LLM answered"""
+
+
+class Deadline:
+    """Overall time budget for one request, split into per-stage budgets"""
+
+    def __init__(self, seconds):
+        self.total = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_timeout(self, stage, remaining_stages, shares):
+        """Budget for `stage`: its share of the time left among the stages still to run"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f'No time left for {stage}')
+        total_share = sum(shares.get(name, 0) for name in remaining_stages) or 1.0
+        return remaining * shares.get(stage, 0) / total_share if stage in shares else remaining
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies per stage.
+
+    A listener (e.g. load_shedding.LoadController) also gets every latency and
+    every wait for a free executor thread.
+    """
+
+    def __init__(self, window=200, listener=None):
+        self._samples = {}
+        self._window = window
+        self._listener = listener
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self._window)).append(seconds)
+        if self._listener is not None:
+            self._listener.record_latency(stage, seconds)
+
+    def record_queue_wait(self, stage, seconds):
+        if self._listener is not None:
+            self._listener.record_queue_wait(stage, seconds)
+
+    def percentile(self, stage, pct):
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor_workers():
+    return int(os.getenv('LLM_EXECUTOR_WORKERS', '32'))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=executor_workers(),
+                    thread_name_prefix='llm'
+                )
+    return _executor
+
+
+def hedging_enabled():
+    return os.getenv('LLM_HEDGING', '').lower() in ('1', 'true', 'yes')
+
+
+def _report_abandoned(future, on_abandoned):
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        on_abandoned(future.result())
+    except Exception as e:
+        print(f"Recording an abandoned LLM call failed: {e}")
+
+
+def call_with_deadline(create, stage, timeout, tracker, on_abandoned=None, **kwargs):
+    """Call create(timeout=..., **kwargs) within `timeout` seconds, hedging if enabled.
+
+    on_abandoned(response) is called for every attempt that succeeds but is not returned.
+    """
+    started = time.monotonic()
+    ends_at = started + timeout
+
+    def attempt(submitted):
+        attempt_started = time.monotonic()
+        tracker.record_queue_wait(stage, attempt_started - submitted)
+        try:
+            return create(timeout=max(0.1, ends_at - attempt_started), **kwargs)
+        finally:
+            tracker.record(stage, time.monotonic() - attempt_started)
+
+    executor = _get_executor()
+    # Each attempt runs in a copy of the caller's context (e.g. the cassette turn being recorded)
+    attempts = [executor.submit(contextvars.copy_context().run, attempt, time.monotonic())]
+
+    hedge_after = tracker.percentile(stage, 95) if hedging_enabled() else None
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = wait(attempts, timeout=hedge_after)
+        if not done:
+            print(f"Hedging {stage} after {hedge_after:.2f}s")
+            attempts.append(executor.submit(contextvars.copy_context().run, attempt, time.monotonic()))
+
+    winner = None
+    last_error = None
+    pending = set(attempts)
+    while pending and winner is None:
+        done, pending = wait(pending, timeout=max(0.0, ends_at - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                winner = future
+                break
+            last_error = future.exception()
+
+    if on_abandoned is not None:
+        for future in attempts:
+            if future is not winner:
+                future.add_done_callback(lambda future: _report_abandoned(future, on_abandoned))
+
+    if winner is not None:
+        return winner.result()
+    if last_error is not None and not pending:
+        raise last_error
+    raise DeadlineExceeded(f'{stage} did not finish within {timeout:.1f}s')
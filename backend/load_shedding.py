@@ -0,0 +1,151 @@
+"""Load-adaptive service levels for /api/chat.
+
+Under a traffic spike every turn used to run the whole three-stage chain plus
+its auxiliary LLM calls, so latency grew for everyone until turns timed out.
+The admission controller watches three signals and steps the chat pipeline
+down through service levels while they are high:
+
+    0 full         everything
+    1 reduced      no memory relevance check, no conversation memory extraction
+    2 deferred     also runs memory extraction and diary summaries after the
+                   response, on a small background pool
+    3 single_call  also answers with the single-call pipeline
+
+Signals, each compared with its limit:
+    in_flight    /api/chat requests in progress in this process
+    queue_wait   p90 wait of LLM calls for a free executor thread (llm_deadlines)
+    llm_latency  p90 latency of LLM calls
+
+The largest signal/limit ratio picks the target level (LEVEL_PRESSURES). The
+controller steps up to a higher target at once, and steps down one level per
+recovery_seconds of lower pressure, so it does not flap at a boundary. Latency
+samples older than window_seconds are dropped, so the level also recovers
+after a quiet period.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LEVELS = ['full', 'reduced', 'deferred', 'single_call']
+FULL, REDUCED, DEFERRED, SINGLE_CALL = range(len(LEVELS))
+
+# Pressure (largest signal/limit ratio) at which each level above full starts
+LEVEL_PRESSURES = (1.0, 1.5, 2.0)
+
+# Fewer recent samples than this and a latency signal is not trusted
+MIN_SAMPLES = 5
+
+
+class _Window:
+    """Timestamped samples of the last `seconds`"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._samples = deque()
+
+    def add(self, value, now):
+        self._samples.append((now, value))
+        self._trim(now)
+
+    def percentile(self, pct, now):
+        self._trim(now)
+        if len(self._samples) < MIN_SAMPLES:
+            return 0.0
+        values = sorted(value for _, value in self._samples)
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+    def _trim(self, now):
+        while self._samples and now - self._samples[0][0] > self.seconds:
+            self._samples.popleft()
+
+
+class LoadController:
+    def __init__(self, max_in_flight, max_queue_wait, max_llm_latency, window_seconds=30, recovery_seconds=30,
+                 enabled=True):
+        self.limits = {'in_flight': max_in_flight, 'queue_wait': max_queue_wait, 'llm_latency': max_llm_latency}
+        self.recovery_seconds = recovery_seconds
+        self.enabled = enabled
+        self._in_flight = 0
+        self._queue_waits = _Window(window_seconds)
+        self._latencies = _Window(window_seconds)
+        self._level = FULL
+        self._changed_at = time.monotonic()
+        # Last time the pressure still called for the current level
+        self._held_at = self._changed_at
+        self._transitions = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self):
+        """Count a request as in flight for its duration; yields the service level it should run at"""
+        with self._lock:
+            self._in_flight += 1
+            level = self._evaluate(time.monotonic())
+        try:
+            yield level
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    # LatencyTracker listener interface (see llm_deadlines.py)
+    def record_latency(self, stage, seconds):
+        with self._lock:
+            self._latencies.add(seconds, time.monotonic())
+
+    def record_queue_wait(self, stage, seconds):
+        with self._lock:
+            self._queue_waits.add(seconds, time.monotonic())
+
+    def level(self):
+        with self._lock:
+            return self._evaluate(time.monotonic())
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            level = self._evaluate(now)
+            signals = self._signals(now)
+            return {
+                'enabled': self.enabled,
+                'level': level,
+                'level_name': LEVELS[level],
+                'seconds_at_level': round(now - self._changed_at, 1),
+                'transitions': self._transitions,
+                'signals': {name: round(value, 3) for name, value in signals.items()},
+                'limits': dict(self.limits)
+            }
+
+    def _signals(self, now):
+        return {
+            'in_flight': self._in_flight,
+            'queue_wait': self._queue_waits.percentile(90, now),
+            'llm_latency': self._latencies.percentile(90, now)
+        }
+
+    def _evaluate(self, now):
+        """Move the level towards the current target; call with the lock held"""
+        if not self.enabled:
+            return FULL
+
+        signals = self._signals(now)
+        pressure = max((signals[name] / limit for name, limit in self.limits.items() if limit > 0), default=0)
+        target = sum(1 for threshold in LEVEL_PRESSURES if pressure >= threshold)
+
+        if target > self._level:
+            self._set_level(target, now)
+        if target >= self._level:
+            self._held_at = now
+        else:
+            # One level down per recovery period at lower pressure, including periods without traffic
+            steps = int((now - self._held_at) // self.recovery_seconds)
+            if steps > 0:
+                self._held_at += steps * self.recovery_seconds
+                self._set_level(max(target, self._level - steps), now)
+        return self._level
+
+    def _set_level(self, level, now):
+        print(f"Chat service level: {LEVELS[self._level]} -> {LEVELS[level]}")
+        self._level = level
+        self._changed_at = now
+        self._transitions += 1
@@ -0,0 +1,116 @@
+"""Consolidate users' global memory with one LLM call per user.
+
+Memory items pile up as near-duplicates ("has a mother", "has mom", "close
+to her mother"), and all of them are injected into every chat prompt. This
+job picks users whose memory is large and changed since it was last
+consolidated, asks the LLM to merge and deduplicate all categories in one
+call, and writes the compacted memory back.
+
+Every memory write increments the document's `version`. The compacted
+memory is only written if the version is still the one that was read, so a
+fact saved by a chat turn in the meantime is never overwritten; that user is
+simply picked again on the next run.
+
+Fields written on success: the categories, version (+1), updated_at,
+consolidated_at and consolidated_item_count.
+"""
+import json
+from datetime import datetime, timezone
+
+CONSOLIDATION_PROMPT = """You are a memory consolidation expert. You get everything remembered about one user, grouped into categories, as JSON.
+
+Rewrite it as a compact version:
+- Merge items that say the same thing (e.g. "has a mother", "has mom", "close to her mother" -> "close to their mother")
+- Remove exact and near duplicates, keep every distinct fact
+- Keep each fact in the category it fits best; use only the given categories
+- Keep items short (a few words), in English
+- Never add facts that are not in the input
+
+Respond with a JSON object with the same category keys, each a list of strings. Return only JSON, nothing else."""
+
+
+def count_items(memory, categories):
+    return sum(len(memory.get(category) or []) for category in categories
+               if isinstance(memory.get(category), list))
+
+
+def select_candidates(collection, categories, min_items, limit=0, user_id=None):
+    """Memories with at least `min_items` items that changed since their last consolidation"""
+    item_count = {'$add': [
+        {'$cond': [{'$isArray': f'${category}'}, {'$size': f'${category}'}, 0]} for category in categories
+    ]}
+    pipeline = [
+        # A missing consolidated_at sorts below every date, so never-consolidated memories match
+        {'$match': {'$expr': {'$gt': ['$updated_at', '$consolidated_at']}}},
+        {'$addFields': {'_item_count': item_count}},
+        {'$match': {'_item_count': {'$gte': min_items}}},
+        {'$sort': {'_item_count': -1}},
+        {'$project': {'_item_count': 0}},
+    ]
+    if user_id:
+        pipeline.insert(0, {'$match': {'user_id': user_id}})
+    if limit:
+        pipeline.append({'$limit': limit})
+    return collection.aggregate(pipeline)
+
+
+def build_messages(memory, categories):
+    current = {category: memory.get(category) or [] for category in categories}
+    return [
+        {'role': 'system', 'content': CONSOLIDATION_PROMPT},
+        {'role': 'user', 'content': json.dumps(current, ensure_ascii=False)}
+    ]
+
+
+def parse_consolidated(text, memory, categories):
+    """Validated {category: [items]} from the LLM reply, or None if it cannot be trusted"""
+    try:
+        start, end = text.find('{'), text.rfind('}')
+        result = json.loads(text[start:end + 1])
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(result, dict):
+        return None
+
+    consolidated = {}
+    for category in categories:
+        items = result.get(category) or []
+        if not isinstance(items, list):
+            return None
+        seen = set()
+        consolidated[category] = []
+        for item in items:
+            if isinstance(item, str) and item.strip() and item.strip().lower() not in seen:
+                seen.add(item.strip().lower())
+                consolidated[category].append(item.strip())
+
+    before, after = count_items(memory, categories), count_items(consolidated, categories)
+    # Compaction never adds items, and an empty answer for a non-empty memory is a failed call
+    if after > before or (before and not after):
+        return None
+    return consolidated
+
+
+def consolidate_user(collection, memory, categories, complete, dry_run=False):
+    """Consolidate one memory document; `complete(messages)` returns the LLM reply text.
+
+    Returns (status, consolidated) with status 'consolidated', 'conflict', 'rejected' or 'dry_run'.
+    """
+    reply = complete(build_messages(memory, categories))
+    consolidated = parse_consolidated(reply, memory, categories)
+    if consolidated is None:
+        return 'rejected', None
+    if dry_run:
+        return 'dry_run', consolidated
+
+    now = datetime.now(timezone.utc)
+    result = collection.update_one(
+        # A missing version (documents written before versioning) matches None
+        {'_id': memory['_id'], 'version': memory.get('version')},
+        {
+            '$set': dict(consolidated, updated_at=now, consolidated_at=now,
+                         consolidated_item_count=count_items(consolidated, categories)),
+            '$inc': {'version': 1}
+        }
+    )
+    return ('consolidated' if result.modified_count else 'conflict'), consolidated
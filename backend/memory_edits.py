@@ -0,0 +1,58 @@
+"""Memory items the user added or deleted by hand.
+
+PUT /api/memory replaces whole categories. Comparing the submitted lists with
+the stored ones tells which items the user typed in and which they deleted.
+Both are kept on the memory document, so a job that rebuilds memory from the
+chats (reprocess_chats.py) keeps the first and does not bring back the
+second.
+
+Fields on the memory document:
+    user_items:    {category: [items added by hand]}
+    removed_items: {category: [items deleted by hand]}
+"""
+EDIT_FIELDS = ('user_items', 'removed_items')
+
+
+def _add(items_by_category, category, item):
+    items = items_by_category.setdefault(category, [])
+    if item not in items:
+        items.append(item)
+
+
+def _discard(items_by_category, category, item):
+    if item in items_by_category.get(category, []):
+        items_by_category[category].remove(item)
+
+
+def record_edits(existing, submitted):
+    """{user_items, removed_items} after `submitted` categories replace the ones in `existing`"""
+    existing = existing or {}
+    user_items = {category: list(items) for category, items in (existing.get('user_items') or {}).items()}
+    removed_items = {category: list(items) for category, items in (existing.get('removed_items') or {}).items()}
+
+    for category, items in submitted.items():
+        before = existing.get(category) or []
+        for item in items:
+            if item not in before:
+                _add(user_items, category, item)
+                _discard(removed_items, category, item)
+        for item in before:
+            if item not in items:
+                _add(removed_items, category, item)
+                _discard(user_items, category, item)
+
+    return {'user_items': user_items, 'removed_items': removed_items}
+
+
+def apply_edits(extracted, memory, categories):
+    """`extracted` categories without the items the user deleted and with the ones they added"""
+    user_items = (memory or {}).get('user_items') or {}
+    removed_items = (memory or {}).get('removed_items') or {}
+
+    result = {}
+    for category in categories:
+        removed = removed_items.get(category, [])
+        items = [item for item in extracted.get(category, []) if item not in removed]
+        items += [item for item in user_items.get(category, []) if item not in items]
+        result[category] = items
+    return result
@@ -0,0 +1,166 @@
+"""Batched memory extraction over windows of user messages.
+
+Per-message extraction makes two LLM calls for every user message (personal
+facts for the user's global memory, facts of the conversation for the chat),
+although most messages contain neither. With MEMORY_EXTRACTION=batched a
+turn only counts its message in the chat's `memory_pending`, and a worker
+pass (extract_memories.py) makes one call per due chat for the whole window
+of pending messages, returning both kinds of facts.
+
+A chat is due when
+  - it has `window_messages` pending messages,
+  - it has been idle for `idle_seconds` with anything pending, or
+  - it ended: the user started another chat since (`memory_due`).
+
+The pass subtracts what it extracted from `memory_pending`, so messages sent
+while the call was running stay pending for the next pass. Run one worker at
+a time; two passes over the same chat would extract its window twice.
+
+Chat fields: memory_pending (user messages not extracted yet), memory_due.
+Writes to them increment the chat's `revision` (see chat_archive.py).
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+# Earlier messages shown with a window, for context only
+CONTEXT_MESSAGES = 10
+
+MEMORY_WINDOW_PROMPT = """You are a memory window extraction expert. You get the newest part of one conversation, with the user's new messages numbered, and the conversation before it for context. Extract two kinds of information from the numbered user messages only.
+
+1. user_memory: lasting personal information about the user, by category:
+- family_friends: Family members, friends, relationships (e.g., "my mom", "my brother", "my best friend")
+- favorites: Likes, preferences (e.g., "I love pizza", "my favorite color is blue")
+- opinions: Views, thoughts (e.g., "exercise is healthy", "technology makes life easier")
+- skills: Abilities, competencies (e.g., "I can play piano", "I know programming")
+- personality: Personality traits (e.g., "sentimental", "I love giving gifts", "I'm a perfectionist")
+- health: Health conditions, medical issues, symptoms (e.g., "I have diabetes", "my back hurts", "I'm allergic to peanuts")
+- others: Other personal information
+
+2. conversation_facts: information specific to this conversation:
+- Temporary situations shared during the conversation (what they did today, where they are now, how they're feeling)
+- Specific problems and solutions mentioned in this conversation
+- Ideas and decisions that developed during the conversation
+- Plans and goals that emerged in this chat
+- Examples and references given during the conversation
+Do not repeat lasting personal information here.
+
+Respond in JSON format:
+{
+  "user_memory": {"family_friends": ["has a mother"], "personality": ["gift-giving"]},
+  "conversation_facts": ["Specific information mentioned in this conversation"]
+}
+
+Leave out categories with nothing new, and use empty objects or arrays if nothing is found. Return only JSON, nothing else."""
+
+
+def buffer_message(collection, chat_id):
+    """Count one more user message of the chat as waiting for extraction"""
+    collection.update_one({'_id': chat_id}, {'$inc': {'memory_pending': 1, 'revision': 1}, '$unset': {'memory_due': ''}})
+
+
+def mark_ended(collection, user_id, except_chat_id):
+    """The user moved on to another chat: their chats with pending messages are due now"""
+    collection.update_many(
+        {'user_id': user_id, 'memory_pending': {'$gt': 0}, '_id': {'$ne': except_chat_id}},
+        {'$set': {'memory_due': True}, '$inc': {'revision': 1}}
+    )
+
+
+def select_due(collection, window_messages, idle_seconds, limit=0, user_id=None):
+    """Chats whose pending messages should be extracted now, fullest windows first"""
+    idle_before = datetime.now(timezone.utc) - timedelta(seconds=idle_seconds)
+    query = {'$or': [
+        {'memory_pending': {'$gte': window_messages}},
+        {'memory_pending': {'$gt': 0}, 'updated_at': {'$lt': idle_before}},
+        {'memory_pending': {'$gt': 0}, 'memory_due': True}
+    ]}
+    if user_id:
+        query['user_id'] = user_id
+    cursor = collection.find(query, {'user_id': 1, 'messages': 1, 'memory_pending': 1}).sort('memory_pending', -1)
+    return cursor.limit(limit) if limit else cursor
+
+
+def split_window(chat):
+    """(context, window) of a chat: the window starts at its first pending user message"""
+    messages = chat.get('messages', [])
+    pending = chat.get('memory_pending', 0)
+    user_indexes = [index for index, message in enumerate(messages) if message.get('role') == 'user']
+    if pending <= 0 or not user_indexes:
+        return messages[-CONTEXT_MESSAGES:], []
+    start = user_indexes[-min(pending, len(user_indexes))]
+    return messages[max(0, start - CONTEXT_MESSAGES):start], messages[start:]
+
+
+def _transcript(messages, numbered=False):
+    lines, number = [], 0
+    for message in messages:
+        if message.get('role') == 'user':
+            number += 1
+            # New user messages are given whole; context is cut like in per-message extraction
+            lines.append(f"User ({number}): {message.get('content', '')}" if numbered
+                         else f"User: {message.get('content', '')[:200]}...")
+        else:
+            lines.append(f"Assistant: {message.get('content', '')[:200]}...")
+    return '\n'.join(lines)
+
+
+def build_messages(chat):
+    context, window = split_window(chat)
+    return [
+        {'role': 'system', 'content': MEMORY_WINDOW_PROMPT},
+        {'role': 'user', 'content': f"New messages:\n{_transcript(window, numbered=True)}\n\n"
+                                    f"Conversation before them:\n{_transcript(context)}"}
+    ]
+
+
+def _strings(items):
+    return [item.strip() for item in items if isinstance(item, str) and item.strip()] if isinstance(items, list) else []
+
+
+def parse_window(text, categories):
+    """({category: [items]}, [conversation facts]) from the LLM reply, or None if it is not usable"""
+    try:
+        start, end = text.find('{'), text.rfind('}')
+        result = json.loads(text[start:end + 1])
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(result, dict):
+        return None
+
+    user_memory = result.get('user_memory') or {}
+    if not isinstance(user_memory, dict):
+        return None
+    memory_data = {category: _strings(user_memory.get(category)) for category in categories}
+    memory_data = {category: items for category, items in memory_data.items() if items}
+    return memory_data, _strings(result.get('conversation_facts'))
+
+
+def extract_chat(collection, chat, categories, complete, save_memory, save_facts, dry_run=False):
+    """Extract one chat's pending window; `complete(messages)` returns the LLM reply text.
+
+    save_memory(user_id, memory_data) and save_facts(chat_id, facts) store the results.
+    Returns (status, memory_data, facts) with status 'extracted', 'rejected', 'dry_run' or 'empty'.
+    An exception from `complete` leaves the window pending for the next pass.
+    """
+    _, window = split_window(chat)
+    if not any(message.get('role') == 'user' for message in window):
+        status, memory_data, facts = 'empty', {}, []
+    else:
+        parsed = parse_window(complete(build_messages(chat)), categories)
+        if parsed is None:
+            # An unusable reply is not retried, like a failed per-message extraction
+            status, memory_data, facts = 'rejected', {}, []
+        else:
+            status, (memory_data, facts) = 'extracted', parsed
+    if dry_run:
+        return (status if status in ('empty', 'rejected') else 'dry_run'), memory_data, facts
+
+    if memory_data:
+        save_memory(chat['user_id'], memory_data)
+    if facts:
+        save_facts(str(chat['_id']), facts)
+    collection.update_one(
+        {'_id': chat['_id']},
+        {'$inc': {'memory_pending': -chat.get('memory_pending', 0), 'revision': 1}, '$unset': {'memory_due': ''}}
+    )
+    return status, memory_data, facts
@@ -0,0 +1,145 @@
+"""Outbound HTTP transports for the OpenAI and Google API clients.
+
+OpenAI: one httpx client shared by every thread (httpx clients are
+thread-safe), with an explicit keep-alive pool sized for our concurrency and
+HTTP/2 when the `h2` package is installed.
+
+YouTube: googleapiclient services send requests through an httplib2.Http,
+which is not thread-safe. The service object is built once and shared, but
+each thread executes its requests with its own Http instance, so keep-alive
+connections are reused per thread and never used by two threads at once.
+
+Both record per-transport metrics: requests, new connections, errors, and
+the share of requests that reused an open connection.
+
+Configuration:
+- OPENAI_MAX_CONNECTIONS: connection limit of the OpenAI pool (default: one per
+  thread that can call OpenAI at once, see default_max_connections)
+- OPENAI_MAX_KEEPALIVE: idle connections kept open (default: the limit)
+- OPENAI_KEEPALIVE_SECONDS: how long an idle connection is kept (default 30)
+- OPENAI_POOL_TIMEOUT_SECONDS: wait for a free connection (default 5)
+- OPENAI_HTTP2: "1" (default) to use HTTP/2 when available
+"""
+import os
+import threading
+
+import llm_deadlines
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+
+class TransportMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def _entry(self, name):
+        return self._counts.setdefault(name, {'requests': 0, 'new_connections': 0, 'errors': 0})
+
+    def record_request(self, name):
+        with self._lock:
+            self._entry(name)['requests'] += 1
+
+    def record_connection(self, name):
+        with self._lock:
+            self._entry(name)['new_connections'] += 1
+
+    def record_error(self, name):
+        with self._lock:
+            self._entry(name)['errors'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, counts in self._counts.items():
+                reused = max(0, counts['requests'] - counts['new_connections'])
+                result[name] = dict(counts, reused=reused,
+                                    reuse_ratio=round(reused / counts['requests'], 3) if counts['requests'] else None)
+            return result
+
+
+metrics = TransportMetrics()
+
+
+def default_max_connections():
+    """The number of threads that can be waiting on OpenAI at the same time.
+
+    Pipeline stages run on the LLM executor, counted twice when hedging is on
+    since second attempts keep it busier. Request threads make the single-call
+    requests (titles, memory extraction, diary summaries); in-flight chat
+    turns are capped by the load controller, so REQUEST_THREADS defaults to
+    LOAD_MAX_IN_FLIGHT. Deferred work after a turn adds its own workers.
+    """
+    stage_calls = llm_deadlines.executor_workers() * (2 if llm_deadlines.hedging_enabled() else 1)
+    request_threads = int(os.getenv('REQUEST_THREADS', os.getenv('LOAD_MAX_IN_FLIGHT', '24')))
+    deferred_workers = int(os.getenv('DEFERRED_WORK_WORKERS', '2'))
+    return stage_calls + request_threads + deferred_workers
+
+
+def openai_http_client(timeout):
+    """httpx client for the OpenAI SDK with an explicit pool and connection metrics"""
+    import httpx
+    from openai import DefaultHttpxClient
+
+    max_connections = int(os.getenv('OPENAI_MAX_CONNECTIONS', '0')) or default_max_connections()
+    http2 = os.getenv('OPENAI_HTTP2', '1').lower() in ('1', 'true', 'yes')
+    if http2 and h2 is None:
+        print("OPENAI_HTTP2 is on but the h2 package is not installed; using HTTP/1.1")
+        http2 = False
+
+    def trace(event_name, info):
+        # httpcore reports every TCP connect; requests without one reused a pooled connection
+        if event_name == 'connection.connect_tcp.complete':
+            metrics.record_connection('openai')
+
+    def on_request(request):
+        metrics.record_request('openai')
+        request.extensions['trace'] = trace
+
+    def on_response(response):
+        if response.status_code >= 500:
+            metrics.record_error('openai')
+
+    return DefaultHttpxClient(
+        http2=http2,
+        timeout=httpx.Timeout(timeout, pool=float(os.getenv('OPENAI_POOL_TIMEOUT_SECONDS', '5'))),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.getenv('OPENAI_MAX_KEEPALIVE', str(max_connections))),
+            keepalive_expiry=float(os.getenv('OPENAI_KEEPALIVE_SECONDS', '30'))
+        ),
+        event_hooks={'request': [on_request], 'response': [on_response]}
+    )
+
+
+class ThreadLocalHttp:
+    """One httplib2.Http per thread for executing googleapiclient requests"""
+
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            import httplib2
+            http = self._local.http = httplib2.Http(timeout=self.timeout)
+        return http
+
+    def execute(self, request):
+        """request.execute() on this thread's Http, recording whether a connection was reused"""
+        http = self.get()
+        open_before = {id(connection) for connection in http.connections.values()}
+        metrics.record_request(self.name)
+        try:
+            return request.execute(http=http)
+        except Exception:
+            metrics.record_error(self.name)
+            raise
+        finally:
+            if any(id(connection) not in open_before for connection in http.connections.values()):
+                metrics.record_connection(self.name)
@@ -0,0 +1,147 @@
+"""Password hashing on a dedicated, bounded process pool.
+
+Werkzeug's password hashes are deliberately slow KDFs. Running them inline in
+a request handler keeps that worker busy on the CPU, so a burst of logins
+starves chat traffic. This module runs them in a small process pool instead
+and refuses new work once too many jobs are queued.
+
+Workers are spawned, not forked, so they do not inherit the app's Mongo and
+OpenAI sockets. A spawned worker imports the parent's __main__ (under another
+name) before it starts working, whatever the start method: forkserver
+children do the same. So the pool must be started from a script that is
+cheap to import; serve.py starts it before app is imported, and start()
+launches every worker right away so none is spawned later. Without start()
+the pool is created on first use.
+
+A hash that takes longer than PASSWORD_HASH_TIMEOUT raises
+PasswordHasherBusy like a full queue, so callers answer both with 503.
+
+Configuration (read from the environment when the pool is first used):
+- PASSWORD_HASH_METHOD: Werkzeug method string, e.g. "pbkdf2" or "scrypt:32768:8:1"
+- PASSWORD_HASH_WORKERS: pool size, 0 runs hashing inline (default 2)
+- PASSWORD_HASH_MAX_QUEUE: jobs allowed to wait beyond the running ones (default 32)
+- PASSWORD_HASH_TIMEOUT: seconds to wait for a result (default 10)
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full or a hash timed out, and the request should be retried later"""
+
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+# Hash prefix ("pbkdf2:sha256:600000") for each configured method, per process
+_method_prefixes = {}
+
+
+def get_hash_method():
+    return os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2')
+
+
+def _method_prefix(method):
+    """Return the prefix Werkzeug writes for `method`, including default costs"""
+    prefix = _method_prefixes.get(method)
+    if prefix is None:
+        # Let Werkzeug fill in its own defaults instead of duplicating them here
+        prefix = generate_password_hash('', method=method).split('$', 1)[0]
+        _method_prefixes[method] = prefix
+    return prefix
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify_and_rehash(stored_hash, password, method):
+    """Check a password and, if it matches an outdated hash, compute a new one"""
+    if not check_password_hash(stored_hash, password):
+        return False, None
+
+    if stored_hash.split('$', 1)[0] != _method_prefix(method):
+        return True, generate_password_hash(password, method=method)
+
+    return True, None
+
+
+def _get_pool():
+    global _pool, _slots
+    if _slots is None:
+        with _pool_lock:
+            if _slots is None:
+                workers = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+                max_queue = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', '32'))
+                if workers > 0:
+                    # spawn avoids forking a process that already holds Mongo/OpenAI sockets
+                    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+                _slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+    return _pool, _slots
+
+
+def start():
+    """Create the pool and launch its workers now instead of on the first hash"""
+    pool, _ = _get_pool()
+    if pool is not None:
+        method = get_hash_method()
+        # One job per worker starts every process and fills its method prefix cache
+        workers = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+        warm_ups = [pool.submit(_method_prefix, method) for _ in range(workers)]
+        for future in warm_ups:
+            future.result()
+
+
+def _run(fn, *args):
+    pool, slots = _get_pool()
+
+    if not slots.acquire(blocking=False):
+        raise PasswordHasherBusy('Too many password hashing requests in progress')
+
+    if pool is None:
+        try:
+            return fn(*args)
+        finally:
+            slots.release()
+
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+
+    # Keep the slot until the worker is actually done, even if we stop waiting
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', '10')))
+    except TimeoutError:
+        raise PasswordHasherBusy('Password hashing is taking too long')
+
+
+def hash_password(password):
+    """Hash a password with the configured method"""
+    return _run(_hash, password, get_hash_method())
+
+
+def verify_password(stored_hash, password):
+    """Verify a password against its stored hash.
+
+    Returns (matches, new_hash). new_hash is set when the password matched but
+    the stored hash uses a different algorithm or cost than the configured one,
+    so the caller can upgrade it in place.
+    """
+    return _run(_verify_and_rehash, stored_hash, password, get_hash_method())
+
+
+def shutdown():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = None
+        _slots = None
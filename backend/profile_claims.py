@@ -0,0 +1,84 @@
+"""Profile claims carried in the access token.
+
+Access tokens used to carry only the user id, so every endpoint that needed
+profileComplete, personaSelected or the persona role read the users or
+personas collection. Tokens now also carry the profile fields and the
+persona role, signed with the rest of the token, plus the user's
+`claims_version` at the time they were issued:
+
+    {'sub': user_id, 'profile': {username, email, profileComplete, ...}, 'role': 'friend', 'cv': 3}
+
+Every change to one of these fields increments the user's claims_version
+and returns a fresh token in the X-Access-Token header. A token's claims are
+trusted only while its cv is the current version; older tokens (other
+devices, tokens issued before this change) fall back to the database.
+
+Current versions are cached per process. A change made in this process
+updates the cache at once; one made by another worker is seen when the
+entry expires, so for at most `ttl` seconds another worker may still trust
+the old claims.
+"""
+import threading
+import time
+
+from pymongo import ReturnDocument
+
+CLAIM = 'profile'
+ROLE_CLAIM = 'role'
+VERSION_CLAIM = 'cv'
+TOKEN_HEADER = 'X-Access-Token'
+
+PROFILE_FIELDS = ['username', 'email', 'profileComplete', 'personaSelected', 'ageGroup', 'pronouns', 'occupation']
+
+
+def build_claims(user, role):
+    """Additional token claims for a user document read with claims_version"""
+    return {
+        CLAIM: {field: user.get(field) for field in PROFILE_FIELDS},
+        ROLE_CLAIM: role,
+        VERSION_CLAIM: user.get('claims_version', 0)
+    }
+
+
+class VersionCache:
+    """Current claims_version per user, cached for `ttl` seconds"""
+
+    def __init__(self, collection, ttl):
+        self.collection = collection
+        self.ttl = ttl
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def current(self, user_id, object_id):
+        with self._lock:
+            cached = self._versions.get(user_id)
+        if cached and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        user = self.collection.find_one({'_id': object_id}, {'claims_version': 1})
+        # A deleted user has no current claims
+        version = user.get('claims_version', 0) if user else None
+        self.remember(user_id, version)
+        return version
+
+    def remember(self, user_id, version):
+        with self._lock:
+            self._versions[user_id] = (version, time.monotonic())
+
+    def is_current(self, user_id, object_id, token_version):
+        return token_version is not None and self.current(user_id, object_id) == token_version
+
+    def update(self, user_id, object_id, update=None, projection=None):
+        """Apply `update` to the user and bump the claims version in the same write.
+
+        Returns the updated user document (with claims_version), or None if there is no such user.
+        """
+        update = dict(update or {})
+        update['$inc'] = dict(update.get('$inc', {}), claims_version=1)
+        user = self.collection.find_one_and_update(
+            {'_id': object_id}, update,
+            projection=dict(projection or {}, claims_version=1),
+            return_document=ReturnDocument.AFTER
+        )
+        if user:
+            self.remember(user_id, user['claims_version'])
+        return user
@@ -0,0 +1,141 @@
+"""Per-user rate limits and in-flight caps for expensive endpoints.
+
+Each (endpoint, user) pair gets an in-process token bucket and a cap on
+concurrent requests. When a shared collection is configured, requests are
+also counted in a Mongo-backed sliding window, so the limit holds across
+several worker processes.
+
+A bucket that has refilled completely is the same as no bucket, so idle
+buckets are dropped by a sweep that runs at most every SWEEP_SECONDS, and
+the number of tracked users only grows with the ones active recently.
+
+Limits per endpoint:
+    {'requests': 10, 'per_seconds': 60, 'burst': 3, 'concurrency': 2}
+"""
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+
+Decision = namedtuple('Decision', ['allowed', 'retry_after', 'reason'])
+
+ALLOWED = Decision(True, 0, None)
+
+SWEEP_SECONDS = 60
+
+
+class RateLimiter:
+    def __init__(self, limits, shared_collection=None):
+        self.limits = limits
+        self.shared_collection = shared_collection
+        self._buckets = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def acquire(self, endpoint, user_id):
+        """Reserve a request slot; release() must be called when an allowed request ends"""
+        limits = self.limits.get(endpoint)
+        if not limits:
+            return ALLOWED
+
+        key = (endpoint, user_id)
+        rate = limits['requests'] / limits['per_seconds']
+        capacity = limits.get('burst', limits['requests'])
+
+        with self._lock:
+            if self._in_flight.get(key, 0) >= limits.get('concurrency', math.inf):
+                return Decision(False, 1, 'Too many requests in progress')
+
+            now = time.monotonic()
+            if now - self._last_sweep >= SWEEP_SECONDS:
+                self._sweep(now)
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return Decision(False, (1 - tokens) / rate, 'Rate limit exceeded')
+
+            self._buckets[key] = (tokens - 1, now)
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+        if self.shared_collection is not None:
+            try:
+                retry_after = self._check_shared_window(endpoint, user_id, limits)
+            except Exception as e:
+                # Fail open: the in-process limits still apply if Mongo is unavailable
+                print(f"Shared rate limit check failed: {e}")
+                retry_after = 0
+            if retry_after:
+                self._refund(key, rate, capacity)
+                self.release(endpoint, user_id)
+                return Decision(False, retry_after, 'Rate limit exceeded')
+
+        return ALLOWED
+
+    def _refund(self, key, rate, capacity):
+        """Give back the token taken for a request the shared window rejected"""
+        with self._lock:
+            if key in self._buckets:
+                now = time.monotonic()
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(capacity, tokens + (now - updated) * rate + 1), now)
+
+    def _sweep(self, now):
+        """Drop buckets that have refilled and have no request in flight (called with the lock held)"""
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if key in self._in_flight:
+                continue
+            limits = self.limits.get(key[0])
+            if limits:
+                rate = limits['requests'] / limits['per_seconds']
+                if tokens + (now - updated) * rate < limits.get('burst', limits['requests']):
+                    continue
+            del self._buckets[key]
+        self._last_sweep = now
+
+    def release(self, endpoint, user_id):
+        key = (endpoint, user_id)
+        with self._lock:
+            remaining = self._in_flight.get(key, 0) - 1
+            if remaining > 0:
+                self._in_flight[key] = remaining
+            else:
+                self._in_flight.pop(key, None)
+
+    def _check_shared_window(self, endpoint, user_id, limits):
+        """Sliding window counter across workers; returns seconds to wait, or 0 if allowed"""
+        window_seconds = limits['per_seconds']
+        now = time.time()
+        window = int(now // window_seconds)
+        elapsed = now - window * window_seconds
+
+        current = self.shared_collection.find_one_and_update(
+            {'_id': f'{endpoint}:{user_id}:{window}'},
+            {
+                '$inc': {'count': 1},
+                '$setOnInsert': {
+                    # Kept for two windows: it is the "previous" window for the next one
+                    'expires_at': datetime.fromtimestamp((window + 2) * window_seconds, timezone.utc)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = self.shared_collection.find_one({'_id': f'{endpoint}:{user_id}:{window - 1}'})
+
+        # Weight the previous window by how much of it still overlaps the sliding window
+        estimate = current['count'] + (previous['count'] if previous else 0) * (1 - elapsed / window_seconds)
+        if estimate <= limits['requests']:
+            return 0
+
+        self.shared_collection.update_one({'_id': current['_id']}, {'$inc': {'count': -1}})
+        return max(1, window_seconds - elapsed)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._in_flight.clear()
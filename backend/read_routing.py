@@ -0,0 +1,118 @@
+"""Read preferences per endpoint class, with causally consistent sessions.
+
+Reads are grouped into classes:
+    primary  - reads that feed a write (default, always the primary)
+    list     - list endpoints (chat history, diary, memory, persona)
+    context  - per-turn prompt context in /api/chat (memory, persona, feedback)
+
+List and context reads may go to secondaries, but only when configured to
+(READ_PREFERENCE_LIST / READ_PREFERENCE_CONTEXT); every class reads from the
+primary by default until check_read_routing.py has passed against a replica
+set. To keep read-your-own-writes,
+each request that routes reads runs them in a causally consistent session.
+After a successful write request the session's operation and cluster time
+are returned to the client as an opaque token (X-Read-After); the client
+sends the latest token back and the session is advanced to it, so a
+secondary only answers once it has replicated that write.
+
+On a standalone server the read preferences have no effect and no tokens
+are issued.
+"""
+import base64
+import os
+import time
+
+import bson
+from bson.timestamp import Timestamp
+from pymongo import ReadPreference
+from pymongo.read_preferences import (Nearest, Primary, PrimaryPreferred,
+                                      Secondary, SecondaryPreferred)
+
+TOKEN_HEADER = 'X-Read-After'
+
+# Tokens more than this far in the future are ignored instead of making secondaries wait for them
+MAX_TOKEN_SKEW_SECONDS = 5
+
+_MODES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+DEFAULT_MODES = {
+    'primary': 'primary',
+    'list': 'primary',
+    'context': 'primary',
+}
+
+
+def _read_preference(mode, max_staleness):
+    if mode not in _MODES:
+        raise ValueError(f'Unknown read preference: {mode}')
+    if mode == 'primary':
+        return ReadPreference.PRIMARY
+    return _MODES[mode](max_staleness=max_staleness)
+
+
+def load_preferences():
+    """{read class: ReadPreference} from READ_PREFERENCE_<CLASS> and READ_MAX_STALENESS_SECONDS"""
+    # -1 means no staleness bound; MongoDB requires at least 90 seconds otherwise
+    max_staleness = int(os.getenv('READ_MAX_STALENESS_SECONDS', '-1'))
+    return {
+        read_class: _read_preference(os.getenv(f'READ_PREFERENCE_{read_class.upper()}', mode), max_staleness)
+        for read_class, mode in DEFAULT_MODES.items()
+    }
+
+
+def routes_to_secondaries(preferences):
+    return any(preference.mode != ReadPreference.PRIMARY.mode for preference in preferences.values())
+
+
+def encode_token(session):
+    """Opaque client token for the session's latest operation, or None before any operation"""
+    if session.operation_time is None:
+        return None
+    raw = bson.encode({'operation_time': session.operation_time, 'cluster_time': session.cluster_time})
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _plausible(timestamp):
+    return isinstance(timestamp, Timestamp) and timestamp.time <= time.time() + MAX_TOKEN_SKEW_SECONDS
+
+
+def _valid_cluster_time(cluster_time):
+    """Whether `cluster_time` has the shape of a $clusterTime document the server sent"""
+    if not isinstance(cluster_time, dict) or not set(cluster_time) <= {'clusterTime', 'signature'}:
+        return False
+    signature = cluster_time.get('signature')
+    if signature is not None and not (isinstance(signature, dict)
+                                      and isinstance(signature.get('hash'), bytes)
+                                      and isinstance(signature.get('keyId'), int)):
+        return False
+    return _plausible(cluster_time.get('clusterTime'))
+
+
+def apply_token(session, token):
+    """Advance `session` to a client token; invalid or implausible tokens are ignored.
+
+    Both times are checked before the session is touched, so an ignored token
+    leaves the session as it was.
+    """
+    if not token:
+        return False
+    try:
+        decoded = bson.decode(base64.urlsafe_b64decode(token.encode('ascii')))
+    except Exception:
+        return False
+
+    operation_time = decoded.get('operation_time')
+    cluster_time = decoded.get('cluster_time')
+    if not _plausible(operation_time) or (cluster_time is not None and not _valid_cluster_time(cluster_time)):
+        return False
+
+    session.advance_operation_time(operation_time)
+    if cluster_time is not None:
+        session.advance_cluster_time(cluster_time)
+    return True
@@ -0,0 +1,44 @@
+"""Backfill the related-chats vector index from existing diary entries.
+
+    python rebuild_related_chats.py            # every user
+    python rebuild_related_chats.py <user_id>  # one user
+
+Run after changing the embedding (related_chats.EMBEDDING_DIM or features)
+or after reprocess_chats.py rewrote diary summaries. Uses the same
+configuration (.env) as app.py.
+"""
+import argparse
+import sys
+import time
+
+import related_chats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill the related-chats index')
+    parser.add_argument('user_id', nargs='?', help='only rebuild this user')
+    args = parser.parse_args()
+
+    if not related_chats.available():
+        print('NumPy is not installed; the related-chats index is not used')
+        return 1
+
+    import app as webapp
+    db = webapp.db
+    collection = webapp.related_collection
+
+    user_ids = [args.user_id] if args.user_id else [str(user['_id']) for user in db['users'].find({}, {'_id': 1})]
+
+    started = time.monotonic()
+    entries = 0
+    for count, user_id in enumerate(user_ids, 1):
+        indexed = related_chats.rebuild_user_index(db, collection, user_id)
+        entries += indexed
+        print(f"[{count}/{len(user_ids)}] indexed {indexed} diary entries of user {user_id}")
+
+    print(f"Rebuilt related-chats index for {len(user_ids)} users ({entries} entries) in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
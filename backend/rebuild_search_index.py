@@ -0,0 +1,36 @@
+"""Backfill the search index from existing chats, diary entries and memory.
+
+    python rebuild_search_index.py            # every user
+    python rebuild_search_index.py <user_id>  # one user
+
+Uses the same configuration (.env) as app.py.
+"""
+import argparse
+import sys
+import time
+
+import search_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill the search index')
+    parser.add_argument('user_id', nargs='?', help='only rebuild this user')
+    args = parser.parse_args()
+
+    import app as webapp
+    db = webapp.db
+    collection = webapp.search_collection
+
+    user_ids = [args.user_id] if args.user_id else [str(user['_id']) for user in db['users'].find({}, {'_id': 1})]
+
+    started = time.monotonic()
+    for count, user_id in enumerate(user_ids, 1):
+        search_index.rebuild_user_index(db, collection, user_id, webapp.MEMORY_CATEGORIES)
+        print(f"[{count}/{len(user_ids)}] indexed user {user_id}")
+
+    print(f"Rebuilt search index for {len(user_ids)} users in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""Related past chats for the chat pipeline, from a per-user vector index.
+
+Every chat's diary entry (its title and summary) is stored with a vector. On
+each turn the user's message is compared against the user's vectors and the
+closest earlier chats are handed to the analysis stage, so users do not have
+to re-explain context from other chats.
+
+The embedding is local and CPU-only: words, word pairs and word prefixes
+(which match inflected Turkish forms), without stop words, hashed into
+EMBEDDING_DIM buckets with log term frequencies. Search loads a user's vectors into one
+NumPy matrix, weights it with inverse document frequencies over that user's
+entries (so boilerplate shared by every summary counts for little) and ranks
+by cosine similarity. Matrices are cached per process and dropped when the
+user's index changes here, or after CACHE_SECONDS for changes made elsewhere.
+
+app.py updates an entry in the background whenever a diary summary changes;
+rebuild_related_chats.py backfills existing diary entries.
+
+Document shape:
+    {_id: "<user_id>:<entry_id>", user_id, entry_id, chat_id, title, summary,
+     date, dim, vector (float32 bytes), updated_at}
+
+Requires NumPy; without it the index is not used.
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from bson import Binary
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EMBEDDING_DIM = 1024
+CACHE_SECONDS = int(os.getenv('RELATED_CHATS_CACHE_SECONDS', '300'))
+CACHE_USERS = int(os.getenv('RELATED_CHATS_CACHE_USERS', '1000'))
+
+# Weights of the hashed features relative to single words
+BIGRAM_WEIGHT = 0.7
+PREFIX_WEIGHT = 0.5
+PREFIX_LENGTH = 5
+
+STOP_WORDS = frozenset('''
+a about after again all also am an and any are as at be been but by can could did do does for from had has
+have he her him his how i if in into is it its just me more my no not of on or our she so some than that the
+their them then there they this to too was we were what when which who will with would you your today talked
+acaba ama ben bir biraz bu da daha de diye en gibi hem her için ile ise kadar ki mi mu mü mı ne o onu sen
+şey şu ve veya ya çok
+'''.split())
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+_indexed_collections = set()
+_index_lock = threading.Lock()
+
+# user_id -> {'loaded_at', 'entries', 'matrix', 'idf'}
+_matrices = OrderedDict()
+# user_id -> number of invalidations, so a load that raced with an update is not cached
+_generations = {}
+_matrices_lock = threading.Lock()
+
+
+def available():
+    return np is not None
+
+
+def ensure_indexes(collection):
+    """Create the index on first use, not at import"""
+    if collection.full_name in _indexed_collections:
+        return
+    with _index_lock:
+        if collection.full_name in _indexed_collections:
+            return
+        collection.create_index('user_id', name='user_id')
+        _indexed_collections.add(collection.full_name)
+
+
+def _features(text):
+    words = [word for word in (word.lower() for word in _WORD.findall(text or '')) if word not in STOP_WORDS]
+    features = Counter(words)
+    for first, second in zip(words, words[1:]):
+        features[f'{first} {second}'] += BIGRAM_WEIGHT
+    for word in words:
+        if len(word) > PREFIX_LENGTH:
+            features[f'{word[:PREFIX_LENGTH]}*'] += PREFIX_WEIGHT
+    return features
+
+
+def embed(text):
+    """Hashed term-frequency vector of `text` (float32, not normalized)"""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature, count in _features(text).items():
+        digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+        # The top bit picks a sign, so colliding features tend to cancel instead of adding up
+        sign = 1.0 if digest >> 63 else -1.0
+        weight = 1.0 + math.log(count) if count >= 1 else count
+        vector[digest % EMBEDDING_DIM] += sign * weight
+    return vector
+
+
+def entry_text(title, summary):
+    return f'{title or ""}\n{summary or ""}'
+
+
+def invalidate(user_id):
+    with _matrices_lock:
+        _matrices.pop(user_id, None)
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+
+
+def index_entry(collection, user_id, entry_id, chat_id, title, summary, date=None):
+    ensure_indexes(collection)
+    collection.update_one(
+        {'_id': f'{user_id}:{entry_id}'},
+        {'$set': {
+            'user_id': user_id,
+            'entry_id': entry_id,
+            'chat_id': chat_id,
+            'title': title,
+            'summary': summary,
+            'date': date,
+            'dim': EMBEDDING_DIM,
+            'vector': Binary(embed(entry_text(title, summary)).tobytes()),
+            'updated_at': datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+    invalidate(user_id)
+
+
+def remove_entry(collection, user_id, entry_id):
+    collection.delete_one({'_id': f'{user_id}:{entry_id}'})
+    invalidate(user_id)
+
+
+def rebuild_user_index(db, collection, user_id):
+    """Re-embed all of one user's diary entries; returns how many were indexed"""
+    ensure_indexes(collection)
+    collection.delete_many({'user_id': user_id})
+    count = 0
+    for entry in db['diary'].find({'user_id': user_id, 'message_count': {'$gt': 0}}):
+        index_entry(collection, user_id, str(entry['_id']), entry.get('chat_id'), entry.get('title'),
+                    entry.get('summary'), entry.get('date'))
+        count += 1
+    invalidate(user_id)
+    return count
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _load(collection, user_id):
+    with _matrices_lock:
+        cached = _matrices.get(user_id)
+        if cached and time.monotonic() - cached['loaded_at'] < CACHE_SECONDS:
+            _matrices.move_to_end(user_id)
+            return cached
+        generation = _generations.get(user_id, 0)
+
+    entries, vectors = [], []
+    for document in collection.find({'user_id': user_id}, {'vector': 1, 'dim': 1, 'chat_id': 1, 'title': 1,
+                                                           'summary': 1, 'date': 1}):
+        # Entries embedded with another dimension wait for a rebuild
+        if document.get('dim') != EMBEDDING_DIM:
+            continue
+        vectors.append(np.frombuffer(document.pop('vector'), dtype=np.float32))
+        entries.append(document)
+
+    if vectors:
+        matrix = np.vstack(vectors)
+        # Smoothed inverse document frequency per bucket over this user's entries
+        document_frequency = np.count_nonzero(matrix, axis=0)
+        idf = (np.log((1 + len(vectors)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix = _normalize_rows(matrix * idf)
+    else:
+        matrix, idf = np.zeros((0, EMBEDDING_DIM), dtype=np.float32), np.ones(EMBEDDING_DIM, dtype=np.float32)
+
+    loaded = {'loaded_at': time.monotonic(), 'entries': entries, 'matrix': matrix, 'idf': idf}
+    with _matrices_lock:
+        if _generations.get(user_id, 0) == generation:
+            _matrices[user_id] = loaded
+            _matrices.move_to_end(user_id)
+            while len(_matrices) > CACHE_USERS:
+                _matrices.popitem(last=False)
+    return loaded
+
+
+def search(collection, user_id, text, limit=3, min_score=0.05, exclude_chat_id=None):
+    """Up to `limit` of the user's entries most similar to `text`, as (score, entry), best first"""
+    index = _load(collection, user_id)
+    if not index['entries']:
+        return []
+
+    query = embed(text) * index['idf']
+    norm = np.linalg.norm(query)
+    if not norm:
+        return []
+    scores = index['matrix'] @ (query / norm)
+
+    results = []
+    for position in np.argsort(-scores):
+        score = float(scores[position])
+        if score < min_score:
+            break
+        entry = index['entries'][position]
+        if exclude_chat_id and entry.get('chat_id') == exclude_chat_id:
+            continue
+        results.append((score, entry))
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def format_context(results, token_budget):
+    """Prompt block for related chats, cut to roughly `token_budget` tokens"""
+    if not results or token_budget <= 0:
+        return ""
+    header = "\n\n--- RELATED PAST CHATS ---\n"
+    lines = []
+    remaining = token_budget - _estimate_tokens(header)
+    for _, entry in results:
+        date = entry.get('date')
+        prefix = f"- {date.strftime('%Y-%m-%d') + ' ' if isinstance(date, datetime) else ''}{entry.get('title') or ''}: "
+        summary = entry.get('summary') or ''
+        available_chars = (remaining - _estimate_tokens(prefix)) * 4
+        if available_chars < 40:
+            break
+        if len(summary) > available_chars:
+            summary = summary[:available_chars - 3].rstrip() + '...'
+        line = prefix + summary
+        lines.append(line)
+        remaining -= _estimate_tokens(line)
+    if not lines:
+        return ""
+    return header + "\n".join(lines) + "\n"
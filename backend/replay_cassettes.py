@@ -0,0 +1,211 @@
+"""Replay recorded /api/chat cassettes offline and report what each turn costs.
+
+Record scenarios against the real API first (one cassette per scenario):
+
+    LLM_RECORD_PATH=cassettes/career_advice.json python app.py
+    # ... chat through the frontend, then stop the server
+
+Then replay them with LLM_PROVIDER=replay against a local scratch database
+(--db, default webapp_replay; see scratch_database.py):
+
+    python replay_cassettes.py cassettes/*.json
+    python replay_cassettes.py cassettes/*.json --write-baseline cassettes/baseline.json
+    python replay_cassettes.py cassettes/*.json --baseline cassettes/baseline.json --tolerance 0.05
+
+Per scenario the report lists LLM calls, input and output tokens per stage
+and Mongo operations by command. Input tokens are counted from the prompts
+the current code builds; output tokens come from the recording. With
+--baseline the exit code is 1 if calls, tokens or Mongo operations grew
+by more than the tolerance, or a turn no longer returns its recorded status.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+
+from pymongo import monitoring
+
+import scratch_database
+
+# Commands the driver sends on its own; they say nothing about the code under test
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue'}
+GATED_METRICS = ['llm_calls', 'input_tokens', 'output_tokens', 'mongo_ops']
+
+
+class MongoOpCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.database = None
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+
+    def started(self, event):
+        if event.database_name != self.database or event.command_name in IGNORED_COMMANDS:
+            return
+        with self._lock:
+            self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def setup_user(webapp, scenario, setup):
+    user_id = str(webapp.users_collection.insert_one({
+        'username': f'replay-{scenario}',
+        'email': f'replay-{scenario}@example.com',
+        'created_at': datetime.now(timezone.utc)
+    }).inserted_id)
+
+    setup = setup or {}
+    if setup.get('persona'):
+        webapp.personas_collection.insert_one({**setup['persona'], 'user_id': user_id})
+    if setup.get('memory'):
+        webapp.memories_collection.insert_one({**setup['memory'], 'user_id': user_id})
+    return user_id
+
+
+def replay_cassette(webapp, counter, path):
+    with open(path, encoding='utf-8') as f:
+        cassette = json.load(f)
+    scenario = cassette.get('scenario') or os.path.splitext(os.path.basename(path))[0]
+
+    webapp.client.drop_database(webapp.db.name)
+    webapp.rate_limiter.reset()
+    user_id = setup_user(webapp, scenario, cassette.get('setup'))
+    with webapp.app.app_context():
+        token = webapp.create_access_token(identity=user_id)
+
+    llm = webapp.openai.get()
+    test_client = webapp.app.test_client()
+    report = {'scenario': scenario, 'turns': 0, 'llm_calls': 0, 'input_tokens': 0, 'output_tokens': 0,
+              'stages': {}, 'mongo_ops': 0, 'mongo_commands': {},
+              'unrecorded_calls': [], 'unused_calls': [], 'status_mismatches': []}
+
+    chat_id = None
+    counter.reset()
+    for number, turn in enumerate(cassette.get('turns', []), 1):
+        llm.load_turn(turn)
+        body = {'message': turn['request']['message']}
+        if turn['request'].get('continue_chat') and chat_id:
+            body['chat_id'] = chat_id
+
+        response = test_client.post('/api/chat', json=body, headers={'Authorization': f'Bearer {token}'})
+        payload = response.get_json() or {}
+        chat_id = payload.get('chat_id', chat_id)
+
+        report['turns'] += 1
+        if turn.get('status_code') and response.status_code != turn['status_code']:
+            report['status_mismatches'].append(
+                f"turn {number}: {response.status_code} (recorded {turn['status_code']})")
+        report['unused_calls'] += [f'turn {number}: {stage}' for stage in llm.unused_calls()]
+
+        for call in llm.calls:
+            stage = report['stages'].setdefault(call['stage'], {'calls': 0, 'input_tokens': 0, 'output_tokens': 0})
+            stage['calls'] += 1
+            stage['input_tokens'] += call['prompt_tokens']
+            stage['output_tokens'] += call['completion_tokens']
+            report['llm_calls'] += 1
+            report['input_tokens'] += call['prompt_tokens']
+            report['output_tokens'] += call['completion_tokens']
+            if not call['recorded']:
+                report['unrecorded_calls'].append(f"turn {number}: {call['stage']}")
+
+    report['mongo_commands'] = dict(sorted(counter.counts.items()))
+    report['mongo_ops'] = sum(counter.counts.values())
+    return report
+
+
+def print_report(report):
+    turns = report['turns'] or 1
+    print(f"\n{report['scenario']}: {report['turns']} turns, {report['llm_calls']} LLM calls "
+          f"({report['llm_calls'] / turns:.1f}/turn), {report['mongo_ops']} Mongo ops "
+          f"({report['mongo_ops'] / turns:.1f}/turn)")
+    print(f"  {'stage':<22}{'calls':>7}{'input':>10}{'output':>10}")
+    for stage, stats in sorted(report['stages'].items()):
+        print(f"  {stage:<22}{stats['calls']:>7}{stats['input_tokens']:>10}{stats['output_tokens']:>10}")
+    print(f"  {'total':<22}{report['llm_calls']:>7}{report['input_tokens']:>10}{report['output_tokens']:>10}")
+    print(f"  mongo: {', '.join(f'{name}={count}' for name, count in report['mongo_commands'].items())}")
+    for label in ('unrecorded_calls', 'unused_calls', 'status_mismatches'):
+        if report[label]:
+            print(f"  {label.replace('_', ' ')}: {'; '.join(report[label])}")
+
+
+def compare(reports, baseline, tolerance):
+    """Regressions against a baseline report, as readable lines"""
+    regressions = []
+    for report in reports:
+        previous = baseline.get(report['scenario'])
+        if report['status_mismatches']:
+            regressions.append(f"{report['scenario']}: status changed ({'; '.join(report['status_mismatches'])})")
+        if not previous:
+            continue
+        for metric in GATED_METRICS:
+            allowed = previous[metric] * (1 + tolerance)
+            if report[metric] > allowed:
+                regressions.append(f"{report['scenario']}: {metric} {previous[metric]} -> {report[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay chat cassettes and report LLM and Mongo cost')
+    parser.add_argument('cassettes', nargs='+', help='cassette files recorded with LLM_RECORD_PATH')
+    parser.add_argument('--baseline', help='fail if a scenario got more expensive than in this report')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='allowed relative growth per metric')
+    parser.add_argument('--write-baseline', help='write this run as the new baseline')
+    scratch_database.add_arguments(parser, 'webapp_replay')
+    args = parser.parse_args()
+
+    os.environ['LLM_PROVIDER'] = 'replay'
+    os.environ.pop('LLM_RECORD_PATH', None)
+    scratch_database.select(args)
+    os.environ.setdefault('JWT_SECRET_KEY', 'replay-secret')
+    # Hedged duplicate calls would make call counts depend on timing
+    os.environ['LLM_HEDGING'] = '0'
+
+    # Listeners only apply to clients created after registration, so register before importing app
+    counter = MongoOpCounter()
+    monitoring.register(counter)
+
+    import app as webapp
+
+    refusal = scratch_database.refusal(webapp, args)
+    if refusal:
+        print(f'Refusing to replay: {refusal}')
+        return 2
+    counter.database = webapp.db.name
+    # Replays stay offline: no YouTube lookups for mentor personas
+    webapp.youtube = None
+
+    reports = [replay_cassette(webapp, counter, path) for path in args.cassettes]
+    webapp.client.drop_database(webapp.db.name)
+    for report in reports:
+        print_report(report)
+
+    if args.write_baseline:
+        with open(args.write_baseline, 'w', encoding='utf-8') as f:
+            json.dump({report['scenario']: report for report in reports}, f, indent=2)
+        print(f"\nBaseline written to {args.write_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(reports, baseline, args.tolerance)
+        if regressions:
+            print('\nRegressions:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
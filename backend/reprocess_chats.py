@@ -0,0 +1,334 @@
+"""Re-run diary summaries and memory extraction over existing chats.
+
+Use after changing the diary prompt in summarize_chat_session or the memory
+schema in extract_memory_info. Users are processed one at a time in id
+order, each with their hot and then archived chats, with bounded concurrency
+and a global request rate. Diary results are written with bulk_write, and
+progress is saved to a checkpoint file after every user so an interrupted
+run can be resumed.
+
+The memory job rebuilds each user's categories from the combined
+re-extraction of all their chats and replaces the stored ones, so items from
+an old prompt or schema do not survive next to the new ones. Items the user
+added through PUT /api/memory are kept and items they deleted are not
+brought back (memory_edits.py). Like
+memory_consolidation.py, the rebuilt memory is only written if the
+document's version is still the one read before the user's chats were
+processed; a user whose memory changed in the meantime is reported as a
+conflict and can be re-run with --user. An empty re-extraction never
+replaces a non-empty memory, since a failed LLM call also returns nothing.
+
+The bulk writes bypass the app's write paths, so the touched diary entries
+are re-indexed for search and related chats, and the rebuilt memories for
+search, like the app does after its own writes.
+
+    python reprocess_chats.py --job diary --concurrency 4 --rate 5
+    python reprocess_chats.py --job both --fake --dry-run --limit 20
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import chat_archive
+import memory_consolidation
+import memory_edits
+import related_chats
+import search_index
+
+# Where chats are read from, in order: (name, transform of the stored document)
+SOURCES = [('chats', None), ('chats_archive', chat_archive.from_archive_document)]
+SOURCE_PROJECTIONS = {
+    'chats': {'user_id': 1, 'messages': 1, 'created_at': 1},
+    'chats_archive': {'user_id': 1, 'messages_blob': 1, 'codec': 1, 'created_at': 1},
+}
+
+
+class RatePacer:
+    """Spaces out call start times so they never exceed `rate` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def process_chat(webapp, chat, jobs, pacer):
+    """Run the selected LLM jobs for one chat; returns results without writing them"""
+    result = {'chat': chat, 'llm_calls': 0, 'failed': False}
+
+    if 'diary' in jobs:
+        pacer.wait()
+        result['llm_calls'] += 1
+        result['diary'] = webapp.summarize_chat_session(chat)
+        if result['diary'] is None and chat.get('messages'):
+            result['failed'] = True
+
+    if 'memory' in jobs:
+        user_messages = [m['content'] for m in chat.get('messages', []) if m.get('role') == 'user']
+        if user_messages:
+            pacer.wait()
+            result['llm_calls'] += 1
+            result['memory'] = webapp.extract_memory_data('\n'.join(user_messages))
+
+    return result
+
+
+def build_operations(results):
+    from pymongo import UpdateOne
+
+    diary_ops = []
+    now = datetime.now(timezone.utc)
+
+    for result in results:
+        chat = result['chat']
+        diary_summary = result.get('diary')
+        if diary_summary:
+            diary_ops.append(UpdateOne(
+                {'user_id': chat['user_id'], 'chat_id': str(chat['_id'])},
+                {
+                    '$set': {
+                        'title': diary_summary['title'],
+                        'summary': diary_summary['summary'],
+                        'message_count': diary_summary['message_count'],
+                        'updated_at': now
+                    },
+                    '$setOnInsert': {'date': diary_summary['date'], 'created_at': now}
+                },
+                upsert=True
+            ))
+
+    return diary_ops
+
+
+def merge_memory(combined, memory_data, categories):
+    """Add one chat's extracted items to the user's combined re-extraction, without duplicates"""
+    for category in categories:
+        items = (memory_data or {}).get(category)
+        if not isinstance(items, list):
+            continue
+        merged = combined.setdefault(category, [])
+        for item in items:
+            if isinstance(item, str) and item.strip() and item.strip() not in merged:
+                merged.append(item.strip())
+    return combined
+
+
+def write_memory(collection, user_id, memory, combined, categories):
+    """Replace the user's categories with `combined` if `memory` (read before extraction) is still current.
+
+    Items the user added by hand are kept and items they deleted stay deleted (see memory_edits.py).
+    Returns 'rebuilt', 'conflict' or 'rejected'.
+    """
+    if memory and memory_consolidation.count_items(memory, categories) and \
+            not memory_consolidation.count_items(combined, categories):
+        return 'rejected'
+    rebuilt = memory_edits.apply_edits(combined, memory, categories)
+
+    now = datetime.now(timezone.utc)
+    if memory:
+        result = collection.update_one(
+            # A missing version (documents written before versioning) matches None
+            {'_id': memory['_id'], 'version': memory.get('version')},
+            {'$set': dict(rebuilt, updated_at=now), '$inc': {'version': 1}}
+        )
+        return 'rebuilt' if result.modified_count else 'conflict'
+
+    # No memory when the user's chats were read: only create one if nobody did in the meantime
+    result = collection.update_one(
+        {'user_id': user_id},
+        {'$setOnInsert': dict(rebuilt, user_id=user_id, version=1, created_at=now, updated_at=now)},
+        upsert=True
+    )
+    return 'rebuilt' if result.upserted_id is not None else 'conflict'
+
+
+def reindex_diary(webapp, results):
+    """Update the search and related-chats indexes for the diary entries just written"""
+    chat_ids = {str(result['chat']['_id']): result['chat']['user_id'] for result in results if result.get('diary')}
+    if chat_ids:
+        for entry in webapp.diary_collection.find({'chat_id': {'$in': list(chat_ids)}}):
+            user_id, chat_id = entry['user_id'], entry['chat_id']
+            if chat_ids.get(chat_id) != user_id:
+                continue
+            webapp.update_search_index(search_index.index_diary_entry, user_id, str(entry['_id']), chat_id,
+                                       entry.get('title'), entry.get('summary'), entry.get('updated_at'))
+            webapp.update_related_index(related_chats.index_entry, user_id, str(entry['_id']), chat_id,
+                                        entry.get('title'), entry.get('summary'), entry.get('date'))
+
+
+def iter_users(webapp, user_id, checkpoint):
+    """Ids of the users to process, in order, resuming after the checkpoint"""
+    if user_id:
+        user_ids = {user_id}
+    else:
+        user_ids = set()
+        for name, _ in SOURCES:
+            user_ids.update(webapp.db[name].distinct('user_id'))
+    last_user_id = checkpoint.get('last_user_id')
+    return [uid for uid in sorted(user_ids) if last_user_id is None or uid > last_user_id]
+
+
+def iter_chats(webapp, user_id, batch_size):
+    """(source, chat) for every chat of one user, hot chats first"""
+    for name, transform in SOURCES:
+        cursor = webapp.db[name].find({'user_id': user_id}, SOURCE_PROJECTIONS[name]).sort('_id', 1)
+        for chat in cursor.batch_size(batch_size):
+            yield name, (transform(chat) if transform else chat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-run diary summaries and memory extraction over existing chats')
+    parser.add_argument('--job', choices=['diary', 'memory', 'both'], default='diary')
+    parser.add_argument('--user', help='only process chats of this user id')
+    parser.add_argument('--concurrency', type=int, default=4, help='parallel LLM calls')
+    parser.add_argument('--rate', type=float, default=5.0, help='max LLM calls per second (0 = unlimited)')
+    parser.add_argument('--batch-size', type=int, default=50, help='chats per bulk write')
+    parser.add_argument('--limit', type=int, default=0, help='stop after the user that reaches this many chats')
+    parser.add_argument('--checkpoint', default='reprocess_checkpoint.json', help='checkpoint file ("" to disable)')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    parser.add_argument('--dry-run', action='store_true', help='call the LLM but do not write results')
+    parser.add_argument('--fake', action='store_true', help='use the offline fake LLM provider')
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ['LLM_PROVIDER'] = 'fake'
+
+    # Imported late so --fake takes effect before the clients are configured
+    import app as webapp
+
+    jobs = {'diary', 'memory'} if args.job == 'both' else {args.job}
+    checkpoint = {} if args.restart else load_checkpoint(args.checkpoint)
+    if checkpoint and checkpoint.get('job') != args.job:
+        print(f"Checkpoint was written for job '{checkpoint.get('job')}', use --restart to start over", file=sys.stderr)
+        return 1
+
+    if checkpoint.get('last_user_id'):
+        print(f"Resuming after user {checkpoint['last_user_id']} ({checkpoint.get('processed', 0)} chats already done)")
+
+    pacer = RatePacer(args.rate)
+    stats = {'users': 0, 'chats': 0, 'archived_chats': 0, 'llm_calls': 0, 'failed': 0, 'diary_writes': 0,
+             'memory_rebuilt': 0, 'memory_conflict': 0, 'memory_rejected': 0}
+    conflicts = []
+    started = time.monotonic()
+
+    def run_batch(executor, batch, combined):
+        results = list(executor.map(lambda chat: process_chat(webapp, chat, jobs, pacer), batch))
+        for result in results:
+            merge_memory(combined, result.get('memory'), webapp.MEMORY_CATEGORIES)
+
+        diary_ops = build_operations(results)
+        if args.dry_run:
+            for result in results[:3]:
+                print(f"  [dry-run] chat {result['chat']['_id']}: diary={result.get('diary')} memory={result.get('memory')}")
+        elif diary_ops:
+            webapp.diary_collection.bulk_write(diary_ops, ordered=False)
+            reindex_diary(webapp, results)
+
+        stats['chats'] += len(results)
+        stats['llm_calls'] += sum(r['llm_calls'] for r in results)
+        stats['failed'] += sum(1 for r in results if r['failed'])
+        stats['diary_writes'] += len(diary_ops)
+
+    def run_user(executor, user_id):
+        # Read before any chat is extracted, so a memory write during the run is detected
+        memory = webapp.memories_collection.find_one({'user_id': user_id}) if 'memory' in jobs else None
+        combined = {}
+
+        batch = []
+        for source, chat in iter_chats(webapp, user_id, args.batch_size):
+            if source == 'chats_archive':
+                stats['archived_chats'] += 1
+            batch.append(chat)
+            if len(batch) >= args.batch_size:
+                run_batch(executor, batch, combined)
+                batch = []
+        if batch:
+            run_batch(executor, batch, combined)
+
+        if 'memory' in jobs:
+            if args.dry_run:
+                print(f"  [dry-run] user {user_id}: memory={combined}")
+            else:
+                status = write_memory(webapp.memories_collection, user_id, memory, combined, webapp.MEMORY_CATEGORIES)
+                stats[f'memory_{status}'] += 1
+                if status == 'conflict':
+                    conflicts.append(user_id)
+                elif status == 'rebuilt':
+                    rebuilt = webapp.memories_collection.find_one({'user_id': user_id})
+                    webapp.update_search_index(search_index.reindex_memory, user_id, rebuilt,
+                                               webapp.MEMORY_CATEGORIES)
+
+        stats['users'] += 1
+        if not args.dry_run:
+            save_checkpoint(args.checkpoint, {
+                'job': args.job,
+                'last_user_id': user_id,
+                'processed': checkpoint.get('processed', 0) + stats['chats'],
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            })
+
+        elapsed = time.monotonic() - started
+        print(f"{stats['users']} users, {stats['chats']} chats, {stats['llm_calls']} LLM calls, "
+              f"{stats['failed']} failed, {stats['chats'] / elapsed:.2f} chats/s, {stats['llm_calls'] / elapsed:.2f} calls/s")
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        for user_id in iter_users(webapp, args.user, checkpoint):
+            # A user's memory is rebuilt from all their chats, so a run only stops between users
+            if args.limit and stats['chats'] >= args.limit:
+                break
+            run_user(executor, user_id)
+
+    # Related-chats updates are queued; let them finish before exiting
+    webapp.related_index_executor.shutdown(wait=True)
+
+    elapsed = time.monotonic() - started
+    print()
+    print(f"Done in {elapsed:.1f}s{' (dry run, nothing written)' if args.dry_run else ''}")
+    print(f"  users processed:   {stats['users']}")
+    print(f"  chats processed:   {stats['chats']} ({stats['archived_chats']} archived)")
+    print(f"  LLM calls:         {stats['llm_calls']}")
+    print(f"  failed summaries:  {stats['failed']}")
+    print(f"  diary writes:      {stats['diary_writes']}")
+    print(f"  memories rebuilt:  {stats['memory_rebuilt']}")
+    print(f"  memory conflicts:  {stats['memory_conflict']}")
+    if conflicts:
+        print(f"    re-run with --user: {', '.join(conflicts)}")
+    print(f"  empty, kept old:   {stats['memory_rejected']}")
+    if elapsed > 0:
+        print(f"  throughput:        {stats['chats'] / elapsed:.2f} chats/s, {stats['llm_calls'] / elapsed:.2f} LLM calls/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Guard for the check and replay scripts, which drop the database they run in.
+
+The scripts import app, and app loads .env with override=True, so the
+database and MONGODB_URI they end up on are whatever .env says, not what the
+script put in the environment. They therefore check the database the app
+actually uses before dropping anything:
+
+  - it is the one named with --db (MONGODB_DB in .env did not replace it),
+  - the name ends in a scratch suffix (_check, _replay),
+  - with the mongo backend, MONGODB_URI only names hosts on this machine,
+    unless --force is given.
+"""
+import os
+
+SCRATCH_SUFFIXES = ('_check', '_replay')
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+
+def add_arguments(parser, default_db):
+    parser.add_argument('--db', default=default_db,
+                        help=f"scratch database, dropped before and after the run; must end in "
+                             f"{' or '.join(SCRATCH_SUFFIXES)}")
+    parser.add_argument('--force', action='store_true', help='also run against a MONGODB_URI on another host')
+
+
+def select(args):
+    """Point the app at the scratch database; call before importing app"""
+    os.environ['MONGODB_DB'] = args.db
+
+
+def remote_hosts(uri):
+    """Hosts of a MongoDB URI that are not on this machine"""
+    from pymongo.uri_parser import parse_uri
+
+    # SRV records are resolved through DNS, so the hosts are never known to be local
+    if uri.startswith('mongodb+srv://'):
+        return [uri.split('://', 1)[1].split('/', 1)[0].rsplit('@', 1)[-1]]
+    try:
+        nodes = parse_uri(uri)['nodelist']
+    except Exception:
+        return [uri]
+    return [f'{host}:{port}' for host, port in nodes if host not in LOCAL_HOSTS]
+
+
+def refusal(webapp, args):
+    """Why the script must not drop the app's database, or None if it is a local scratch database"""
+    name = webapp.db.name
+    if name != args.db:
+        return f"the app uses database {name}, not {args.db}: MONGODB_DB in .env overrides the environment"
+    if not name.endswith(SCRATCH_SUFFIXES):
+        return f"{name} is not a scratch database (the name must end in {' or '.join(SCRATCH_SUFFIXES)})"
+    if webapp.STORAGE_BACKEND == 'mongo' and not args.force:
+        hosts = remote_hosts(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
+        if hosts:
+            return f"MONGODB_URI points at {', '.join(hosts)}; pass --force to run there"
+    return None
@@ -0,0 +1,197 @@
+"""Per-user full-text search over messages, chat titles, diary entries and memory.
+
+Every searchable item is stored as a small document in its own collection
+with a compound {user_id, text} text index, so a search only touches one
+user's entries and never loads whole chat documents. app.py keeps the index
+current on every write; rebuild_user_index backfills existing data.
+
+Document shape:
+    {user_id, kind, ref, text, chat_id?, message_index?, role?, entry_id?,
+     title?, category?, timestamp}
+"""
+import os
+import re
+import threading
+
+from pymongo import UpdateOne
+
+import chat_archive
+
+SEARCH_KINDS = ('message', 'chat_title', 'diary', 'memory')
+SNIPPET_WIDTH = 160
+MAX_PAGE_SIZE = 50
+
+_indexed_collections = set()
+_index_lock = threading.Lock()
+
+
+def ensure_indexes(collection):
+    """Create the search indexes once per process (on first use, not at import)"""
+    if collection.full_name in _indexed_collections:
+        return
+    with _index_lock:
+        if collection.full_name in _indexed_collections:
+            return
+        collection.create_index(
+            [('user_id', 1), ('text', 'text')],
+            name='user_text',
+            # Content is mixed English/Turkish, so skip English-only stemming by default
+            default_language=os.getenv('SEARCH_LANGUAGE', 'none')
+        )
+        collection.create_index([('user_id', 1), ('kind', 1), ('ref', 1)], name='user_kind_ref', unique=True)
+        _indexed_collections.add(collection.full_name)
+
+
+def _upsert(collection, user_id, kind, ref, text, **fields):
+    ensure_indexes(collection)
+    fields['text'] = text
+    collection.update_one(
+        {'user_id': user_id, 'kind': kind, 'ref': ref},
+        {'$set': fields},
+        upsert=True
+    )
+
+
+def index_message(collection, user_id, chat_id, message_index, message):
+    _upsert(collection, user_id, 'message', f'{chat_id}:{message_index}', message.get('content', ''),
+            chat_id=chat_id, message_index=message_index, role=message.get('role'),
+            timestamp=message.get('timestamp'))
+
+
+def index_chat_title(collection, user_id, chat_id, title, timestamp=None):
+    _upsert(collection, user_id, 'chat_title', chat_id, title or '',
+            chat_id=chat_id, title=title, timestamp=timestamp)
+
+
+def index_diary_entry(collection, user_id, entry_id, chat_id, title, summary, timestamp=None):
+    _upsert(collection, user_id, 'diary', entry_id, f'{title or ""}\n{summary or ""}',
+            entry_id=entry_id, chat_id=chat_id, title=title, timestamp=timestamp)
+
+
+def remove_diary_entry(collection, user_id, entry_id):
+    collection.delete_one({'user_id': user_id, 'kind': 'diary', 'ref': entry_id})
+
+
+def reindex_memory(collection, user_id, memory, categories):
+    """Replace the user's memory items with the ones in `memory`"""
+    ensure_indexes(collection)
+    operations = []
+    refs = []
+    for category in categories:
+        for item in (memory or {}).get(category, []):
+            if not isinstance(item, str):
+                continue
+            ref = f'{category}:{item}'
+            refs.append(ref)
+            operations.append(UpdateOne(
+                {'user_id': user_id, 'kind': 'memory', 'ref': ref},
+                {'$set': {'text': item, 'category': category, 'timestamp': (memory or {}).get('updated_at')}},
+                upsert=True
+            ))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    collection.delete_many({'user_id': user_id, 'kind': 'memory', 'ref': {'$nin': refs}})
+
+
+def remove_memory(collection, user_id):
+    collection.delete_many({'user_id': user_id, 'kind': 'memory'})
+
+
+def _query_terms(query):
+    return [term.lower() for term in re.findall(r'\w+', query, re.UNICODE)]
+
+
+def make_snippet(text, terms, width=SNIPPET_WIDTH):
+    """Cut a window of `text` around the first matching term"""
+    if len(text) <= width:
+        return text
+
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    first = min(positions) if positions else 0
+
+    start = max(0, first - width // 3)
+    end = min(len(text), start + width)
+    start = max(0, end - width)
+
+    snippet = text[start:end].strip()
+    if start > 0:
+        snippet = '…' + snippet
+    if end < len(text):
+        snippet += '…'
+    return snippet
+
+
+def search(collection, user_id, query, kinds=None, page=1, page_size=20):
+    """Ranked, paginated search over one user's index"""
+    ensure_indexes(collection)
+
+    page = max(1, page)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+
+    search_filter = {'user_id': user_id, '$text': {'$search': query}}
+    if kinds:
+        search_filter['kind'] = {'$in': list(kinds)}
+
+    cursor = collection.find(
+        search_filter,
+        {'score': {'$meta': 'textScore'}, 'user_id': 0}
+    ).sort([('score', {'$meta': 'textScore'})]).skip((page - 1) * page_size).limit(page_size)
+
+    terms = _query_terms(query)
+    results = []
+    for document in cursor:
+        text = document.pop('text', '')
+        document.pop('_id', None)
+        document['snippet'] = make_snippet(text, terms)
+        results.append(document)
+
+    return {
+        'results': results,
+        'total': collection.count_documents(search_filter),
+        'page': page,
+        'page_size': page_size
+    }
+
+
+def _index_chat(collection, user_id, chat):
+    chat_id = str(chat['_id'])
+    operations = [UpdateOne(
+        {'user_id': user_id, 'kind': 'chat_title', 'ref': chat_id},
+        {'$set': {'text': chat.get('title') or '', 'chat_id': chat_id,
+                  'title': chat.get('title'), 'timestamp': chat.get('updated_at')}},
+        upsert=True
+    )]
+    for message_index, message in enumerate(chat.get('messages', [])):
+        operations.append(UpdateOne(
+            {'user_id': user_id, 'kind': 'message', 'ref': f'{chat_id}:{message_index}'},
+            {'$set': {'text': message.get('content', ''), 'chat_id': chat_id,
+                      'message_index': message_index, 'role': message.get('role'),
+                      'timestamp': message.get('timestamp')}},
+            upsert=True
+        ))
+    collection.bulk_write(operations, ordered=False)
+
+
+def rebuild_user_index(db, collection, user_id, memory_categories):
+    """Backfill the index for one user from the source collections, archived chats included"""
+    ensure_indexes(collection)
+    collection.delete_many({'user_id': user_id})
+
+    hot = db['chats'].find({'user_id': user_id}, {'title': 1, 'messages': 1, 'updated_at': 1}).batch_size(50)
+    for chat in hot:
+        _index_chat(collection, user_id, chat)
+
+    # Cold chats keep their messages compressed in chats_archive (chat_archive.py)
+    archived = db['chats_archive'].find(
+        {'user_id': user_id}, {'title': 1, 'messages_blob': 1, 'codec': 1, 'updated_at': 1}
+    ).batch_size(50)
+    for chat in archived:
+        _index_chat(collection, user_id, chat_archive.from_archive_document(chat))
+
+    for entry in db['diary'].find({'user_id': user_id}):
+        index_diary_entry(collection, user_id, str(entry['_id']), entry.get('chat_id'),
+                          entry.get('title'), entry.get('summary'), entry.get('updated_at') or entry.get('date'))
+
+    reindex_memory(collection, user_id, db['memories'].find_one({'user_id': user_id}), memory_categories)
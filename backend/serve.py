@@ -0,0 +1,39 @@
+"""Run the API server, with the password hashing workers started first.
+
+Hashing workers are spawned processes, and a spawned process imports the
+parent's __main__ before it starts working. Started from app.py they would
+each re-run its whole set-up (storage client, executors, load controller,
+eager clients). This entry point imports nothing but password_hashing and
+python-dotenv before the workers are up, so that is all they import; app is
+imported afterwards, in this process only.
+
+    python serve.py
+
+Running `python app.py` still starts Flask's server, but hashes inline.
+"""
+import os
+import sys
+
+from dotenv import load_dotenv
+
+import password_hashing
+
+
+def main():
+    # The pool reads its configuration from the environment, which app.py would otherwise load
+    load_dotenv(override=True)
+    password_hashing.start()
+
+    import app as webapp
+    try:
+        webapp.prepare_instance()
+    except Exception as e:
+        # /api/ready retries it and reports not ready until it succeeds
+        print(f"Start-up preparation failed: {e}")
+
+    webapp.app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
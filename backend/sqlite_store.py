@@ -0,0 +1,1204 @@
+"""Embedded document store on SQLite with the pymongo interface the app uses.
+
+For single-node installs and in-process runs without a MongoDB server
+(STORAGE_BACKEND=sqlite, see storage.py). Every collection is a table
+
+    "<db>.<collection>" (id TEXT PRIMARY KEY, doc TEXT)
+
+holding each document as extended JSON (bson.json_util, relaxed), so
+ObjectIds and datetimes round-trip. Indexes are SQLite expression indexes on
+json_extract(doc, '$.<field>'): every collection gets one on user_id, and
+create_index adds the declared ones (unique indexes raise DuplicateKeyError
+like MongoDB).
+
+Queries push equality on _id and on indexed fields down to SQL; everything
+else (operators, dotted paths into arrays, $expr) is evaluated in Python on
+the narrowed rows. Indexed fields must hold scalars, which is true for every
+index in this codebase: json_extract can not index into arrays, so an array
+there would silently drop the document from pushed-down queries. Writing such
+a document, or creating an index over one, raises OperationFailure instead
+(MongoDB would build a multikey index).
+
+Supported, as used by this codebase:
+  - find/find_one (projection, sort, skip, limit), count_documents,
+    insert_one/insert_many, update_one/update_many (upsert), replace_one,
+    find_one_and_update, delete_one/delete_many, bulk_write, aggregate
+  - query operators $eq $ne $gt $gte $lt $lte $in $nin $exists $and $or $nor
+    $expr $text
+  - update operators $set $unset $inc $min $max $push ($each) $addToSet
+    ($each) $pull $setOnInsert
+  - aggregation stages $match $project $addFields/$set $sort $skip $limit
+    $group $count $unwind
+  - TTL indexes (expireAfterSeconds), purged at most once a minute like
+    MongoDB's TTL monitor
+  - text indexes: $text matches any query term and scores by term frequency,
+    without stemming or phrase search
+
+Writes run in BEGIN IMMEDIATE transactions, so read-modify-write updates are
+atomic across threads and processes sharing the file. Sessions, read
+preferences and write concerns are accepted and ignored.
+"""
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId, json_util
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.results import (BulkWriteResult, DeleteResult, InsertManyResult,
+                             InsertOneResult, UpdateResult)
+
+_JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+# Fields indexed on every collection: nearly every read is per user
+DEFAULT_INDEXED_FIELDS = ('user_id',)
+
+TTL_PURGE_INTERVAL_SECONDS = 60
+
+_FIELD_PATH = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+_MISSING = object()
+
+
+def _encode(document):
+    return json_util.dumps(document, json_options=_JSON_OPTIONS)
+
+
+def _decode(text):
+    return json_util.loads(text, json_options=_JSON_OPTIONS)
+
+
+def _id_key(value):
+    """Primary key text for an _id value"""
+    if isinstance(value, ObjectId):
+        return f'oid:{value}'
+    if isinstance(value, str):
+        return f'str:{value}'
+    return f'json:{_encode(value)}'
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _json_path(field):
+    return '$.' + field
+
+
+def _utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+# --- Values and comparison (BSON type order) ---
+
+def _type_rank(value):
+    if value is _MISSING:
+        return 0
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank in (0, 1):
+        return (rank, 0)
+    if rank == 4:
+        return (rank, [(key, _sort_key(item)) for key, item in value.items()])
+    if rank == 5:
+        return (rank, [_sort_key(item) for item in value])
+    if rank == 9:
+        return (rank, _utc(value))
+    if rank == 10:
+        return (rank, str(value))
+    return (rank, value)
+
+
+def _equal(left, right):
+    return _sort_key(left) == _sort_key(right)
+
+
+def _compare(left, right):
+    left_key, right_key = _sort_key(left), _sort_key(right)
+    return (left_key > right_key) - (left_key < right_key)
+
+
+# --- Paths ---
+
+def _resolve(value, parts):
+    """Every value at a dotted path, descending into arrays like a MongoDB query"""
+    if not parts:
+        return [value]
+    if isinstance(value, dict):
+        return _resolve(value[parts[0]], parts[1:]) if parts[0] in value else []
+    if isinstance(value, list):
+        found = []
+        if parts[0].isdigit() and int(parts[0]) < len(value):
+            found.extend(_resolve(value[int(parts[0])], parts[1:]))
+        for item in value:
+            if isinstance(item, dict):
+                found.extend(_resolve(item, parts))
+        return found
+    return []
+
+
+def _get(document, path):
+    """The value at a dotted path for expressions, or _MISSING"""
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            if part.isdigit():
+                value = value[int(part)] if int(part) < len(value) else _MISSING
+            else:
+                value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _array_on_path(document, path):
+    """True if a dotted path runs through or ends at an array"""
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return False
+        value = value.get(part)
+        if isinstance(value, list):
+            return True
+    return False
+
+
+def _container(document, path, create):
+    """(parent, last key) of a dotted path, creating intermediate documents if `create`"""
+    parts = path.split('.')
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            if not part.isdigit():
+                raise OperationFailure(f"Cannot create field '{part}' in array at '{path}'")
+            index = int(part)
+            if index >= len(target):
+                if not create:
+                    return None, None
+                target.extend([None] * (index + 1 - len(target)))
+            if target[index] is None and create:
+                target[index] = {}
+            target = target[index]
+        elif isinstance(target, dict):
+            if target.get(part) is None:
+                if not create:
+                    return None, None
+                target[part] = {}
+            target = target[part]
+        else:
+            raise OperationFailure(f"Cannot traverse '{part}' at '{path}'")
+    return target, parts[-1]
+
+
+def _set_path(document, path, value):
+    target, key = _container(document, path, create=True)
+    if isinstance(target, list):
+        index = int(key)
+        if index >= len(target):
+            target.extend([None] * (index + 1 - len(target)))
+        target[index] = value
+    elif isinstance(target, dict):
+        target[key] = value
+    else:
+        raise OperationFailure(f"Cannot set '{path}'")
+
+
+def _unset_path(document, path):
+    target, key = _container(document, path, create=False)
+    if isinstance(target, dict):
+        target.pop(key, None)
+    elif isinstance(target, list) and key.isdigit() and int(key) < len(target):
+        target[int(key)] = None
+
+
+# --- Queries ---
+
+def _candidates(values):
+    """Values plus the elements of array values, which equality also matches"""
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+
+def _match_equal(values, target):
+    if target is None and not values:
+        return True
+    return any(_equal(value, target) for value in _candidates(values))
+
+
+def _match_range(values, target, accept):
+    rank = _type_rank(target)
+    return any(_type_rank(value) == rank and accept(_compare(value, target))
+               for value in _candidates(values))
+
+
+def _match_operator(values, operator, argument):
+    if operator == '$eq':
+        return _match_equal(values, argument)
+    if operator == '$ne':
+        return not _match_equal(values, argument)
+    if operator == '$gt':
+        return _match_range(values, argument, lambda order: order > 0)
+    if operator == '$gte':
+        return _match_range(values, argument, lambda order: order >= 0)
+    if operator == '$lt':
+        return _match_range(values, argument, lambda order: order < 0)
+    if operator == '$lte':
+        return _match_range(values, argument, lambda order: order <= 0)
+    if operator == '$in':
+        return any(_match_equal(values, target) for target in argument)
+    if operator == '$nin':
+        return not any(_match_equal(values, target) for target in argument)
+    if operator == '$exists':
+        return bool(values) == bool(argument)
+    raise OperationFailure(f'Unsupported query operator: {operator}')
+
+
+def _is_operator_document(condition):
+    return isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)
+
+
+def matches(document, query):
+    """Whether `document` matches a MongoDB query ($text is applied separately)"""
+    for key, condition in (query or {}).items():
+        if key == '$or':
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(document, clause) for clause in condition):
+                return False
+        elif key == '$expr':
+            if not _truthy(evaluate(condition, document)):
+                return False
+        elif key == '$text':
+            continue
+        elif key.startswith('$'):
+            raise OperationFailure(f'Unsupported query operator: {key}')
+        else:
+            values = _resolve(document, key.split('.'))
+            if _is_operator_document(condition):
+                if not all(_match_operator(values, operator, argument) for operator, argument in condition.items()):
+                    return False
+            elif not _match_equal(values, condition):
+                return False
+    return True
+
+
+# --- Aggregation expressions ---
+
+def _truthy(value):
+    return value not in (_MISSING, None, False, 0)
+
+
+def _numbers(values):
+    return [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+
+def _cond(arguments, document):
+    if isinstance(arguments, dict):
+        arguments = [arguments['if'], arguments['then'], arguments['else']]
+    condition, then, otherwise = arguments
+    return evaluate(then if _truthy(evaluate(condition, document)) else otherwise, document)
+
+
+def _size(arguments, document):
+    value = evaluate(arguments[0] if isinstance(arguments, list) else arguments, document)
+    if not isinstance(value, list):
+        raise OperationFailure('The argument to $size must be an array')
+    return len(value)
+
+
+def _if_null(arguments, document):
+    for argument in arguments:
+        value = evaluate(argument, document)
+        if value is not _MISSING and value is not None:
+            return value
+    return None
+
+
+def _comparison(accept):
+    def apply(arguments, document):
+        left, right = (evaluate(argument, document) for argument in arguments)
+        return accept(_compare(left, right))
+    return apply
+
+
+def _arithmetic(combine):
+    def apply(arguments, document):
+        values = [evaluate(argument, document) for argument in arguments]
+        if any(value is _MISSING or value is None for value in values):
+            return None
+        result = values[0]
+        for value in values[1:]:
+            result = combine(result, value)
+        return result
+    return apply
+
+
+def _add(arguments, document):
+    values = [evaluate(argument, document) for argument in arguments]
+    if any(value is _MISSING or value is None for value in values):
+        return None
+    dates = [value for value in values if isinstance(value, datetime)]
+    total = sum(_numbers(values))
+    if dates:
+        return dates[0] + timedelta(milliseconds=total)
+    return total
+
+
+_EXPRESSIONS = {
+    '$add': _add,
+    '$subtract': _arithmetic(lambda left, right: left - right),
+    '$multiply': _arithmetic(lambda left, right: left * right),
+    '$divide': _arithmetic(lambda left, right: left / right),
+    '$size': _size,
+    '$isArray': lambda arguments, document: isinstance(
+        evaluate(arguments[0] if isinstance(arguments, list) else arguments, document), list),
+    '$cond': _cond,
+    '$ifNull': _if_null,
+    '$eq': _comparison(lambda order: order == 0),
+    '$ne': _comparison(lambda order: order != 0),
+    '$gt': _comparison(lambda order: order > 0),
+    '$gte': _comparison(lambda order: order >= 0),
+    '$lt': _comparison(lambda order: order < 0),
+    '$lte': _comparison(lambda order: order <= 0),
+    '$and': lambda arguments, document: all(_truthy(evaluate(argument, document)) for argument in arguments),
+    '$or': lambda arguments, document: any(_truthy(evaluate(argument, document)) for argument in arguments),
+    '$not': lambda arguments, document: not _truthy(
+        evaluate(arguments[0] if isinstance(arguments, list) else arguments, document)),
+    '$sum': lambda arguments, document: sum(_numbers(_flatten_argument(arguments, document))),
+    '$max': lambda arguments, document: max(_flatten_argument(arguments, document), key=_sort_key, default=None),
+    '$min': lambda arguments, document: min(_flatten_argument(arguments, document), key=_sort_key, default=None),
+    '$literal': lambda arguments, document: arguments,
+}
+
+
+def _flatten_argument(arguments, document):
+    value = evaluate(arguments, document)
+    if isinstance(arguments, list):
+        return [item for item in value if item is not _MISSING]
+    return value if isinstance(value, list) else ([] if value is _MISSING else [value])
+
+
+def evaluate(expression, document):
+    """Value of an aggregation expression for `document` (_MISSING for missing fields)"""
+    if isinstance(expression, str) and expression.startswith('$'):
+        return _get(document, expression[1:])
+    if isinstance(expression, list):
+        return [evaluate(item, document) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, arguments = next(iter(expression.items()))
+            if operator.startswith('$'):
+                if operator not in _EXPRESSIONS:
+                    raise OperationFailure(f'Unsupported expression operator: {operator}')
+                return _EXPRESSIONS[operator](arguments, document)
+        return {key: evaluate(value, document) for key, value in expression.items()}
+    return expression
+
+
+# --- Updates ---
+
+def _apply_update(document, update, inserting=False):
+    """Apply update operators to `document` in place"""
+    for operator, fields in update.items():
+        if operator == '$setOnInsert' and not inserting:
+            continue
+        for path, value in fields.items():
+            if path == '_id' and operator != '$setOnInsert' and '_id' in document \
+                    and not (operator == '$set' and _equal(document['_id'], value)):
+                raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'")
+            current = _get(document, path)
+            if operator in ('$set', '$setOnInsert'):
+                _set_path(document, path, value)
+            elif operator == '$unset':
+                _unset_path(document, path)
+            elif operator == '$inc':
+                _set_path(document, path, (0 if current in (_MISSING, None) else current) + value)
+            elif operator == '$min':
+                if current is _MISSING or _compare(value, current) < 0:
+                    _set_path(document, path, value)
+            elif operator == '$max':
+                if current is _MISSING or _compare(value, current) > 0:
+                    _set_path(document, path, value)
+            elif operator in ('$push', '$addToSet'):
+                items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                array = [] if current in (_MISSING, None) else current
+                if not isinstance(array, list):
+                    raise OperationFailure(f"The field '{path}' must be an array")
+                for item in items:
+                    if operator == '$push' or not any(_equal(item, existing) for existing in array):
+                        array.append(item)
+                _set_path(document, path, array)
+            elif operator == '$pull':
+                if isinstance(current, list):
+                    if _is_operator_document(value):
+                        kept = [item for item in current
+                                if not all(_match_operator([item], name, argument) for name, argument in value.items())]
+                    elif isinstance(value, dict):
+                        kept = [item for item in current if not (isinstance(item, dict) and matches(item, value))]
+                    else:
+                        kept = [item for item in current if not _equal(item, value)]
+                    _set_path(document, path, kept)
+            else:
+                raise OperationFailure(f'Unsupported update operator: {operator}')
+
+
+def _is_replacement(update):
+    return not any(key.startswith('$') for key in update)
+
+
+def _upsert_seed(query):
+    """The document an upsert starts from: the query's equality fields"""
+    document = {}
+    for key, condition in (query or {}).items():
+        if key.startswith('$') or _is_operator_document(condition):
+            if isinstance(condition, dict) and set(condition) == {'$eq'}:
+                _set_path(document, key, condition['$eq'])
+            continue
+        _set_path(document, key, condition)
+    return document
+
+
+# --- Projection and sorting ---
+
+def _project(document, projection, score=None):
+    if projection is None:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    meta = {field: spec for field, spec in projection.items() if isinstance(spec, dict) and '$meta' in spec}
+    fields = {field: spec for field, spec in projection.items() if field not in meta}
+    include_id = fields.pop('_id', 1)
+
+    # {'_id': 1} on its own is an inclusion projection too
+    if any(fields.values()) or (not fields and '_id' in projection and include_id):
+        projected = {}
+        if include_id and '_id' in document:
+            projected['_id'] = document['_id']
+        for field, include in fields.items():
+            value = _get(document, field)
+            if include and value is not _MISSING:
+                _set_path(projected, field, value)
+    else:
+        # Nested exclusions modify subdocuments, so those need a deep copy
+        projected = _decode(_encode(document)) if any('.' in field for field in fields) else dict(document)
+        for field in fields:
+            _unset_path(projected, field)
+        if not include_id:
+            projected.pop('_id', None)
+
+    for field in meta:
+        projected[field] = score
+    return projected
+
+
+def _sort_spec(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, 1 if direction is None else direction)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+def _sort(documents, spec, scores=None):
+    """Stable multi-key sort; `scores` maps id(document) to its text score for $meta sorts"""
+    for field, direction in reversed(spec):
+        if isinstance(direction, dict):
+            documents.sort(key=lambda document: scores.get(id(document), 0), reverse=True)
+        else:
+            documents.sort(key=lambda document: _sort_key(_get(document, field)), reverse=direction < 0)
+    return documents
+
+
+# --- Text search ---
+
+def _text_score(document, fields, terms):
+    tokens = []
+    for field in fields:
+        for value in _resolve(document, field.split('.')):
+            if isinstance(value, str):
+                tokens.extend(token.lower() for token in _WORD.findall(value))
+    if not tokens:
+        return 0
+    hits = sum(tokens.count(term) for term in terms)
+    return hits / math.sqrt(len(tokens)) if hits else 0
+
+
+# --- Aggregation ---
+
+def _group(documents, stage):
+    group_id = stage['_id']
+    groups = OrderedDict()
+    for document in documents:
+        key_value = evaluate(group_id, document)
+        key_value = None if key_value is _MISSING else key_value
+        key = _encode({'k': key_value})
+        if key not in groups:
+            groups[key] = {'_id': key_value, '__documents': []}
+        groups[key]['__documents'].append(document)
+
+    results = []
+    for group in groups.values():
+        members = group.pop('__documents')
+        for field, accumulator in stage.items():
+            if field == '_id':
+                continue
+            operator, expression = next(iter(accumulator.items()))
+            values = [evaluate(expression, member) for member in members]
+            present = [value for value in values if value is not _MISSING]
+            if operator == '$sum':
+                group[field] = sum(_numbers(present))
+            elif operator == '$avg':
+                numbers = _numbers(present)
+                group[field] = sum(numbers) / len(numbers) if numbers else None
+            elif operator == '$min':
+                group[field] = min(present, key=_sort_key) if present else None
+            elif operator == '$max':
+                group[field] = max(present, key=_sort_key) if present else None
+            elif operator == '$first':
+                group[field] = values[0] if values and values[0] is not _MISSING else None
+            elif operator == '$last':
+                group[field] = values[-1] if values and values[-1] is not _MISSING else None
+            elif operator == '$push':
+                group[field] = present
+            elif operator == '$addToSet':
+                unique = []
+                for value in present:
+                    if not any(_equal(value, existing) for existing in unique):
+                        unique.append(value)
+                group[field] = unique
+            else:
+                raise OperationFailure(f'Unsupported accumulator: {operator}')
+        results.append(group)
+    return results
+
+
+def _add_fields(documents, fields):
+    results = []
+    for document in documents:
+        document = dict(document)
+        for field, expression in fields.items():
+            value = evaluate(expression, document)
+            if value is not _MISSING:
+                _set_path(document, field, value)
+        results.append(document)
+    return results
+
+
+def _project_stage(documents, projection):
+    plain = {field: spec for field, spec in projection.items()
+             if spec in (0, 1, True, False)}
+    computed = {field: spec for field, spec in projection.items() if field not in plain}
+    results = []
+    for document in documents:
+        projected = _project(document, plain) if plain else ({'_id': document['_id']} if '_id' in document else {})
+        for field, expression in computed.items():
+            value = evaluate(expression, document)
+            if value is not _MISSING:
+                _set_path(projected, field, value)
+        results.append(projected)
+    return results
+
+
+def _unwind(documents, spec):
+    path = spec if isinstance(spec, str) else spec['path']
+    keep_empty = isinstance(spec, dict) and spec.get('preserveNullAndEmptyArrays')
+    field = path[1:]
+    results = []
+    for document in documents:
+        value = _get(document, field)
+        if isinstance(value, list) and value:
+            for item in value:
+                unwound = dict(document)
+                _set_path(unwound, field, item)
+                results.append(unwound)
+        elif keep_empty or (value not in (_MISSING, None) and not isinstance(value, list)):
+            results.append(document)
+    return results
+
+
+def run_pipeline(documents, pipeline):
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == '$match':
+            documents = [document for document in documents if matches(document, spec)]
+        elif name in ('$addFields', '$set'):
+            documents = _add_fields(documents, spec)
+        elif name == '$project':
+            documents = _project_stage(documents, spec)
+        elif name == '$sort':
+            documents = _sort(list(documents), _sort_spec(spec))
+        elif name == '$skip':
+            documents = documents[spec:]
+        elif name == '$limit':
+            documents = documents[:spec]
+        elif name == '$group':
+            documents = _group(documents, spec)
+        elif name == '$count':
+            documents = [{spec: len(documents)}] if documents else []
+        elif name == '$unwind':
+            documents = _unwind(documents, spec)
+        else:
+            raise OperationFailure(f'Unsupported aggregation stage: {name}')
+    return documents
+
+
+# --- Client, database, collection ---
+
+class SQLiteCursor:
+    """Lazily evaluated find() result with the pymongo cursor methods the app uses"""
+
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def close(self):
+        self._results = iter(())
+
+    def _evaluate(self):
+        scores = {}
+        if self._sort or self._skip or '$text' in self._query:
+            documents = self._collection._matching(self._query, scores=scores)
+            if self._sort:
+                _sort(documents, self._sort, scores)
+            documents = documents[self._skip:]
+            if self._limit:
+                documents = documents[:self._limit]
+        else:
+            # No ordering needed: stop scanning once the limit is reached
+            documents = self._collection._matching(self._query, limit=self._limit)
+        return iter([_project(document, self._projection, scores.get(id(document)))
+                     for document in documents])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._results is None:
+            self._results = self._evaluate()
+        return next(self._results)
+
+
+class SQLiteCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+        self._table = _quote(self.full_name)
+        self._client = database.client
+
+    # pymongo compatibility
+
+    def with_options(self, **kwargs):
+        return self
+
+    def __getitem__(self, name):
+        return self.database[f'{self.name}.{name}']
+
+    # Schema
+
+    def _spec(self):
+        return self._client._prepare(self.full_name)
+
+    @contextmanager
+    def _writing(self):
+        # Prepared before taking the write lock, so table creation never nests in a transaction
+        self._spec()
+        with self._client._writing() as connection:
+            yield connection
+
+    def create_index(self, keys, name=None, unique=False, expireAfterSeconds=None, **kwargs):
+        keys = _sort_spec(keys)
+        name = name or '_'.join(f'{field}_{direction}' for field, direction in keys)
+        with self._writing() as connection:
+            fields = [field for field, direction in keys if direction != 'text']
+            for _, raw in connection.execute(f'SELECT id, doc FROM {self._table}'):
+                self._check_indexed(_decode(raw), fields)
+            self._client._create_index(connection, self.full_name, name, keys, unique, expireAfterSeconds)
+        return name
+
+    def drop(self, session=None):
+        self.database.drop_collection(self.name)
+
+    # Reading
+
+    def _pushdown(self, query):
+        """SQL WHERE clause and parameters narrowing rows for `query` (a superset of the matches)"""
+        indexed = self._spec()['indexed']
+        clauses, parameters = [], []
+        for field, condition in (query or {}).items():
+            if field == '_id':
+                if isinstance(condition, dict) and set(condition) == {'$in'}:
+                    keys = [_id_key(value) for value in condition['$in']]
+                    clauses.append(f"id IN ({', '.join('?' * len(keys))})" if keys else '0')
+                    parameters.extend(keys)
+                elif not isinstance(condition, (dict, list)):
+                    clauses.append('id = ?')
+                    parameters.append(_id_key(condition))
+            elif field in indexed and isinstance(condition, (str, int, float)):
+                clauses.append(f"json_extract(doc, '{_json_path(field)}') = ?")
+                parameters.append(condition)
+        return (' AND '.join(clauses) or '1'), parameters
+
+    def _rows(self, connection, query):
+        where, parameters = self._pushdown(query)
+        return connection.execute(f'SELECT id, doc FROM {self._table} WHERE {where} ORDER BY rowid', parameters)
+
+    def _matching(self, query, limit=0, scores=None):
+        """Matching documents in natural order; fills `scores` for $text queries"""
+        self._client._purge_expired(self.full_name)
+        text = (query or {}).get('$text')
+        terms = None
+        if text is not None:
+            fields = self._spec()['text']
+            if not fields:
+                raise OperationFailure('text index required for $text query')
+            terms = {term.lower() for term in _WORD.findall(text['$search'])}
+
+        documents = []
+        with self._client._reading() as connection:
+            for _, raw in self._rows(connection, query):
+                document = _decode(raw)
+                if not matches(document, query):
+                    continue
+                if terms is not None:
+                    score = _text_score(document, fields, terms)
+                    if not score:
+                        continue
+                    if scores is not None:
+                        scores[id(document)] = score
+                documents.append(document)
+                if limit and len(documents) >= limit:
+                    break
+        return documents
+
+    def find(self, filter=None, projection=None, skip=0, limit=0, sort=None, session=None, **kwargs):
+        cursor = SQLiteCursor(self, filter, projection).skip(skip).limit(limit)
+        if sort:
+            cursor.sort(sort)
+        return cursor
+
+    def find_one(self, filter=None, projection=None, session=None, sort=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        for document in self.find(filter, projection, sort=sort).limit(1):
+            return document
+        return None
+
+    def count_documents(self, filter, session=None, **kwargs):
+        return len(self._matching(filter))
+
+    def estimated_document_count(self, **kwargs):
+        with self._client._reading() as connection:
+            return connection.execute(f'SELECT COUNT(*) FROM {self._table}').fetchone()[0]
+
+    def distinct(self, key, filter=None, session=None, **kwargs):
+        values = []
+        for document in self._matching(filter):
+            for value in _candidates(_resolve(document, key.split('.'))):
+                if not isinstance(value, list) and not any(_equal(value, existing) for existing in values):
+                    values.append(value)
+        return values
+
+    def aggregate(self, pipeline, session=None, **kwargs):
+        pipeline = list(pipeline)
+        # A leading $match narrows the rows like find() does
+        query = pipeline.pop(0)['$match'] if pipeline and '$match' in pipeline[0] else {}
+        return iter(run_pipeline(self._matching(query), pipeline))
+
+    # Writing
+
+    def _check_indexed(self, document, fields=None):
+        for field in self._spec()['indexed'] if fields is None else fields:
+            if _array_on_path(document, field):
+                raise OperationFailure(f'{self.full_name}: indexed field {field} holds an array, '
+                                       f'which the sqlite backend can not index')
+
+    def _insert(self, connection, document):
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        self._check_indexed(document)
+        try:
+            connection.execute(f'INSERT INTO {self._table} (id, doc) VALUES (?, ?)',
+                               (_id_key(document['_id']), _encode(document)))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} ({e})', 11000)
+        return document['_id']
+
+    def _replace(self, connection, row_id, document):
+        self._check_indexed(document)
+        try:
+            connection.execute(f'UPDATE {self._table} SET doc = ? WHERE id = ?', (_encode(document), row_id))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} ({e})', 11000)
+
+    def _update(self, connection, query, update, upsert, many):
+        """(matched, modified, upserted_id, documents after the update)"""
+        matched = modified = 0
+        updated = []
+        for row_id, raw in self._rows(connection, query).fetchall():
+            document = _decode(raw)
+            if not matches(document, query):
+                continue
+            matched += 1
+            if _is_replacement(update):
+                new_document = dict(update, _id=document['_id'])
+            else:
+                new_document = _decode(raw)
+                _apply_update(new_document, update)
+            encoded = _encode(new_document)
+            if encoded != raw:
+                self._replace(connection, row_id, new_document)
+                modified += 1
+            updated.append(new_document)
+            if not many:
+                break
+
+        upserted_id = None
+        if not matched and upsert:
+            if _is_replacement(update):
+                document = dict(update)
+                seed_id = _upsert_seed(query).get('_id')
+                if '_id' not in document and seed_id is not None:
+                    document['_id'] = seed_id
+            else:
+                document = _upsert_seed(query)
+                _apply_update(document, update, inserting=True)
+            upserted_id = self._insert(connection, document)
+            updated.append(document)
+        return matched, modified, upserted_id, updated
+
+    def _delete(self, connection, query, many):
+        deleted = 0
+        for row_id, raw in self._rows(connection, query).fetchall():
+            if matches(_decode(raw), query):
+                connection.execute(f'DELETE FROM {self._table} WHERE id = ?', (row_id,))
+                deleted += 1
+                if not many:
+                    break
+        return deleted
+
+    @staticmethod
+    def _update_result(matched, modified, upserted_id):
+        raw = {'n': matched + (1 if upserted_id is not None else 0), 'nModified': modified}
+        if upserted_id is not None:
+            raw['upserted'] = upserted_id
+        return UpdateResult(raw, True)
+
+    def insert_one(self, document, session=None, **kwargs):
+        with self._writing() as connection:
+            return InsertOneResult(self._insert(connection, document), True)
+
+    def insert_many(self, documents, ordered=True, session=None, **kwargs):
+        with self._writing() as connection:
+            return InsertManyResult([self._insert(connection, document) for document in documents], True)
+
+    def update_one(self, filter, update, upsert=False, session=None, **kwargs):
+        with self._writing() as connection:
+            matched, modified, upserted_id, _ = self._update(connection, filter, update, upsert, many=False)
+        return self._update_result(matched, modified, upserted_id)
+
+    def update_many(self, filter, update, upsert=False, session=None, **kwargs):
+        with self._writing() as connection:
+            matched, modified, upserted_id, _ = self._update(connection, filter, update, upsert, many=True)
+        return self._update_result(matched, modified, upserted_id)
+
+    def replace_one(self, filter, replacement, upsert=False, session=None, **kwargs):
+        if not _is_replacement(replacement):
+            raise ValueError('replacement can not include $ operators')
+        with self._writing() as connection:
+            matched, modified, upserted_id, _ = self._update(connection, filter, replacement, upsert, many=False)
+        return self._update_result(matched, modified, upserted_id)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, session=None, **kwargs):
+        with self._writing() as connection:
+            before = None
+            if return_document == ReturnDocument.BEFORE:
+                for _, raw in self._rows(connection, filter).fetchall():
+                    document = _decode(raw)
+                    if matches(document, filter):
+                        before = document
+                        break
+            _, _, upserted_id, updated = self._update(connection, filter, update, upsert, many=False)
+        if return_document == ReturnDocument.AFTER:
+            return _project(updated[0], projection) if updated else None
+        return _project(before, projection) if before is not None else None
+
+    def delete_one(self, filter, session=None, **kwargs):
+        with self._writing() as connection:
+            return DeleteResult({'n': self._delete(connection, filter, many=False)}, True)
+
+    def delete_many(self, filter, session=None, **kwargs):
+        with self._writing() as connection:
+            return DeleteResult({'n': self._delete(connection, filter, many=True)}, True)
+
+    def bulk_write(self, requests, ordered=True, session=None, **kwargs):
+        result = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        with self._writing() as connection:
+            for index, operation in enumerate(requests):
+                kind = type(operation).__name__
+                if kind == 'InsertOne':
+                    self._insert(connection, operation._doc)
+                    result['nInserted'] += 1
+                elif kind in ('UpdateOne', 'UpdateMany', 'ReplaceOne'):
+                    matched, modified, upserted_id, _ = self._update(
+                        connection, operation._filter, operation._doc, operation._upsert, many=kind == 'UpdateMany'
+                    )
+                    result['nMatched'] += matched
+                    result['nModified'] += modified
+                    if upserted_id is not None:
+                        result['nUpserted'] += 1
+                        result['upserted'].append({'index': index, '_id': upserted_id})
+                elif kind in ('DeleteOne', 'DeleteMany'):
+                    result['nRemoved'] += self._delete(connection, operation._filter, many=kind == 'DeleteMany')
+                else:
+                    raise OperationFailure(f'Unsupported bulk operation: {kind}')
+        return BulkWriteResult(result, True)
+
+
+class SQLiteDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            with self._lock:
+                self._collections.setdefault(name, SQLiteCollection(self, name))
+        return self._collections[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    def list_collection_names(self, session=None):
+        prefix = f'{self.name}.'
+        return [table[len(prefix):] for table in self.client._tables() if table.startswith(prefix)]
+
+    def drop_collection(self, name, session=None):
+        self.client._drop_tables([f'{self.name}.{name}'])
+
+    def command(self, command, session=None, **kwargs):
+        if command != 'ping':
+            raise OperationFailure(f'Unsupported command: {command}')
+        with self.client._reading() as connection:
+            connection.execute('SELECT 1').fetchone()
+        return {'ok': 1.0}
+
+
+class SQLiteClient:
+    """Client for one SQLite file; `path` ":memory:" keeps everything in this process"""
+
+    def __init__(self, path):
+        self.path = path
+        self._databases = {}
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._prepared = {}
+        self._prepare_lock = threading.Lock()
+        self._last_purge = {}
+        # An in-memory database exists per connection, so all threads share one
+        self._shared = self._connect() if path == ':memory:' else None
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        if self.path != ':memory:':
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('''CREATE TABLE IF NOT EXISTS _indexes (
+            collection TEXT NOT NULL, name TEXT NOT NULL, spec TEXT NOT NULL, PRIMARY KEY (collection, name))''')
+        return connection
+
+    def _connection(self):
+        if self._shared is not None:
+            return self._shared
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    @contextmanager
+    def _reading(self):
+        if self._shared is not None:
+            with self._write_lock:
+                yield self._shared
+        else:
+            yield self._connection()
+
+    @contextmanager
+    def _writing(self):
+        # The lock avoids busy-waiting between this process's threads; BEGIN IMMEDIATE covers other processes
+        with self._write_lock:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    # Collections and indexes
+
+    def _prepare(self, full_name):
+        """Create the collection's table on first use; returns its index summary"""
+        spec = self._prepared.get(full_name)
+        if spec is not None:
+            return spec
+        with self._prepare_lock:
+            if full_name not in self._prepared:
+                with self._writing() as connection:
+                    connection.execute(f'CREATE TABLE IF NOT EXISTS {_quote(full_name)} '
+                                       f'(id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+                    for field in DEFAULT_INDEXED_FIELDS:
+                        connection.execute(f'CREATE INDEX IF NOT EXISTS {_quote(f"{full_name}.{field}")} '
+                                           f"ON {_quote(full_name)} (json_extract(doc, '{_json_path(field)}'))")
+                    self._prepared[full_name] = self._load_spec(connection, full_name)
+        return self._prepared[full_name]
+
+    def _load_spec(self, connection, full_name):
+        spec = {'indexed': set(DEFAULT_INDEXED_FIELDS), 'text': [], 'ttl': {}}
+        for (raw,) in connection.execute('SELECT spec FROM _indexes WHERE collection = ?', (full_name,)):
+            index = json.loads(raw)
+            for field, direction in index['keys']:
+                if direction == 'text':
+                    spec['text'].append(field)
+                else:
+                    spec['indexed'].add(field)
+            if index.get('ttl') is not None:
+                spec['ttl'][index['keys'][0][0]] = index['ttl']
+        return spec
+
+    def _create_index(self, connection, full_name, name, keys, unique, ttl):
+        columns = []
+        for field, direction in keys:
+            if not _FIELD_PATH.match(field):
+                raise OperationFailure(f'Unsupported index field: {field}')
+            if direction != 'text':
+                columns.append(f"json_extract(doc, '{_json_path(field)}')" + (' DESC' if direction == -1 else ''))
+        if columns:
+            connection.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS '
+                               f'{_quote(f"{full_name}.{name}")} ON {_quote(full_name)} ({", ".join(columns)})')
+        connection.execute('INSERT OR REPLACE INTO _indexes (collection, name, spec) VALUES (?, ?, ?)',
+                           (full_name, name, json.dumps({'keys': keys, 'unique': unique, 'ttl': ttl})))
+        self._prepared[full_name] = self._load_spec(connection, full_name)
+
+    def _purge_expired(self, full_name):
+        ttl = self._prepare(full_name)['ttl']
+        if not ttl or time.monotonic() - self._last_purge.get(full_name, 0) < TTL_PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge[full_name] = time.monotonic()
+        with self._writing() as connection:
+            for field, seconds in ttl.items():
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+                connection.execute(
+                    f"DELETE FROM {_quote(full_name)} "
+                    f"WHERE julianday(json_extract(doc, '{_json_path(field)}.\"$date\"')) < julianday(?)",
+                    (cutoff.strftime('%Y-%m-%dT%H:%M:%S.%f'),)
+                )
+
+    def _tables(self):
+        with self._reading() as connection:
+            return [name for (name,) in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name != '_indexes'")]
+
+    def _drop_tables(self, names):
+        with self._writing() as connection:
+            for name in names:
+                connection.execute(f'DROP TABLE IF EXISTS {_quote(name)}')
+                connection.execute('DELETE FROM _indexes WHERE collection = ?', (name,))
+        with self._prepare_lock:
+            for name in names:
+                self._prepared.pop(name, None)
+                self._last_purge.pop(name, None)
+
+    # pymongo client interface
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases.setdefault(name, SQLiteDatabase(self, name))
+        return self._databases[name]
+
+    def get_database(self, name, **kwargs):
+        return self[name]
+
+    @property
+    def admin(self):
+        return self['admin']
+
+    def drop_database(self, name, session=None):
+        name = getattr(name, 'name', name)
+        self._drop_tables([table for table in self._tables() if table.startswith(f'{name}.')])
+
+    def start_session(self, **kwargs):
+        raise OperationFailure('Sessions are not supported by the embedded SQLite store')
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,41 @@
+"""Storage backends behind the app's collections.
+
+STORAGE_BACKEND selects where documents live:
+    mongo   MongoDB at MONGODB_URI (default)
+    sqlite  the embedded engine in sqlite_store.py, one file at SQLITE_PATH
+            (default webapp.sqlite3; ":memory:" keeps everything in-process)
+
+Both backends return a client with the pymongo interface the app already
+uses (client[db_name][collection_name].find/update_one/aggregate/...), so
+call sites do not change with the backend. The embedded engine implements the
+subset of that interface this codebase uses; see sqlite_store.py.
+
+Only the mongo backend supports sessions, so read routing (read_routing.py)
+is off with sqlite.
+"""
+import os
+
+BACKENDS = ('mongo', 'sqlite')
+
+
+def backend_name():
+    backend = os.getenv('STORAGE_BACKEND', 'mongo').lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend} (expected one of {', '.join(BACKENDS)})")
+    return backend
+
+
+def create_client(backend=None):
+    """Client for the configured backend; neither connects until the first operation"""
+    backend = backend or backend_name()
+    if backend == 'sqlite':
+        from sqlite_store import SQLiteClient
+        return SQLiteClient(os.getenv('SQLITE_PATH', 'webapp.sqlite3'))
+
+    from pymongo import MongoClient
+    # connect=False: no sockets or monitor threads until the first operation
+    return MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'), connect=False)
+
+
+def supports_sessions(backend):
+    return backend == 'mongo'
@@ -0,0 +1,34 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# The backend modules are flat, imported by name like app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_store import SQLiteClient  # noqa: E402
+
+
+@pytest.fixture(params=['sqlite', 'mongo'])
+def db(request, tmp_path):
+    """A fresh scratch database on each storage backend.
+
+    The mongo run needs a server at MONGODB_TEST_URI and is skipped without it.
+    Every test gets its own database name, so the per-process index caches of
+    the modules under test never see a collection they already indexed.
+    """
+    name = f'store_{uuid.uuid4().hex[:12]}_check'
+    if request.param == 'sqlite':
+        client = SQLiteClient(str(tmp_path / 'store.sqlite3'))
+    else:
+        uri = os.getenv('MONGODB_TEST_URI')
+        if not uri:
+            pytest.skip('MONGODB_TEST_URI is not set')
+        from pymongo import MongoClient
+        client = MongoClient(uri, serverSelectionTimeoutMS=3000)
+    try:
+        yield client[name]
+    finally:
+        client.drop_database(name)
+        client.close()
@@ -0,0 +1,194 @@
+"""One user's way through the API on the in-process SQLite store and the fake LLM."""
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+os.environ.update({
+    'STORAGE_BACKEND': 'sqlite',
+    'SQLITE_PATH': ':memory:',
+    'LLM_PROVIDER': 'fake',
+    'LLM_HEDGING': '0',
+    'JWT_SECRET_KEY': 'smoke-test-secret-of-sufficient-length',
+    'PASSWORD_HASH_WORKERS': '0',
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+})
+
+import app as webapp  # noqa: E402
+
+# app.py loads .env with override=True; never run this against a configured database
+if webapp.STORAGE_BACKEND != 'sqlite' or os.getenv('SQLITE_PATH') != ':memory:':
+    pytest.skip('.env overrides the in-memory SQLite store', allow_module_level=True)
+
+
+@pytest.fixture
+def client():
+    webapp.rate_limiter.reset()
+    return webapp.app.test_client()
+
+
+def test_register_to_export(client):
+    response = client.post('/api/register', json={'username': 'smoke', 'email': 'smoke@example.com',
+                                                  'password': 'correct horse'})
+    assert response.status_code == 201
+    auth = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    def refresh_token(response):
+        token = response.headers.get(webapp.profile_claims.TOKEN_HEADER)
+        if token:
+            auth['Authorization'] = f'Bearer {token}'
+
+    response = client.post('/api/complete-profile', json={'ageGroup': '25-34', 'pronouns': 'they',
+                                                          'occupation': 'nurse'}, headers=auth)
+    assert response.status_code == 200
+    refresh_token(response)
+
+    response = client.put('/api/persona', json={'role': 'mentor', 'personality_traits': ['Caring', 'Bogus'],
+                                                'interests': ['Space']}, headers=auth)
+    assert response.status_code == 200
+    refresh_token(response)
+    response = client.post('/api/complete-persona-selection', headers=auth)
+    assert response.status_code == 200
+    refresh_token(response)
+
+    response = client.post('/api/chat', json={'message': 'I started piano lessons this week'}, headers=auth)
+    assert response.status_code == 200
+    chat_id = response.get_json()['chat_id']
+    first_answer = response.get_json()['message']
+    assert first_answer
+
+    response = client.get(f'/api/chat/{chat_id}', headers=auth)
+    assert response.status_code == 200
+    messages = response.get_json()['chat']['messages']
+    assert [message['role'] for message in messages] == ['user', 'assistant']
+
+    response = client.post(f'/api/chat/{chat_id}/message/1/feedback', json={'feedback_type': 'love'}, headers=auth)
+    assert response.status_code == 200
+
+    assert webapp.analytics_collection.find_one({'_id': 'total:mentor'})['reactions'] == {'love': 1}
+    response = client.get(f'/api/chat/{chat_id}', headers=auth)
+    assert response.get_json()['chat']['messages'][1]['user_feedback']['type'] == 'love'
+    assert 'rollup_bucket' not in response.get_json()['chat']['messages'][1]['user_feedback']
+
+    response = client.put('/api/feedback', json={
+        'design': 4, 'usability': 4, 'response_quality': 5, 'speed': 3, 'personalization': 4,
+        'conversation_naturalness': 4, 'usefulness': 5, 'overall_satisfaction': 'good'}, headers=auth)
+    assert response.status_code == 200
+    response = client.get('/api/feedback', headers=auth)
+    assert response.get_json()['feedback']['design'] == 4
+    assert 'rollup_bucket' not in response.get_json()['feedback']
+
+    response = client.post(f'/api/chat/{chat_id}/message/1/regenerate', json={'stage': 'strategy'}, headers=auth)
+    assert response.status_code == 200
+    assert response.get_json()['message']
+    # The reaction belonged to the replaced answer
+    assert webapp.analytics_collection.find_one({'_id': 'total:mentor'})['reactions'] == {'love': 0}
+
+    response = client.get(f'/api/chat/{chat_id}', headers=auth)
+    chat = response.get_json()['chat']
+    assert not {'turn_lease', 'last_turn', 'memory_pending', 'version', 'revision'} & set(chat)
+    answer = chat['messages'][1]
+    assert 'user_feedback' not in answer
+    assert not {'stage_outputs', 'stage_usage'} & set(answer)
+    assert answer['regenerated']['stage'] == 'strategy' and 'stage_usage' not in answer['regenerated']
+
+    response = client.get('/api/chat/history', headers=auth)
+    assert [set(chat) & {'messages', 'turn_lease', 'last_turn', 'version', 'revision'}
+            for chat in response.get_json()['chats']] == [set()]
+
+    # jsonify and the streamed lists share one date format
+    response = client.put('/api/memory', json={'skills': ['sight reading']}, headers=auth)
+    assert response.status_code == 200
+    memory = client.get('/api/memory', headers=auth).get_json()['memory']
+    assert memory['skills'] == ['sight reading'] and not {'user_items', 'removed_items'} & set(memory)
+    assert webapp.memories_collection.find_one({'user_id': memory['user_id']})['user_items'] == {
+        'skills': ['sight reading']}
+    memory_updated = memory['updated_at']
+    history_updated = client.get('/api/chat/history', headers=auth).get_json()['chats'][0]['updated_at']
+    for value in (memory_updated, history_updated):
+        assert datetime.fromisoformat(value).utcoffset() == timedelta(0), value
+
+    response = client.get('/api/search', query_string={'q': 'piano'}, headers=auth)
+    assert response.status_code == 200
+    assert any(result['chat_id'] == chat_id for result in response.get_json()['results'])
+
+    response = client.get('/api/bootstrap', headers=auth)
+    assert response.status_code == 200
+    bootstrap = response.get_json()
+    assert bootstrap['user']['personaSelected'] and bootstrap['user']['profileComplete']
+    assert bootstrap['persona']['role'] == 'mentor'
+    assert bootstrap['persona']['personality_traits'] == ['Caring']
+    assert [chat['_id'] for chat in bootstrap['chats']] == [chat_id]
+
+    response = client.get('/api/export', headers=auth)
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert records[0]['type'] == 'export' and records[-1]['type'] == 'end'
+    assert records[-1]['counts']['chat'] == 1
+    exported_chat = next(record['data'] for record in records if record['type'] == 'chat')
+    assert len(exported_chat['messages']) == 2
+    assert 'version' not in exported_chat and 'stage_outputs' not in exported_chat['messages'][1]
+    assert 'password' not in next(record['data'] for record in records if record['type'] == 'user')
+    assert 'rollup_bucket' not in next(record['data'] for record in records if record['type'] == 'feedback')
+
+
+class FailingCursor:
+    """A diary cursor that dies after `count` entries"""
+
+    def __init__(self, count):
+        self.count = count
+
+    def find(self, *args, **kwargs):
+        return self
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield {'_id': str(index), 'content': 'entry'}
+        raise RuntimeError('cursor killed')
+
+
+def test_streamed_list_failures(client, monkeypatch):
+    response = client.post('/api/register', json={'username': 'streamer', 'email': 'streamer@example.com',
+                                                  'password': 'correct horse'})
+    auth = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+
+    # Failures in the part read before the response starts get an error status
+    for count in (0, 3):
+        monkeypatch.setattr(webapp, 'routed', lambda collection, read_class: FailingCursor(count))
+        response = client.get('/api/diary', headers=auth)
+        assert response.status_code == 500 and response.get_json()['error'] == 'cursor killed'
+
+    # Later failures abort the transfer instead of ending a 200 with part of the list
+    monkeypatch.setattr(webapp.fast_json, 'STREAM_CHUNK_SIZE', 64)
+    monkeypatch.setenv('COMPRESS_MIN_SIZE', '64')
+    monkeypatch.setattr(webapp, 'routed', lambda collection, read_class: FailingCursor(20))
+    response = client.get('/api/diary', headers=auth)
+    assert response.status_code == 200
+    with pytest.raises(RuntimeError, match='cursor killed'):
+        response.get_data()
+
+
+def test_small_streamed_lists_are_not_compressed(client):
+    response = client.post('/api/register', json={'username': 'empty', 'email': 'empty@example.com',
+                                                  'password': 'correct horse'})
+    auth = {'Authorization': f"Bearer {response.get_json()['access_token']}",
+            'Accept-Encoding': 'gzip'}
+
+    response = client.get('/api/chat/history', headers=auth)
+    assert response.status_code == 200 and 'Content-Encoding' not in response.headers
+    assert response.get_json() == {'chats': []}
+
+
+def test_readiness_prepares_the_instance_once(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(webapp, '_instance_prepared', False)
+    monkeypatch.setattr(webapp, 'ensure_ttl_indexes', lambda: calls.append('indexes'))
+
+    for _ in range(3):
+        response = client.get('/api/ready')
+        assert response.status_code == 200, response.get_json()
+    assert calls == ['indexes']
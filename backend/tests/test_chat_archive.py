@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+import chat_archive
+import chat_turns
+import memory_windows
+
+
+class WriteBeforeDelete:
+    """The chats collection, with another writer landing between the archive's read and its delete"""
+
+    def __init__(self, collection, write):
+        self.collection = collection
+        self.write = write
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def delete_one(self, query, **kwargs):
+        self.write(self.collection)
+        return self.collection.delete_one(query, **kwargs)
+
+
+def idle_chat(collection, **fields):
+    old = datetime.now(timezone.utc) - timedelta(days=90)
+    return collection.insert_one(dict({
+        'user_id': 'u1', 'title': 'old chat', 'created_at': old, 'updated_at': old, 'version': 1, 'revision': 1,
+        'messages': [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'hello'}]
+    }, **fields)).inserted_id
+
+
+def test_archives_idle_chats(db):
+    chat_id = idle_chat(db['chats'])
+    stats = chat_archive.archive_idle_chats(db['chats'], db['chats_archive'], idle_days=30)
+    assert (stats['archived'], stats['skipped']) == (1, 0)
+    assert db['chats'].count_documents({}) == 0
+
+    chat = chat_archive.rehydrate(db['chats'], db['chats_archive'], {'_id': chat_id})
+    assert [message['content'] for message in chat['messages']] == ['hi', 'hello']
+    assert db['chats_archive'].count_documents({}) == 0
+
+
+def test_concurrent_writes_keep_the_hot_chat(db):
+    """Writes that leave updated_at alone must still stop the hot copy from being removed"""
+    writers = {
+        'feedback': lambda chats, chat_id: chats.update_one(
+            {'_id': chat_id}, {'$set': {'messages.1.user_feedback': {'type': 'love'}}, '$inc': {'revision': 1}}),
+        'memory window': lambda chats, chat_id: memory_windows.buffer_message(chats, chat_id),
+        'turn lease': lambda chats, chat_id: chat_turns._acquire_lease(chats, {'_id': chat_id}, 'owner', 'fp', 60),
+    }
+    for name, write in writers.items():
+        chat_id = idle_chat(db['chats'], title=name)
+        chats = WriteBeforeDelete(db['chats'], lambda collection: write(collection, chat_id))
+        stats = chat_archive.archive_idle_chats(chats, db['chats_archive'], idle_days=30)
+        assert (stats['archived'], stats['skipped']) == (0, 1), name
+        assert db['chats'].find_one({'_id': chat_id})['revision'] == 2, name
+        assert db['chats_archive'].count_documents({}) == 0, name
+        db['chats'].delete_one({'_id': chat_id})
+
+
+def test_skips_chats_with_a_turn_in_progress(db):
+    idle_chat(db['chats'], turn_lease={'owner': 'other', 'fingerprint': 'fp',
+                                       'expires_at': datetime.now(timezone.utc) + timedelta(minutes=1)})
+    stats = chat_archive.archive_idle_chats(db['chats'], db['chats_archive'], idle_days=30)
+    assert stats['archived'] == 0 and db['chats'].count_documents({}) == 1
+
+
+def test_keeps_chats_with_pending_memory_windows(db):
+    """extract_memories.py only reads hot chats, so a pending window must not be archived"""
+    pending = idle_chat(db['chats'], title='pending', memory_pending=2, memory_due=True)
+    extracted = idle_chat(db['chats'], title='extracted', memory_pending=0)
+    stats = chat_archive.archive_idle_chats(db['chats'], db['chats_archive'], idle_days=30)
+    assert stats['archived'] == 1
+    assert [chat['_id'] for chat in db['chats'].find({})] == [pending]
+    assert db['chats_archive'].find_one({})['_id'] == extracted
+    assert [chat['_id'] for chat in memory_windows.select_due(db['chats'], 8, 60)] == [pending]
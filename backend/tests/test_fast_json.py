@@ -0,0 +1,52 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import fast_json
+
+
+def failing_cursor(count, error='cursor killed'):
+    for index in range(count):
+        yield {'_id': index}
+    raise RuntimeError(error)
+
+
+def test_streams_an_object_with_an_array():
+    body = b''.join(fast_json.iter_object_with_array({'total': 2}, 'chats', [{'a': 1}, {'b': 2}]))
+    assert json.loads(body) == {'total': 2, 'chats': [{'a': 1}, {'b': 2}]}
+    assert json.loads(b''.join(fast_json.iter_object_with_array({}, 'chats', []))) == {'chats': []}
+
+
+def test_read_ahead_buffers_up_to_the_threshold(monkeypatch):
+    monkeypatch.setattr(fast_json, 'STREAM_CHUNK_SIZE', 16)
+    head, rest = fast_json.read_ahead(fast_json.iter_object_with_array({}, 'chats', [{'_id': 1}]), 1024)
+    assert rest is None and json.loads(head) == {'chats': [{'_id': 1}]}
+
+    chunks = fast_json.iter_object_with_array({}, 'chats', ({'_id': index} for index in range(20)))
+    head, rest = fast_json.read_ahead(chunks, 32)
+    assert len(head) >= 32 and rest is not None
+    assert json.loads(head + b''.join(rest)) == {'chats': [{'_id': index} for index in range(20)]}
+
+
+def test_failure_in_the_buffered_part_raises_before_streaming(monkeypatch):
+    monkeypatch.setattr(fast_json, 'STREAM_CHUNK_SIZE', 16)
+    with pytest.raises(RuntimeError):
+        fast_json.read_ahead(fast_json.iter_object_with_array({}, 'chats', failing_cursor(3)), 1024)
+
+
+def test_later_failure_is_raised_from_the_stream(monkeypatch):
+    monkeypatch.setattr(fast_json, 'STREAM_CHUNK_SIZE', 16)
+    head, rest = fast_json.read_ahead(fast_json.iter_object_with_array({}, 'chats', failing_cursor(5)), 16)
+    with pytest.raises(RuntimeError, match='cursor killed'):
+        list(rest)
+
+
+def test_unencodable_item_raises():
+    with pytest.raises(TypeError):
+        list(fast_json.iter_object_with_array({}, 'items', [{'ok': 1}, {'bad': object()}, {'ok': 2}]))
+
+
+def test_naive_datetimes_are_utc_iso_8601():
+    value = datetime(2026, 10, 19, 18, 30)
+    assert json.loads(fast_json.dumps({'at': value}))['at'] == fast_json.default(value) == '2026-10-19T18:30:00+00:00'
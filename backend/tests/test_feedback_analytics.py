@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+
+import chat_archive
+import feedback_analytics
+
+
+def test_backfill_counts_reactions_in_archived_chats(db):
+    old = datetime(2026, 7, 1, tzinfo=timezone.utc)
+    db['personas'].insert_one({'user_id': 'u1', 'role': 'mentor'})
+    for title in ('hot', 'cold'):
+        db['chats'].insert_one({
+            'user_id': 'u1', 'title': title, 'revision': 1,
+            'created_at': old, 'updated_at': datetime.now(timezone.utc) if title == 'hot' else old,
+            'messages': [{'role': 'user', 'content': 'hi'},
+                         {'role': 'assistant', 'content': 'hello',
+                          'user_feedback': {'type': 'love', 'timestamp': old}}]
+        })
+    stats = chat_archive.archive_idle_chats(db['chats'], db['chats_archive'], idle_days=30)
+    assert stats['archived'] == 1
+
+    rollups = db['analytics_rollups']
+    assert feedback_analytics.backfill(db, rollups) == {'ratings': 0, 'reactions': 2}
+    assert rollups.find_one({'_id': '2026-07-01:mentor'})['reactions'] == {'love': 2}
+
+    # Both copies remember their bucket, so a second run counts nothing
+    archived = chat_archive.from_archive_document(db['chats_archive'].find_one({'title': 'cold'}))
+    assert archived['messages'][1]['user_feedback']['rollup_bucket'] == {'day': '2026-07-01', 'role': 'mentor'}
+    assert feedback_analytics.backfill(db, rollups) == {'ratings': 0, 'reactions': 0}
+    assert rollups.find_one({'_id': 'total:mentor'})['reactions'] == {'love': 2}
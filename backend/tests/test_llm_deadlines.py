@@ -0,0 +1,72 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_deadlines
+import usage_ledger
+
+
+def completion(prompt_tokens):
+    usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=1, prompt_tokens_details=None)
+    return SimpleNamespace(usage=usage)
+
+
+def test_a_call_past_the_deadline_is_still_reported(monkeypatch):
+    monkeypatch.setenv('LLM_HEDGING', '0')
+    abandoned = []
+    finished = threading.Event()
+
+    def create(timeout, **kwargs):
+        time.sleep(0.3)
+        return completion(10)
+
+    def on_abandoned(response):
+        abandoned.append(response)
+        finished.set()
+
+    with pytest.raises(llm_deadlines.DeadlineExceeded):
+        llm_deadlines.call_with_deadline(create, 'strategy', 0.05, llm_deadlines.LatencyTracker(),
+                                         on_abandoned=on_abandoned)
+    assert finished.wait(2)
+    assert abandoned[0].usage.prompt_tokens == 10
+
+
+def test_the_losing_hedge_is_reported(monkeypatch):
+    monkeypatch.setenv('LLM_HEDGING', '1')
+    tracker = llm_deadlines.LatencyTracker()
+    for _ in range(llm_deadlines.HEDGE_MIN_SAMPLES):
+        tracker.record('strategy', 0.01)
+    attempts = []
+    abandoned = []
+    finished = threading.Event()
+
+    def create(timeout, **kwargs):
+        attempts.append(1)
+        if len(attempts) == 1:
+            time.sleep(0.3)
+            return completion(1)
+        return completion(2)
+
+    def on_abandoned(response):
+        abandoned.append(response)
+        finished.set()
+
+    response = llm_deadlines.call_with_deadline(create, 'strategy', 2, tracker, on_abandoned=on_abandoned)
+    assert response.usage.prompt_tokens == 2
+    assert finished.wait(2)
+    assert [response.usage.prompt_tokens for response in abandoned] == [1]
+
+
+def test_usage_recorded_after_the_turn_is_written_goes_to_the_ledger():
+    late = []
+    with usage_ledger.collect() as stage_usage:
+        usage_ledger.record('strategy', completion(10), 'gpt-4o-mini')
+        turn = usage_ledger.current_turn()
+    written = usage_ledger.close(stage_usage, late.append)
+    usage_ledger.record('strategy', completion(5), 'gpt-4o-mini', turn=turn)
+
+    assert written['strategy']['prompt_tokens'] == 10
+    assert [entry['strategy']['prompt_tokens'] for entry in late] == [5]
+    assert stage_usage['strategy']['prompt_tokens'] == 10
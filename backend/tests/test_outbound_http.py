@@ -0,0 +1,14 @@
+import outbound_http
+
+
+def test_pool_follows_the_callers(monkeypatch):
+    for name in ('OPENAI_MAX_CONNECTIONS', 'REQUEST_THREADS', 'LLM_HEDGING'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('LLM_EXECUTOR_WORKERS', '8')
+    monkeypatch.setenv('LOAD_MAX_IN_FLIGHT', '10')
+    monkeypatch.setenv('DEFERRED_WORK_WORKERS', '2')
+    assert outbound_http.default_max_connections() == 8 + 10 + 2
+
+    monkeypatch.setenv('LLM_HEDGING', '1')
+    monkeypatch.setenv('REQUEST_THREADS', '4')
+    assert outbound_http.default_max_connections() == 16 + 4 + 2
@@ -0,0 +1,41 @@
+import rate_limit
+
+LIMITS = {'chat': {'requests': 2, 'per_seconds': 60, 'burst': 2, 'concurrency': 1}}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_idle_buckets_are_swept(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    limiter = rate_limit.RateLimiter(LIMITS)
+
+    for user_id in ('u1', 'u2'):
+        assert limiter.acquire('chat', user_id).allowed
+        limiter.release('chat', user_id)
+    assert len(limiter._buckets) == 2
+
+    # u1 comes back once u2's bucket has refilled; only u1's is left
+    clock.now += rate_limit.SWEEP_SECONDS
+    assert limiter.acquire('chat', 'u1').allowed
+    assert list(limiter._buckets) == [('chat', 'u1')]
+
+
+def test_shared_rejection_refunds_the_local_token(db):
+    shared = rate_limit.RateLimiter(LIMITS, shared_collection=db['rate_limits'])
+    other_worker = rate_limit.RateLimiter(LIMITS, shared_collection=db['rate_limits'])
+    for _ in range(2):
+        assert other_worker.acquire('chat', 'u1').allowed
+        other_worker.release('chat', 'u1')
+
+    decision = shared.acquire('chat', 'u1')
+    assert not decision.allowed and decision.retry_after >= 1
+    tokens, _ = shared._buckets[('chat', 'u1')]
+    assert tokens >= 2 - 1e-6
+    assert not shared._in_flight
@@ -0,0 +1,54 @@
+import base64
+import time
+
+import bson
+from bson.int64 import Int64
+from bson.timestamp import Timestamp
+
+import read_routing
+
+
+class RecordingSession:
+    def __init__(self):
+        self.operation_time = None
+        self.cluster_time = None
+
+    def advance_operation_time(self, operation_time):
+        self.operation_time = operation_time
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+
+def token(**fields):
+    return base64.urlsafe_b64encode(bson.encode(fields)).decode('ascii')
+
+
+def test_round_trips_a_server_token():
+    now = Timestamp(int(time.time()), 1)
+    cluster_time = {'clusterTime': now, 'signature': {'hash': b'\0' * 20, 'keyId': Int64(0)}}
+    source = RecordingSession()
+    source.operation_time, source.cluster_time = now, cluster_time
+
+    session = RecordingSession()
+    assert read_routing.apply_token(session, read_routing.encode_token(source))
+    assert (session.operation_time, session.cluster_time) == (now, cluster_time)
+
+
+def test_ignores_malformed_tokens_without_touching_the_session():
+    now = Timestamp(int(time.time()), 1)
+    future = Timestamp(int(time.time()) + 3600, 1)
+    tokens = {
+        'not base64': '%%%',
+        'no operation time': token(cluster_time={'clusterTime': now}),
+        'future operation time': token(operation_time=future),
+        'cluster time not a document': token(operation_time=now, cluster_time='later'),
+        'cluster time without a timestamp': token(operation_time=now, cluster_time={'clusterTime': 5}),
+        'future cluster time': token(operation_time=now, cluster_time={'clusterTime': future}),
+        'bad signature': token(operation_time=now, cluster_time={'clusterTime': now, 'signature': {'hash': 'x'}}),
+        'extra fields': token(operation_time=now, cluster_time={'clusterTime': now, '$where': 1}),
+    }
+    for name, value in tokens.items():
+        session = RecordingSession()
+        assert not read_routing.apply_token(session, value), name
+        assert (session.operation_time, session.cluster_time) == (None, None), name
@@ -0,0 +1,52 @@
+import memory_edits
+import reprocess_chats
+
+CATEGORIES = ['favorites', 'health']
+
+
+def test_rebuild_replaces_stale_items(db):
+    db['memories'].insert_one({'user_id': 'u1', 'favorites': ['likes pizza (old schema)'], 'health': ['asthma'],
+                               'version': 3})
+    memory = db['memories'].find_one({'user_id': 'u1'})
+
+    combined = {}
+    reprocess_chats.merge_memory(combined, {'favorites': ['pizza', 'tea']}, CATEGORIES)
+    reprocess_chats.merge_memory(combined, {'favorites': ['pizza'], 'unknown': ['x']}, CATEGORIES)
+    assert combined == {'favorites': ['pizza', 'tea']}
+
+    assert reprocess_chats.write_memory(db['memories'], 'u1', memory, combined, CATEGORIES) == 'rebuilt'
+    rebuilt = db['memories'].find_one({'user_id': 'u1'})
+    assert (rebuilt['favorites'], rebuilt['health'], rebuilt['version']) == (['pizza', 'tea'], [], 4)
+
+
+def test_rebuild_skips_memory_written_during_the_run(db):
+    db['memories'].insert_one({'user_id': 'u1', 'favorites': ['pizza'], 'version': 1})
+    memory = db['memories'].find_one({'user_id': 'u1'})
+    db['memories'].update_one({'user_id': 'u1'}, {'$addToSet': {'favorites': 'tea'}, '$inc': {'version': 1}})
+
+    status = reprocess_chats.write_memory(db['memories'], 'u1', memory, {'favorites': ['coffee']}, CATEGORIES)
+    assert status == 'conflict'
+    assert db['memories'].find_one({'user_id': 'u1'})['favorites'] == ['pizza', 'tea']
+
+
+def test_rebuild_keeps_items_edited_by_hand(db):
+    stored = {'favorites': ['pizza'], 'health': ['asthma']}
+    edits = memory_edits.record_edits(stored, {'favorites': [], 'health': ['asthma', 'pollen allergy']})
+    db['memories'].insert_one(dict(stored, user_id='u1', version=1, favorites=[],
+                                   health=['asthma', 'pollen allergy'], **edits))
+    memory = db['memories'].find_one({'user_id': 'u1'})
+
+    extracted = {'favorites': ['pizza', 'tea'], 'health': ['asthma']}
+    assert reprocess_chats.write_memory(db['memories'], 'u1', memory, extracted, CATEGORIES) == 'rebuilt'
+    rebuilt = db['memories'].find_one({'user_id': 'u1'})
+    # The deleted item stays deleted and the typed-in one survives the rebuild
+    assert (rebuilt['favorites'], rebuilt['health']) == (['tea'], ['asthma', 'pollen allergy'])
+
+
+def test_rebuild_creates_missing_memory_and_keeps_it_from_empty_results(db):
+    assert reprocess_chats.write_memory(db['memories'], 'u2', None, {'health': ['asthma']}, CATEGORIES) == 'rebuilt'
+    created = db['memories'].find_one({'user_id': 'u2'})
+    assert (created['health'], created['version']) == (['asthma'], 1)
+
+    assert reprocess_chats.write_memory(db['memories'], 'u2', created, {}, CATEGORIES) == 'rejected'
+    assert db['memories'].find_one({'user_id': 'u2'})['health'] == ['asthma']
@@ -0,0 +1,21 @@
+from datetime import datetime, timedelta, timezone
+
+import chat_archive
+import search_index
+
+
+def test_rebuild_keeps_archived_chats(db):
+    old = datetime.now(timezone.utc) - timedelta(days=90)
+    chat_id = db['chats'].insert_one({
+        'user_id': 'u1', 'title': 'trip to Kapadokya', 'created_at': old, 'updated_at': old, 'revision': 1,
+        'messages': [{'role': 'user', 'content': 'balloon ride at sunrise'}]
+    }).inserted_id
+    stats = chat_archive.archive_idle_chats(db['chats'], db['chats_archive'], idle_days=30)
+    assert stats['archived'] == 1 and db['chats'].count_documents({}) == 0
+
+    search_index.rebuild_user_index(db, db['search_index'], 'u1', ['interests'])
+
+    found = search_index.search(db['search_index'], 'u1', 'balloon')['results']
+    assert [(result['kind'], result['chat_id']) for result in found] == [('message', str(chat_id))]
+    titles = search_index.search(db['search_index'], 'u1', 'Kapadokya', kinds=['chat_title'])['results']
+    assert [result['chat_id'] for result in titles] == [str(chat_id)]
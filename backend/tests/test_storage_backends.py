@@ -0,0 +1,231 @@
+"""The same operations against MongoDB and the embedded SQLite store.
+
+Covers the query, update and aggregation features the codebase relies on
+(see sqlite_store.py), mostly through the modules that use them, so both
+backends are held to the results the app expects.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+import feedback_analytics
+import memory_consolidation
+import search_index
+import usage_ledger
+from sqlite_store import SQLiteClient
+
+CATEGORIES = ['family_friends', 'favorites', 'skills']
+
+
+def wait_until(check, timeout):
+    """MongoDB's TTL monitor runs once a minute; the SQLite store purges on the next read"""
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(1)
+    return True
+
+
+def test_find_projection_sort_skip_limit(db):
+    collection = db['chats']
+    collection.insert_many([
+        {'user_id': 'u1', 'title': f'chat {n}', 'updated_at': n, 'messages': [{'role': 'user', 'content': str(n)}]}
+        for n in range(5)
+    ] + [{'user_id': 'u2', 'title': 'other', 'updated_at': 9}])
+
+    titles = [chat['title'] for chat in
+              collection.find({'user_id': 'u1'}, {'title': 1, '_id': 0}).sort('updated_at', -1).skip(1).limit(2)]
+    assert titles == ['chat 3', 'chat 2']
+    assert collection.count_documents({'user_id': 'u1', 'updated_at': {'$gte': 3}}) == 2
+    assert collection.count_documents({'messages.content': {'$in': ['1', '4']}}) == 2
+    assert collection.find_one({'user_id': 'u2'}, {'messages': 0})['title'] == 'other'
+    assert collection.find_one({'$or': [{'title': 'missing'}, {'updated_at': {'$lt': 1}}]})['title'] == 'chat 0'
+    assert collection.count_documents({'user_id': 'u1', '_id': {'$ne': None}, 'deleted': {'$exists': False}}) == 5
+
+
+def test_update_operators(db):
+    collection = db['memories']
+    collection.update_one({'user_id': 'u1'}, {'$set': {'others': []}, '$setOnInsert': {'created': 1}}, upsert=True)
+    collection.update_one({'user_id': 'u1'}, {
+        '$addToSet': {'skills': {'$each': ['piano', 'chess', 'piano']}},
+        '$push': {'log': {'$each': [1, 2]}},
+        '$inc': {'version': 1, 'stats.writes': 2},
+        '$setOnInsert': {'created': 2}
+    })
+    collection.update_one({'user_id': 'u1'}, {'$addToSet': {'skills': {'$each': ['chess', 'go']}},
+                                              '$unset': {'others': ''}})
+    memory = collection.find_one({'user_id': 'u1'}, {'_id': 0})
+    assert memory == {'user_id': 'u1', 'created': 1, 'skills': ['piano', 'chess', 'go'], 'log': [1, 2],
+                      'version': 1, 'stats': {'writes': 2}}
+
+    result = collection.update_one({'user_id': 'u1', 'version': 0}, {'$inc': {'version': 1}})
+    assert (result.matched_count, result.modified_count) == (0, 0)
+    result = collection.update_many({'user_id': {'$in': ['u1', 'u2']}}, {'$set': {'seen': True}})
+    assert (result.matched_count, result.modified_count) == (1, 1)
+
+
+def test_expr_cond_is_array_size(db):
+    """memory_consolidation's pipeline: $expr on two fields, item counts with $cond/$isArray/$size"""
+    collection = db['memories']
+    now = datetime.now(timezone.utc)
+    collection.insert_many([
+        # Changed since its last consolidation, three items in lists
+        {'user_id': 'a', 'updated_at': now, 'consolidated_at': now - timedelta(days=1),
+         'family_friends': ['mom', 'dad'], 'skills': ['piano'], 'favorites': 'not a list'},
+        # Never consolidated, four items
+        {'user_id': 'b', 'updated_at': now, 'favorites': ['tea', 'rain', 'jazz', 'cats']},
+        # Consolidated after its last change
+        {'user_id': 'c', 'updated_at': now - timedelta(days=2), 'consolidated_at': now - timedelta(days=1),
+         'skills': ['a', 'b', 'c', 'd', 'e']},
+        # Changed, but too small
+        {'user_id': 'd', 'updated_at': now, 'skills': ['one']},
+    ])
+
+    selected = list(memory_consolidation.select_candidates(collection, CATEGORIES, min_items=2))
+    assert [memory['user_id'] for memory in selected] == ['b', 'a']
+    assert all('_item_count' not in memory for memory in selected)
+    assert [memory['user_id'] for memory in
+            memory_consolidation.select_candidates(collection, CATEGORIES, min_items=2, limit=1)] == ['b']
+    assert [memory['user_id'] for memory in
+            memory_consolidation.select_candidates(collection, CATEGORIES, min_items=2, user_id='a')] == ['a']
+
+
+def test_group(db):
+    """usage_ledger's top consumers: $match on days, $group with $sum, $sort and $limit"""
+    collection = db['usage_ledger']
+    stage_usage = {'analysis': {'calls': 1, 'prompt_tokens': 100, 'completion_tokens': 20, 'cached_tokens': 0,
+                                'latency_ms': 5, 'cost_usd': 0.001}}
+    for _ in range(3):
+        usage_ledger.record_turn(collection, 'heavy', 'mentor', stage_usage)
+    usage_ledger.record_turn(collection, 'light', 'friend', stage_usage)
+    usage_ledger.record_turn(collection, 'light', 'friend', stage_usage, turns=0)
+    yesterday = (datetime.now(timezone.utc).date() - timedelta(days=1)).strftime('%Y-%m-%d')
+    collection.insert_one({'_id': f'{yesterday}:light', 'day': yesterday, 'user_id': 'light', 'turns': 10,
+                           'llm_calls': 10, 'prompt_tokens': 1000, 'completion_tokens': 0, 'cached_tokens': 0,
+                           'total_tokens': 1000, 'cost_usd': 0.01})
+
+    today = usage_ledger.top_consumers(collection, days=1)
+    assert [(row['user_id'], row['total_tokens'], row['turns']) for row in today] == [('heavy', 360, 3),
+                                                                                     ('light', 240, 1)]
+    two_days = usage_ledger.top_consumers(collection, days=2, limit=1)
+    assert [(row['user_id'], row['total_tokens'], row['turns'], row['llm_calls']) for row in two_days] == [
+        ('light', 1240, 11, 12)]
+    assert collection.find_one({'_id': f'{usage_ledger.current_day()}:heavy'})['roles']['mentor']['turns'] == 3
+
+
+def test_text_search_sorted_by_score(db):
+    """search_index: $text with a compound text index, textScore projection and sort, kind filter"""
+    collection = db['search_index']
+    search_index.index_message(collection, 'u1', 'c1', 0, {'role': 'user', 'content': 'piano lessons every piano day'})
+    search_index.index_message(collection, 'u1', 'c1', 1, {'role': 'assistant', 'content': 'the piano sounds nice'})
+    search_index.index_chat_title(collection, 'u1', 'c1', 'Weekend plans')
+    search_index.index_diary_entry(collection, 'u1', 'd1', 'c1', 'Lessons', 'Started lessons today')
+    search_index.index_message(collection, 'u2', 'c2', 0, {'role': 'user', 'content': 'piano lessons'})
+
+    found = search_index.search(collection, 'u1', 'piano lessons')
+    assert found['total'] == 3
+    assert [result['ref'] for result in found['results']][0] == 'c1:0'
+    assert all('user_id' not in result and result['score'] > 0 for result in found['results'])
+    scores = [result['score'] for result in found['results']]
+    assert scores == sorted(scores, reverse=True)
+
+    messages = search_index.search(collection, 'u1', 'piano lessons', kinds=['message'], page=2, page_size=1)
+    assert (messages['total'], [result['ref'] for result in messages['results']]) == (2, ['c1:1'])
+    assert search_index.search(collection, 'u1', 'violin')['total'] == 0
+
+
+def test_find_one_and_update_return_document(db):
+    """rate_limit's window counter and profile_claims' version bump"""
+    collection = db['rate_limits']
+    after = collection.find_one_and_update(
+        {'_id': 'chat:u1:1'}, {'$inc': {'count': 1}, '$setOnInsert': {'window': 1}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    assert after == {'_id': 'chat:u1:1', 'count': 1, 'window': 1}
+    before = collection.find_one_and_update({'_id': 'chat:u1:1'}, {'$inc': {'count': 1}},
+                                            return_document=ReturnDocument.BEFORE)
+    assert before['count'] == 1
+    projected = collection.find_one_and_update({'_id': 'chat:u1:1'}, {'$inc': {'count': 1}},
+                                               projection={'count': 1, '_id': 0},
+                                               return_document=ReturnDocument.AFTER)
+    assert projected == {'count': 3}
+    assert collection.find_one_and_update({'_id': 'missing'}, {'$inc': {'count': 1}}) is None
+    assert collection.find_one_and_update({'_id': 'missing'}, {'$inc': {'count': 1}},
+                                          return_document=ReturnDocument.AFTER) is None
+    assert collection.count_documents({}) == 1
+
+
+def test_bulk_write(db):
+    """feedback_analytics' rollups: unordered upserts with $inc, $set and $setOnInsert"""
+    collection = db['analytics_rollups']
+    bucket = {'day': '2026-10-19', 'role': 'mentor'}
+    feedback_analytics.record_reaction(collection, None, 'thumbs_up', bucket)
+    feedback_analytics.record_reaction(collection, {'type': 'thumbs_up', 'rollup_bucket': bucket}, 'love', bucket)
+    for rollup_id in ('2026-10-19:mentor', 'total:mentor'):
+        rollup = collection.find_one({'_id': rollup_id})
+        assert rollup['reactions'] == {'thumbs_up': 0, 'love': 1}
+        assert rollup['role'] == 'mentor'
+    assert collection.find_one({'_id': 'total:mentor'})['day'] == 'total'
+
+    result = db['diary'].bulk_write([
+        InsertOne({'_id': 1, 'user_id': 'u1'}),
+        UpdateOne({'_id': 1}, {'$set': {'title': 'a'}}),
+        UpdateOne({'_id': 2}, {'$set': {'title': 'b'}}, upsert=True),
+        DeleteOne({'_id': 1}),
+    ], ordered=False)
+    assert (result.inserted_count, result.matched_count, result.modified_count,
+            result.upserted_count, result.deleted_count) == (1, 1, 1, 1, 1)
+    assert result.upserted_ids == {2: 2}
+    assert list(db['diary'].find({}, {'_id': 1})) == [{'_id': 2}]
+
+
+def test_ttl_purge(db):
+    collection = db['idempotency_keys']
+    collection.create_index('expires_at', name='expires_at_ttl', expireAfterSeconds=0)
+    now = datetime.now(timezone.utc)
+    collection.insert_many([{'_id': 'expired', 'expires_at': now - timedelta(minutes=5)},
+                            {'_id': 'fresh', 'expires_at': now + timedelta(hours=1)},
+                            {'_id': 'no date'}])
+    assert wait_until(lambda: collection.count_documents({}) == 2, timeout=150)
+    assert sorted(document['_id'] for document in collection.find({})) == ['fresh', 'no date']
+
+
+def test_unique_index(db):
+    collection = db['search_index']
+    search_index.ensure_indexes(collection)
+    collection.insert_one({'user_id': 'u1', 'kind': 'memory', 'ref': 'a', 'text': 'a'})
+    collection.insert_one({'user_id': 'u1', 'kind': 'memory', 'ref': 'b', 'text': 'b'})
+    collection.insert_one({'user_id': 'u2', 'kind': 'memory', 'ref': 'a', 'text': 'a'})
+
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({'user_id': 'u1', 'kind': 'memory', 'ref': 'a', 'text': 'again'})
+    with pytest.raises(DuplicateKeyError):
+        collection.update_one({'user_id': 'u1', 'ref': 'b'}, {'$set': {'ref': 'a'}})
+    # An upsert on the unique key updates the existing entry instead
+    collection.update_one({'user_id': 'u1', 'kind': 'memory', 'ref': 'a'}, {'$set': {'text': 'new'}}, upsert=True)
+    assert collection.find_one({'user_id': 'u1', 'ref': 'a'})['text'] == 'new'
+    assert collection.count_documents({}) == 3
+
+
+def test_sqlite_rejects_arrays_in_indexed_fields(tmp_path):
+    """json_extract can not index into arrays, so pushed-down queries would miss such documents"""
+    client = SQLiteClient(str(tmp_path / 'store.sqlite3'))
+    collection = client['store_check']['items']
+    with pytest.raises(OperationFailure):
+        collection.insert_one({'user_id': ['u1', 'u2']})
+    collection.insert_one({'_id': 1, 'user_id': 'u1', 'kind': 'memory'})
+    with pytest.raises(OperationFailure):
+        collection.update_one({'_id': 1}, {'$set': {'user_id': ['u1']}})
+    assert collection.find_one({'user_id': 'u1'})['user_id'] == 'u1'
+
+    collection.insert_one({'_id': 2, 'user_id': 'u1', 'tags': ['a', 'b']})
+    with pytest.raises(OperationFailure):
+        collection.create_index('tags')
+    collection.create_index([('kind', 1), ('meta.source', 1)])
+    with pytest.raises(OperationFailure):
+        collection.insert_one({'user_id': 'u1', 'meta': [{'source': 'x'}]})
+    client.close()
@@ -0,0 +1,217 @@
+"""LLM token usage per chat turn and a per-user, per-day ledger.
+
+Every completion made while a turn is being collected (collect()) is added
+to that turn's usage by stage. At the end of the turn the totals are added
+to the ledger with one atomic $inc upsert, so concurrent turns of the same
+user never lose an update. Calls the turn stopped waiting for (lost hedges,
+stages past their deadline) are still billed when they finish; their usage
+is recorded against the turn they were made for, and if that turn has
+already been written (close()) it goes to the ledger on its own.
+
+One ledger document per (day, user):
+    {_id: "2026-10-19:<user_id>", day, user_id,
+     turns, llm_calls, prompt_tokens, completion_tokens, cached_tokens, total_tokens, cost_usd,
+     stages: {<stage>: {calls, prompt_tokens, completion_tokens, latency_ms}},
+     roles: {<persona role>: {turns, total_tokens}},
+     updated_at}
+
+Budgets are daily token totals: past the soft budget a user gets the
+cheaper single-call pipeline, past the hard budget chat requests are
+rejected until the next UTC day.
+"""
+import contextvars
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+# USD per 1M (prompt, completion) tokens, used for the cost estimate in the ledger
+MODEL_PRICES = {
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+}
+
+_turn_usage = contextvars.ContextVar('usage_ledger_turn', default=None)
+_turn_lock = threading.Lock()
+
+_indexed_collections = set()
+_index_lock = threading.Lock()
+
+
+class TurnUsage(dict):
+    """{stage: usage} of one turn; usage recorded after close() goes to `late_writer`"""
+    late_writer = None
+
+
+@contextmanager
+def collect():
+    """Collect the usage of every completion made in this context; yields {stage: usage}"""
+    usage = TurnUsage()
+    token = _turn_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _turn_usage.reset(token)
+
+
+def current_turn():
+    """The turn being collected in this context, to record usage for it from another thread later"""
+    return _turn_usage.get()
+
+
+def close(usage, late_writer):
+    """Snapshot a turn's usage for writing; usage recorded for it later is passed to late_writer({stage: usage})"""
+    with _turn_lock:
+        usage.late_writer = late_writer
+        return {stage: dict(entry) for stage, entry in usage.items()}
+
+
+def summarize(response):
+    """Token counts from a completion's usage, including prompt tokens served from the provider cache"""
+    usage = getattr(response, 'usage', None)
+    if not usage:
+        return {}
+
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens or 0,
+        'completion_tokens': usage.completion_tokens or 0,
+        'cached_tokens': (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+    }
+
+
+def estimate_cost(model, summary):
+    prompt_price, completion_price = MODEL_PRICES.get(model, MODEL_PRICES['gpt-3.5-turbo'])
+    return (summary.get('prompt_tokens', 0) * prompt_price +
+            summary.get('completion_tokens', 0) * completion_price) / 1_000_000
+
+
+def _add(usage, stage, summary, model, latency_ms):
+    entry = usage.setdefault(stage, {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                                     'cached_tokens': 0, 'latency_ms': 0, 'cost_usd': 0.0})
+    entry['calls'] += 1
+    for field in ('prompt_tokens', 'completion_tokens', 'cached_tokens'):
+        entry[field] += summary.get(field, 0)
+    entry['latency_ms'] += latency_ms or 0
+    entry['cost_usd'] += estimate_cost(model, summary)
+    if model:
+        entry['model'] = model
+
+
+def record(stage, response, model=None, latency_ms=None, turn=None):
+    """Add a completion's usage to the current turn, or to `turn` (no-op outside collect())"""
+    usage = turn if turn is not None else _turn_usage.get()
+    if usage is None:
+        return
+
+    summary = summarize(response)
+    with _turn_lock:
+        late_writer = getattr(usage, 'late_writer', None)
+        if late_writer is None:
+            _add(usage, stage, summary, model, latency_ms)
+            return
+    late = {}
+    _add(late, stage, summary, model, latency_ms)
+    late_writer(late)
+
+
+def totals(stage_usage):
+    result = {'llm_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0, 'cost_usd': 0.0}
+    for entry in stage_usage.values():
+        result['llm_calls'] += entry.get('calls', 0)
+        for field in ('prompt_tokens', 'completion_tokens', 'cached_tokens', 'cost_usd'):
+            result[field] += entry.get(field, 0)
+    result['total_tokens'] = result['prompt_tokens'] + result['completion_tokens']
+    return result
+
+
+def current_day():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+def seconds_until_reset():
+    now = datetime.now(timezone.utc)
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((tomorrow - now).total_seconds()) + 1
+
+
+def ensure_indexes(collection):
+    if collection.full_name in _indexed_collections:
+        return
+    with _index_lock:
+        if collection.full_name in _indexed_collections:
+            return
+        collection.create_index([('day', 1), ('total_tokens', -1)], name='day_total_tokens')
+        _indexed_collections.add(collection.full_name)
+
+
+def record_turn(collection, user_id, role, stage_usage, turns=1):
+    """Add one turn's usage to the user's ledger document for today.
+
+    turns=0 adds usage without counting a turn (work deferred from a turn already counted).
+    """
+    if not stage_usage:
+        return
+
+    turn_totals = totals(stage_usage)
+    increments = {'turns': turns, f"roles.{role or 'friend'}.turns": turns,
+                  f"roles.{role or 'friend'}.total_tokens": turn_totals['total_tokens']}
+    for field, value in turn_totals.items():
+        increments[field] = value
+    for stage, entry in stage_usage.items():
+        for field in ('calls', 'prompt_tokens', 'completion_tokens', 'latency_ms'):
+            increments[f'stages.{stage}.{field}'] = entry.get(field, 0)
+
+    day = current_day()
+    collection.update_one(
+        {'_id': f'{day}:{user_id}'},
+        {
+            '$inc': increments,
+            '$set': {'updated_at': datetime.now(timezone.utc)},
+            '$setOnInsert': {'day': day, 'user_id': user_id}
+        },
+        upsert=True
+    )
+
+
+def tokens_used_today(collection, user_id):
+    ledger = collection.find_one({'_id': f'{current_day()}:{user_id}'}, {'total_tokens': 1})
+    return ledger.get('total_tokens', 0) if ledger else 0
+
+
+def budget_status(used, soft_budget, hard_budget):
+    """'hard', 'soft' or 'ok' for a daily token total; a budget of 0 is disabled"""
+    if hard_budget and used >= hard_budget:
+        return 'hard'
+    if soft_budget and used >= soft_budget:
+        return 'soft'
+    return 'ok'
+
+
+def top_consumers(collection, days=1, limit=20):
+    """Users with the most tokens over the last `days` days (today included)"""
+    ensure_indexes(collection)
+    today = datetime.now(timezone.utc).date()
+    day_keys = [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+
+    pipeline = [
+        {'$match': {'day': {'$in': day_keys}}},
+        {'$group': {
+            '_id': '$user_id',
+            'total_tokens': {'$sum': '$total_tokens'},
+            'prompt_tokens': {'$sum': '$prompt_tokens'},
+            'completion_tokens': {'$sum': '$completion_tokens'},
+            'cached_tokens': {'$sum': '$cached_tokens'},
+            'cost_usd': {'$sum': '$cost_usd'},
+            'turns': {'$sum': '$turns'},
+            'llm_calls': {'$sum': '$llm_calls'}
+        }},
+        {'$sort': {'total_tokens': -1}},
+        {'$limit': limit}
+    ]
+    consumers = []
+    for row in collection.aggregate(pipeline):
+        row['user_id'] = row.pop('_id')
+        row['cost_usd'] = round(row['cost_usd'], 4)
+        consumers.append(row)
+    return consumers
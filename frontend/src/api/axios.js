@@ -11,12 +11,28 @@ instance.interceptors.request.use((config) => {
   if (token) {
     config.headers.Authorization = `Bearer ${token}`;
   }
+  // Latest write seen by this browser, so reads served by replicas include it
+  const readAfter = localStorage.getItem('readAfter');
+  if (readAfter) {
+    config.headers['X-Read-After'] = readAfter;
+  }
   return config;
 });
 
 // Token expiration interceptor
 instance.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    const readAfter = response.headers['x-read-after'];
+    if (readAfter) {
+      localStorage.setItem('readAfter', readAfter);
+    }
+    // A profile or persona change comes back with a token carrying the new claims
+    const accessToken = response.headers['x-access-token'];
+    if (accessToken) {
+      localStorage.setItem('token', accessToken);
+    }
+    return response;
+  },
   (error) => {
     if (error.response?.status === 401) {
       localStorage.removeItem('token');
@@ -0,0 +1,39 @@
+// src/api/bootstrap.js
+import axios from './axios';
+
+// Start-up data (user, persona, chat list) in one request.
+// Each section is handed out once, to the component that renders it first; later loads
+// go to the section's own endpoint so they see fresh data. Writes to a section's data
+// must call resetBootstrap(), or a component that has not rendered yet gets the old copy.
+let pending = null;
+const taken = new Set();
+
+const loadBootstrap = () => {
+  if (!pending) {
+    pending = axios.get('/api/bootstrap')
+      .then((response) => response.data)
+      .catch((error) => {
+        pending = null;
+        throw error;
+      });
+  }
+  return pending;
+};
+
+export const takeBootstrap = async (section) => {
+  if (taken.has(section)) {
+    return null;
+  }
+  taken.add(section);
+  try {
+    const data = await loadBootstrap();
+    return data[section] ?? null;
+  } catch (error) {
+    return null;
+  }
+};
+
+export const resetBootstrap = () => {
+  pending = null;
+  taken.clear();
+};
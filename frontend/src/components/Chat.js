@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import axios from '../api/axios';
+import { takeBootstrap } from '../api/bootstrap';
 import MessageFeedback from './MessageFeedback';
 import './Chat.css';
 
@@ -96,6 +97,11 @@ const Chat = () => {
 
   const loadChatHistory = async () => {
     try {
+      const bootstrapChats = await takeBootstrap('chats');
+      if (bootstrapChats) {
+        setChatHistory(bootstrapChats);
+        return;
+      }
       const response = await axios.get('/api/chat/history');
       setChatHistory(response.data.chats || []);
     } catch (error) {
@@ -135,11 +141,24 @@ const Chat = () => {
     setLoading(true);
     setInputMessage('');
 
+    // Same key on a retry lets the backend return the first result instead of re-running the turn
+    const idempotencyKey = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    const postMessage = () => axios.post('/api/chat', {
+      message: inputMessage,
+      chat_id: currentChatId
+    }, {
+      headers: { 'Idempotency-Key': idempotencyKey }
+    });
+
     try {
-      const response = await axios.post('/api/chat', {
-        message: inputMessage,
-        chat_id: currentChatId
-      });
+      let response;
+      try {
+        response = await postMessage();
+      } catch (error) {
+        // Retry once on network errors and timeouts (no response received)
+        if (error.response) throw error;
+        response = await postMessage();
+      }
 
       const assistantMessage = {
         role: 'assistant',
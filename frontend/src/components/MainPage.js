@@ -6,6 +6,7 @@ import Diary from './Diary';
 import Profile from './Profile';
 import FeedbackModal from './FeedbackModal';
 import axios from '../api/axios';
+import { takeBootstrap } from '../api/bootstrap';
 
 const MainPage = () => {
   const { user, logout } = useAuth();
@@ -20,6 +21,11 @@ const MainPage = () => {
 
   const fetchPersona = async () => {
     try {
+      const bootstrapPersona = await takeBootstrap('persona');
+      if (bootstrapPersona) {
+        setPersona(bootstrapPersona);
+        return;
+      }
       const response = await axios.get('/api/persona');
       console.log('Persona response:', response.data);
       console.log('Persona traits:', response.data.persona?.personality_traits);
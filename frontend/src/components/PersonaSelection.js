@@ -2,6 +2,7 @@ import React, { useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
 import axios from '../api/axios';
+import { resetBootstrap } from '../api/bootstrap';
 
 import './PersonaSelection.css';
 
@@ -79,6 +80,9 @@ const PersonaSelection = () => {
             // Mark persona selection as complete
             await axios.post('/api/complete-persona-selection');
             
+            // The bootstrap loaded before onboarding still holds the default persona
+            resetBootstrap();
+            
             // Update user state to trigger navigation
             await fetchUser();
             
@@ -97,6 +101,7 @@ const PersonaSelection = () => {
         try {
             // Mark persona selection as complete even if skipped
             await axios.post('/api/complete-persona-selection');
+            resetBootstrap();
             
             // Update user state to trigger navigation
             await fetchUser();
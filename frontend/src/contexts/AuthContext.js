@@ -1,5 +1,6 @@
 import React, { createContext, useState, useContext, useEffect } from 'react';
 import axios from '../api/axios';
+import { takeBootstrap, resetBootstrap } from '../api/bootstrap';
 
 
 // Set up axios interceptor to include JWT token
@@ -53,6 +54,11 @@ export const AuthProvider = ({ children }) => {
 
   const fetchUser = async () => {
     try {
+      const bootstrapUser = await takeBootstrap('user');
+      if (bootstrapUser) {
+        setUser(bootstrapUser);
+        return;
+      }
       const response = await axios.get('/api/user');
       setUser(response.data.user);
     } catch (error) {
@@ -73,6 +79,7 @@ export const AuthProvider = ({ children }) => {
       const { access_token, user: userData } = response.data;
       
       localStorage.setItem('token', access_token);
+      resetBootstrap();
       setToken(access_token);
       setUser(userData);
       
@@ -96,6 +103,7 @@ export const AuthProvider = ({ children }) => {
       const { access_token, user: userData } = response.data;
       
       localStorage.setItem('token', access_token);
+      resetBootstrap();
       setToken(access_token);
       setUser(userData);
       
@@ -110,6 +118,7 @@ export const AuthProvider = ({ children }) => {
 
   const logout = () => {
     localStorage.removeItem('token');
+    resetBootstrap();
     setToken(null);
     setUser(null);
   };
@@ -12,7 +12,7 @@ if (-not $mongoProcess) {
 
 # Start backend in a new PowerShell window
 Write-Host "🐍 Starting Flask backend..." -ForegroundColor Cyan
-Start-Process powershell -ArgumentList "-NoExit", "-Command", "cd 'c:\Users\Jamai\Desktop\CSE 496 Bitirme\proje 2\backend'; .\venv\Scripts\Activate.ps1; python app.py"
+Start-Process powershell -ArgumentList "-NoExit", "-Command", "cd 'c:\Users\Jamai\Desktop\CSE 496 Bitirme\proje 2\backend'; .\venv\Scripts\Activate.ps1; python serve.py"
 
 # Wait a moment for backend to start
 Start-Sleep -Seconds 3